@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import ffmpeg
+from rich.console import Console
+from rich.table import Table
+
+try:
+    import resource
+except ImportError:
+    resource = None # Windows: peak RSS isn't reported
+
+# Progress goes to stderr so the JSON report can be piped from stdout.
+console = Console(stderr=True)
+
+# Fixture name -> (width, height, seconds). Override with --sizes WxH:SECONDS,...
+DEFAULT_FIXTURES = {
+    "360p": (640, 360, 5),
+    "720p": (1280, 720, 10),
+}
+FIXTURE_FPS = 30
+# A run is a regression when it is this much slower than the baseline.
+DEFAULT_TOLERANCE = 0.2
+
+
+def make_fixture(path, width, height, seconds, fps=FIXTURE_FPS):
+    """
+    Write a deterministic test clip: lavfi testsrc2 video with a sine tone mixed with
+    seeded pink noise, as H.264/AAC with a keyframe every two seconds.
+    """
+    video = ffmpeg.input(f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}", f='lavfi')
+    tone = ffmpeg.input(f"sine=frequency=440:sample_rate=48000:duration={seconds}", f='lavfi')
+    noise = ffmpeg.input(f"anoisesrc=color=pink:amplitude=0.1:seed=1:sample_rate=48000:duration={seconds}", f='lavfi')
+    audio = ffmpeg.filter([tone, noise], 'amix', inputs=2, duration='shortest')
+    stream = ffmpeg.output(video, audio, path, **{
+        'c:v': 'libx264', 'preset': 'ultrafast', 'crf': 23, 'pix_fmt': 'yuv420p', 'g': fps * 2,
+        'c:a': 'aac', 'b:a': '128k', 'y': None,
+    })
+    ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, quiet=True)
+    return path
+
+
+def _out(work_dir, name):
+    return os.path.join(work_dir, name)
+
+
+def _bench_batch(fixture, work_dir):
+    from peg_this.features.batch import run_batch
+    from peg_this.utils.manifest import BatchManifest
+    batch_dir = os.path.join(work_dir, "batch")
+    os.makedirs(batch_dir, exist_ok=True)
+    files = []
+    for i in range(4):
+        copy = os.path.join(batch_dir, f"clip{i}.mp4")
+        shutil.copyfile(fixture, copy)
+        files.append(copy)
+    manifest = BatchManifest(os.path.join(work_dir, "manifest.sqlite3"))
+    jobs, _ = run_batch(files, "mp4", "medium", force=True, manifest=manifest)
+    return all(job.success for job in jobs)
+
+
+def _operations():
+    """Benchmark name -> function(fixture, work_dir, width, height, seconds) returning success."""
+    from peg_this.features.audio import extract
+    from peg_this.features.convert import convert
+    from peg_this.features.crop import apply_crop
+    from peg_this.features.join import join
+    from peg_this.features.trim import trim
+
+    def convert_to(output_format, quality="medium"):
+        return lambda f, d, w, h, s: convert(f, output_format, quality, output_file=_out(d, f"out_{quality}.{output_format}"))
+
+    return {
+        "convert_mp4": convert_to("mp4"),
+        "convert_mkv_source": convert_to("mkv", "source"),
+        "convert_webm": convert_to("webm"),
+        "convert_mp3": convert_to("mp3"),
+        "convert_flac": convert_to("flac"),
+        "convert_wav": convert_to("wav"),
+        "convert_gif": convert_to("gif"),
+        "trim_fast": lambda f, d, w, h, s: trim(f, str(s / 4), str(s * 3 / 4), _out(d, "trim_fast.mp4"), mode="fast"),
+        "trim_accurate": lambda f, d, w, h, s: trim(f, str(s / 4), str(s * 3 / 4), _out(d, "trim_accurate.mp4"), mode="accurate"),
+        "crop": lambda f, d, w, h, s: apply_crop(f, w // 2, h // 2, w // 4, h // 4, _out(d, "crop.mp4")),
+        "join": lambda f, d, w, h, s: join([f, f], _out(d, "join.mp4")),
+        "extract_audio": lambda f, d, w, h, s: extract(f, "mp3", _out(d, "audio.mp3")),
+        "batch": lambda f, d, w, h, s: _bench_batch(f, d),
+    }
+
+
+def _peak_rss_mb(who):
+    """Peak resident set size in MB for RUSAGE_SELF or RUSAGE_CHILDREN."""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_one(name, fixture, width, height, seconds, result_file):
+    """Run a single benchmark in this (fresh) process and write its measurements to result_file."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_", dir=os.path.dirname(fixture))
+    try:
+        started = time.perf_counter()
+        ok = bool(_operations()[name](fixture, work_dir, width, height, seconds))
+        wall = time.perf_counter() - started
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result = {'ok': ok, 'wall_seconds': wall, 'peak_rss_mb': None, 'python_rss_mb': None, 'ffmpeg_rss_mb': None}
+    if resource:
+        # RUSAGE_CHILDREN covers every ffmpeg/ffprobe process this operation waited for.
+        result['python_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF)
+        result['ffmpeg_rss_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+        result['peak_rss_mb'] = max(result['python_rss_mb'], result['ffmpeg_rss_mb'])
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def run_benchmark(name, fixture, width, height, seconds):
+    """
+    Time one operation on a fixture in a separate Python process, so peak RSS (ours and
+    ffmpeg's) is measured for that operation alone. Returns the result dict.
+    """
+    with tempfile.NamedTemporaryFile('r', suffix='.json', delete=False) as f:
+        result_file = f.name
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    command = [sys.executable, '-m', 'peg_this.bench', '--run-one', name, fixture,
+               str(width), str(height), str(seconds), result_file]
+    try:
+        completed = subprocess.run(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        with open(result_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        result = json.loads(content) if content else {'ok': False, 'wall_seconds': None, 'peak_rss_mb': None}
+        if completed.returncode != 0:
+            result['ok'] = False
+            lines = completed.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            result['error'] = lines[-1] if lines else f"exited with code {completed.returncode}"
+    finally:
+        os.remove(result_file)
+
+    result.update(operation=name, width=width, height=height, duration=seconds)
+    wall = result.get('wall_seconds')
+    result['realtime_factor'] = round(seconds / wall, 2) if result['ok'] and wall else None
+    if wall is not None:
+        result['wall_seconds'] = round(wall, 3)
+    return result
+
+
+def _ffmpeg_version():
+    try:
+        out = subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True).stdout.decode('utf-8', errors='replace')
+        return out.splitlines()[0] if out else None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(fixtures=None, operations=None, repeat=1, keep_dir=None):
+    """
+    Generate each fixture, run every operation on it `repeat` times and return a report dict.
+    The fastest repeat of each operation is kept, which is the least noisy estimate.
+    """
+    from peg_this.utils.encoder_profile import x264_tuning
+    fixtures = fixtures or DEFAULT_FIXTURES
+    names = operations or list(_operations())
+    unknown = [n for n in names if n not in _operations()]
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+    work_dir = keep_dir or tempfile.mkdtemp(prefix="peg_this_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        for label, (width, height, seconds) in fixtures.items():
+            console.print(f"[bold cyan]Generating {label} fixture ({width}x{height}, {seconds}s)...[/bold cyan]")
+            fixture = make_fixture(os.path.join(work_dir, f"fixture_{label}.mp4"), width, height, seconds)
+            for name in names:
+                runs = [run_benchmark(name, fixture, width, height, seconds) for _ in range(repeat)]
+                ok_runs = [r for r in runs if r['ok']]
+                best = min(ok_runs, key=lambda r: r['wall_seconds']) if ok_runs else runs[-1]
+                best['fixture'] = label
+                results.append(best)
+                status = f"{best['wall_seconds']:.2f}s ({best['realtime_factor']}x realtime)" if best['ok'] else "[red]failed[/red]"
+                console.print(f"  {name:<20} {status}")
+    finally:
+        if not keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': _ffmpeg_version(),
+        'x264_tuning': x264_tuning(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return (operation, fixture, baseline seconds, current seconds) for every run slower than tolerance allows."""
+    previous = {(r['operation'], r.get('fixture')): r for r in baseline.get('results', []) if r.get('ok')}
+    regressions = []
+    for r in report['results']:
+        before = previous.get((r['operation'], r.get('fixture')))
+        if not before or not r['ok']:
+            continue
+        if r['wall_seconds'] > before['wall_seconds'] * (1 + tolerance):
+            regressions.append((r['operation'], r['fixture'], before['wall_seconds'], r['wall_seconds']))
+    return regressions
+
+
+def parse_fixtures(text):
+    """
+    Parse '640x360:5,1920x1080:20' into {'360p': (640, 360, 5), '1080p': (1920, 1080, 20)}.
+    Fixtures sharing a height are named by their full size and length instead, e.g. '480x360_5s'.
+    Raises ValueError for malformed or repeated fixtures.
+    """
+    parsed = []
+    for item in text.split(','):
+        size, _, seconds = item.strip().partition(':')
+        width, _, height = size.partition('x')
+        if not (width.isdigit() and height.isdigit()):
+            raise ValueError(f"Invalid fixture size: {item}")
+        try:
+            parsed.append((int(width), int(height), float(seconds or 10)))
+        except ValueError:
+            raise ValueError(f"Invalid fixture length: {item}")
+    heights = [height for _, height, _ in parsed]
+    fixtures = {}
+    for width, height, seconds in parsed:
+        name = f"{height}p" if heights.count(height) == 1 else f"{width}x{height}_{seconds:g}s"
+        if name in fixtures:
+            raise ValueError(f"Fixture {width}x{height}:{seconds:g} is listed more than once.")
+        fixtures[name] = (width, height, seconds)
+    return fixtures
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="peg_this bench",
+        description="Time every operation on synthetic lavfi media and report the results as JSON."
+    )
+    parser.add_argument('--sizes', help="Fixtures as WxH:SECONDS, comma-separated (default: 640x360:5,1280x720:10).")
+    parser.add_argument('--only', help="Comma-separated benchmarks to run (default: all).")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per benchmark; the fastest is reported.")
+    parser.add_argument('-o', '--output', help="Write the JSON report here instead of stdout.")
+    parser.add_argument('--baseline', help="Earlier JSON report to compare against; exits 1 on regressions.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown against the baseline, as a fraction (default: 0.2).")
+    parser.add_argument('--keep', metavar='DIR', help="Generate fixtures in DIR and keep them.")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    return parser
+
+
+def main(argv=None):
+    """Entry point for `peg_this bench`. Returns the process exit code."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ['--run-one']:
+        name, fixture, width, height, seconds, result_file = argv[1:7]
+        logging.basicConfig(level=logging.WARNING)
+        _run_one(name, fixture, int(width), int(height), float(seconds), result_file)
+        return 0
+
+    args = build_parser().parse_args(argv)
+    if args.list:
+        print("\n".join(_operations()))
+        return 0
+    try:
+        fixtures = parse_fixtures(args.sizes) if args.sizes else None
+        operations = [o.strip() for o in args.only.split(',')] if args.only else None
+        report = run_suite(fixtures, operations, max(1, args.repeat), args.keep)
+    except (ValueError, ffmpeg.Error) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return 2
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+        console.print(f"[bold green]Report written to {args.output}[/bold green]")
+    else:
+        print(output)
+
+    failed = [r for r in report['results'] if not r['ok']]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            table = Table(title="Regressions", header_style="bold red")
+            for column in ("Operation", "Fixture", "Baseline (s)", "Now (s)"):
+                table.add_column(column)
+            for operation, fixture, before, now in regressions:
+                table.add_row(operation, fixture, f"{before:.2f}", f"{now:.2f}")
+            console.print(table)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
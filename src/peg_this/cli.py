@@ -0,0 +1,645 @@
+import os
+import sys
+import glob
+import json
+import logging
+import argparse
+
+import ffmpeg
+from rich.console import Console
+
+from peg_this.features.audio import extract, strip_audio
+from peg_this.features.batch import run_batch, print_batch_summary
+from peg_this.features.calibrate import DEFAULT_PRESETS, SAMPLE_SECONDS, calibrate, print_profile
+from peg_this.features.convert import (
+    OUTPUT_FORMATS, AUDIO_FORMATS, CRF_VALUES, AUDIO_BITRATES, GIF_PALETTE_MODES,
+    convert, convert_many, parse_target, parse_targets,
+)
+from peg_this.features.crop import apply_crop, auto_crop, auto_crop_many
+from peg_this.features.join import join
+from peg_this.features.streaming import PACKAGE_FORMATS, DEFAULT_LADDER, PACKAGE_SEGMENT_SECONDS, package
+from peg_this.features.thumbnails import (
+    SELECTION_MODES, IMAGE_FORMATS, DEFAULT_COUNT, DEFAULT_COLUMNS, DEFAULT_WIDTH, SCENE_THRESHOLD, make_thumbnails
+)
+from peg_this.features.watch import STABLE_SECONDS, POLL_SECONDS, watch
+from peg_this.features.trim import TRIM_MODES, trim, trim_many, parse_ranges, load_ranges_file
+from peg_this.utils.chunked import DEFAULT_SEGMENT_SECONDS
+from peg_this.utils.encoder_profile import CALIBRATION_GOALS, load_profile
+from peg_this.utils.ffmpeg_utils import check_ffmpeg_ffprobe, probe_file
+from peg_this.utils.filter_plan import parse_size
+from peg_this.utils.loudness import LOUDNESS_TARGETS
+from peg_this.utils.scanner import scan_media, MEDIA_EXTENSIONS, VIDEO_EXTENSIONS
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+console = Console()
+
+# Exit codes for scripted runs.
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+QUALITY_CHOICES = ["source"] + list(CRF_VALUES)
+NORMALIZE_HELP = ("Normalize loudness (audio formats): ebu (-23 LUFS), podcast (-16) or streaming (-14). "
+                  "Each file is measured once; the measurement is cached.")
+
+
+class UsageError(Exception):
+    """A job or command line that can't be run as written."""
+
+
+def iter_inputs(patterns, recursive=False, include=None, exclude=None, sniff=False, extensions=MEDIA_EXTENSIONS):
+    """
+    Yield media file paths for files, directories and glob patterns, in order.
+    Directories are scanned lazily with scan_media, recursively if asked.
+    """
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            scan = scan_media(pattern, recursive=recursive, include=include, exclude=exclude, sniff=sniff, extensions=extensions)
+            for path in scan:
+                yield os.path.abspath(path)
+        elif glob.has_magic(pattern):
+            for path in sorted(p for p in glob.glob(pattern, recursive=recursive) if os.path.isfile(p)):
+                yield os.path.abspath(path)
+        elif os.path.isfile(pattern):
+            yield os.path.abspath(pattern)
+        else:
+            raise UsageError(f"Input not found: {pattern}")
+
+
+def expand_inputs(patterns, **scan_options):
+    """Expand files, directories and glob patterns into an ordered list of media file paths."""
+    return list(iter_inputs(patterns, **scan_options))
+
+
+def _single_output(params, inputs):
+    output = params.get('output')
+    if output and len(inputs) > 1:
+        raise UsageError("'output' can only be used with a single input.")
+    return output
+
+
+def _report(results):
+    """Print one line per produced file and return True if every step succeeded."""
+    ok = True
+    for file_path, output_file, error in results:
+        name = os.path.basename(file_path)
+        if output_file:
+            console.print(f"[bold green]{name} -> {output_file}[/bold green]")
+        else:
+            console.print(f"[bold red]{name}: {error or 'failed'}[/bold red]")
+            ok = False
+    return ok
+
+
+def _each_input(params, action):
+    inputs = expand_inputs(params['inputs'])
+    if not inputs:
+        raise UsageError("No input files matched.")
+    output = _single_output(params, inputs)
+    results = []
+    for file_path in inputs:
+        try:
+            results.append((file_path, action(file_path, output), None))
+        except (ValueError, ffmpeg.Error, OSError) as e:
+            results.append((file_path, None, str(e)))
+    return _report(results)
+
+
+def op_convert(params):
+    if params.get('targets'):
+        return op_convert_many(params)
+    return _each_input(params, lambda file_path, output: convert(
+        file_path,
+        params['format'],
+        quality=params.get('quality', 'medium'),
+        audio_bitrate=params.get('audio_bitrate', '192k'),
+        gif_fps=str(params.get('gif_fps', 15)),
+        gif_width=str(params.get('gif_width', 480)),
+        gif_palette=params.get('gif_palette', 'diff'),
+        output_file=output,
+        chunked=params.get('chunked', False),
+        workers=params.get('workers'),
+        segment_seconds=params.get('segment_seconds', DEFAULT_SEGMENT_SECONDS),
+        loudness=params.get('normalize'),
+    ))
+
+
+def _job_targets(params):
+    targets = params['targets']
+    try:
+        # Job files may list targets instead of writing them as one comma-separated string.
+        return [parse_target(t) for t in targets] if isinstance(targets, list) else parse_targets(targets)
+    except ValueError as e:
+        raise UsageError(str(e))
+
+
+def op_convert_many(params):
+    targets = _job_targets(params)
+    inputs = expand_inputs(params['inputs'])
+    if not inputs:
+        raise UsageError("No input files matched.")
+    results = []
+    for file_path in inputs:
+        try:
+            outputs = convert_many(file_path, targets, output_dir=params.get('output_dir'))
+            results.extend((file_path, output, None) for output in outputs)
+        except (ValueError, ffmpeg.Error, OSError) as e:
+            results.append((file_path, None, str(e)))
+    return _report(results)
+
+
+def op_trim(params):
+    if params.get('ranges') or params.get('ranges_file'):
+        return op_trim_many(params)
+    return _each_input(params, lambda file_path, output: trim(
+        file_path, params['start'], params['end'], output_file=output, mode=params.get('mode', 'fast')
+    ))
+
+
+def op_trim_many(params):
+    try:
+        if params.get('ranges_file'):
+            ranges = load_ranges_file(params['ranges_file'])
+        elif isinstance(params['ranges'], list):
+            # Job files may give ranges as a list of "start-end" strings or [start, end, name] lists.
+            lines = [",".join(str(v) for v in r) if isinstance(r, list) else str(r) for r in params['ranges']]
+            ranges = parse_ranges("\n".join(lines) + "\n")
+        else:
+            ranges = parse_ranges(params['ranges'])
+    except (OSError, ValueError) as e:
+        raise UsageError(str(e))
+
+    inputs = expand_inputs(params['inputs'])
+    if not inputs:
+        raise UsageError("No input files matched.")
+    results = []
+    for file_path in inputs:
+        try:
+            clips = trim_many(file_path, ranges, output_dir=params.get('output_dir'), mode=params.get('mode', 'fast'))
+            results.extend((file_path, clip, None) for clip in clips)
+        except (ValueError, ffmpeg.Error, OSError) as e:
+            results.append((file_path, None, str(e)))
+    return _report(results)
+
+
+def op_extract_audio(params):
+    return _each_input(params, lambda file_path, output: extract(
+        file_path, params['format'], output_file=output, loudness=params.get('normalize')
+    ))
+
+
+def op_remove_audio(params):
+    return _each_input(params, lambda file_path, output: strip_audio(file_path, output_file=output))
+
+
+def op_crop(params):
+    try:
+        size = parse_size(params['size']) if params.get('size') else None
+    except ValueError as e:
+        raise UsageError(str(e))
+    if params.get('auto'):
+        return op_auto_crop(params, size)
+    try:
+        crop_w, crop_h, crop_x, crop_y = (int(v) for v in str(params['rect']).split(':'))
+    except ValueError:
+        raise UsageError(f"Invalid crop rectangle '{params['rect']}', expected W:H:X:Y.")
+    return _each_input(params, lambda file_path, output: apply_crop(
+        file_path, crop_w, crop_h, crop_x, crop_y, output_file=output, size=size
+    ))
+
+
+def op_auto_crop(params, size):
+    if params.get('output'):
+        return _each_input(params, lambda file_path, output: auto_crop(file_path, output_file=output, size=size))
+    inputs = iter_inputs(params['inputs'], recursive=params.get('recursive', False), extensions=VIDEO_EXTENSIONS)
+    jobs, skipped = auto_crop_many(inputs, workers=params.get('workers'), size=size, output_dir=params.get('output_dir'))
+    if not jobs and not skipped:
+        raise UsageError("No video files found to crop.")
+    print_batch_summary(jobs, skipped, title="Cropping Complete")
+    return all(job.success for job in jobs)
+
+
+def op_join(params):
+    inputs = expand_inputs(params['inputs'])
+    if len(inputs) < 2:
+        raise UsageError("join needs at least two input videos.")
+    output = params.get('output', 'joined_video.mp4')
+    return _report([(inputs[0], join(inputs, output), None)])
+
+
+def _as_list(value):
+    return [value] if isinstance(value, str) else value
+
+
+def op_batch(params):
+    inputs = iter_inputs(
+        params.get('inputs') or ['.'],
+        recursive=params.get('recursive', False),
+        include=_as_list(params.get('include')),
+        exclude=_as_list(params.get('exclude')),
+        sniff=params.get('sniff', False),
+    )
+    jobs, skipped = run_batch(
+        inputs,
+        params['format'],
+        quality=params.get('quality', 'medium'),
+        workers=params.get('workers'),
+        audio_bitrate=params.get('audio_bitrate', '192k'),
+        force=params.get('force', False),
+        verify=params.get('verify', False),
+        timeout=params.get('timeout'),
+        stall_timeout=params.get('stall_timeout'),
+        loudness=params.get('normalize'),
+    )
+    if not jobs and not skipped:
+        raise UsageError("No media files found to batch convert.")
+    print_batch_summary(jobs, skipped)
+    return all(job.success for job in jobs)
+
+
+def op_watch(params):
+    folder = (_as_list(params.get('inputs')) or ['.'])[0]
+    if not os.path.isdir(folder):
+        raise UsageError(f"Not a directory: {folder}")
+    jobs = watch(
+        folder,
+        params['format'],
+        quality=params.get('quality', 'medium'),
+        workers=params.get('workers'),
+        audio_bitrate=params.get('audio_bitrate', '192k'),
+        recursive=params.get('recursive', False),
+        include=_as_list(params.get('include')),
+        exclude=_as_list(params.get('exclude')),
+        sniff=params.get('sniff', False),
+        stable_seconds=float(params.get('stable_seconds', STABLE_SECONDS)),
+        poll_seconds=float(params.get('poll_seconds', POLL_SECONDS)),
+        loudness=params.get('normalize'),
+        timeout=params.get('timeout'),
+        stall_timeout=params.get('stall_timeout'),
+    )
+    if jobs:
+        print_batch_summary(jobs, title="Watch Stopped")
+    # Conversions cut short by stopping the watcher aren't failures; they are resumed next time.
+    return not any(job.error for job in jobs)
+
+
+def op_thumbnails(params):
+    inputs = iter_inputs(
+        params['inputs'],
+        recursive=params.get('recursive', False),
+        include=_as_list(params.get('include')),
+        exclude=_as_list(params.get('exclude')),
+        extensions=VIDEO_EXTENSIONS + ['.gif'],
+    )
+    try:
+        jobs, skipped = make_thumbnails(
+            inputs,
+            workers=params.get('workers'),
+            output_dir=params.get('output_dir'),
+            image_format=params.get('image_format', 'jpg'),
+            sheet=not params.get('separate', False),
+            mode=params.get('mode', 'scene'),
+            count=int(params.get('count', DEFAULT_COUNT)),
+            columns=int(params.get('columns', DEFAULT_COLUMNS)),
+            width=int(params.get('width', DEFAULT_WIDTH)),
+            scene_threshold=float(params.get('scene_threshold', SCENE_THRESHOLD)),
+        )
+    except ValueError as e:
+        raise UsageError(str(e))
+    if not jobs and not skipped:
+        raise UsageError("No video files found to make thumbnails for.")
+    print_batch_summary(jobs, skipped, title="Thumbnails Complete")
+    return all(job.success for job in jobs)
+
+
+def op_package(params):
+    return _each_input(params, lambda file_path, output: package(
+        file_path,
+        params.get('format', 'hls'),
+        ladder=','.join(_as_list(params.get('ladder', DEFAULT_LADDER))),
+        output_dir=params.get('output_dir'),
+        segment_seconds=int(params.get('segment_seconds', PACKAGE_SEGMENT_SECONDS)),
+        copy=params.get('copy', False),
+    ))
+
+
+def op_inspect(params):
+    inputs = expand_inputs(params['inputs'])
+    info = {file_path: probe_file(file_path) for file_path in inputs}
+    print(json.dumps(info, indent=2))
+    return True
+
+
+def _int_list(value):
+    if isinstance(value, list):
+        return [int(v) for v in value]
+    return [int(v) for v in str(value).split(',') if v.strip()]
+
+
+def op_calibrate(params):
+    if params.get('show'):
+        profile = load_profile()
+        if not profile:
+            raise UsageError("This machine hasn't been calibrated yet; run 'peg_this calibrate'.")
+        print_profile(profile)
+        return True
+    presets = params.get('presets')
+    if isinstance(presets, str):
+        presets = [p.strip() for p in presets.split(',') if p.strip()]
+    try:
+        profile = calibrate(
+            sample_file=params.get('sample'),
+            seconds=float(params.get('seconds', SAMPLE_SECONDS)),
+            presets=presets,
+            thread_counts=_int_list(params['threads']) if params.get('threads') else None,
+            goal=params.get('goal', 'balanced'),
+            target_fps=params.get('target_fps'),
+        )
+    except ValueError as e:
+        raise UsageError(str(e))
+    print_profile(profile)
+    return True
+
+
+# Operation name -> (handler, required parameters). Used by subcommands and job files alike.
+OPERATIONS = {
+    'convert': (op_convert, ['inputs']),
+    'trim': (op_trim, ['inputs']),
+    'extract_audio': (op_extract_audio, ['inputs', 'format']),
+    'remove_audio': (op_remove_audio, ['inputs']),
+    'crop': (op_crop, ['inputs']),
+    'join': (op_join, ['inputs']),
+    'batch': (op_batch, ['format']),
+    'watch': (op_watch, ['format']),
+    'thumbnails': (op_thumbnails, ['inputs']),
+    'package': (op_package, ['inputs']),
+    'inspect': (op_inspect, ['inputs']),
+    'calibrate': (op_calibrate, []),
+}
+
+
+def load_job_file(path):
+    """Read a JSON or YAML job file into a list of job dicts with defaults applied."""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise UsageError("YAML job files need PyYAML: pip install pyyaml (or use a .json job file).")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if isinstance(data, list):
+        data = {'jobs': data}
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise UsageError("A job file must contain a 'jobs' list.")
+
+    defaults = data.get('defaults', {})
+    jobs = []
+    for i, job in enumerate(data['jobs'], start=1):
+        if not isinstance(job, dict):
+            raise UsageError(f"Job #{i} must be a mapping.")
+        job = {**defaults, **job}
+        # Accept a single 'input' as shorthand for 'inputs'.
+        if 'input' in job:
+            job.setdefault('inputs', [job.pop('input')])
+        if isinstance(job.get('inputs'), str):
+            job['inputs'] = [job['inputs']]
+        job['operation'] = str(job.get('operation', '')).replace('-', '_')
+        validate_job(job, f"Job #{i}")
+        jobs.append(job)
+    return jobs
+
+
+def validate_job(job, label="Job"):
+    operation = job.get('operation')
+    if operation not in OPERATIONS:
+        raise UsageError(f"{label}: unknown operation '{operation}'. Choose from: {', '.join(OPERATIONS)}.")
+    missing = [key for key in OPERATIONS[operation][1] if not job.get(key)]
+    if missing:
+        raise UsageError(f"{label} ({operation}): missing {', '.join(missing)}.")
+    if operation == 'convert' and not (job.get('format') or job.get('targets')):
+        raise UsageError(f"{label} ({operation}): give a format or a list of targets.")
+    if operation == 'convert' and job.get('targets'):
+        _job_targets(job)
+    if operation == 'crop' and not (job.get('rect') or job.get('auto')):
+        raise UsageError(f"{label} ({operation}): give a rect, or auto to detect black bars.")
+    if operation == 'trim' and not (job.get('ranges') or job.get('ranges_file')) and (job.get('start') is None or job.get('end') is None):
+        raise UsageError(f"{label} ({operation}): give start and end, or ranges / ranges_file.")
+    if operation in ('convert', 'batch', 'watch') and job.get('format') and job['format'] not in OUTPUT_FORMATS:
+        raise UsageError(f"{label} ({operation}): unsupported format '{job['format']}'.")
+    if operation == 'package' and job.get('format', 'hls') not in PACKAGE_FORMATS:
+        raise UsageError(f"{label} ({operation}): unsupported package format '{job['format']}'.")
+    if operation == 'extract_audio' and job['format'] not in AUDIO_FORMATS:
+        raise UsageError(f"{label} ({operation}): unsupported audio format '{job['format']}'.")
+    if job.get('normalize'):
+        if job['normalize'] not in LOUDNESS_TARGETS:
+            raise UsageError(f"{label} ({operation}): unknown loudness target '{job['normalize']}'.")
+        if operation not in ('convert', 'batch', 'watch', 'extract_audio') or job.get('targets') or \
+                (job.get('format') and job['format'] not in AUDIO_FORMATS):
+            raise UsageError(f"{label} ({operation}): normalize needs an audio format ({', '.join(AUDIO_FORMATS)}).")
+    if job.get('quality', 'medium') not in QUALITY_CHOICES:
+        raise UsageError(f"{label} ({operation}): unknown quality '{job['quality']}'.")
+
+
+def run_jobs(jobs, fail_fast=False):
+    """Run job dicts in order. Returns the process exit code."""
+    failed = 0
+    for i, job in enumerate(jobs, start=1):
+        console.rule(f"[bold]Job {i}/{len(jobs)}: {job['operation']}[/bold]")
+        handler = OPERATIONS[job['operation']][0]
+        try:
+            ok = handler(job)
+        except UsageError as e:
+            console.print(f"[bold red]Error: {e}[/bold red]")
+            ok = False
+        except Exception as e:
+            logging.exception(f"Job {i} ({job['operation']}) failed.")
+            console.print(f"[bold red]Job {i} failed: {e}[/bold red]")
+            ok = False
+        if not ok:
+            failed += 1
+            if fail_fast:
+                break
+    if failed:
+        console.print(f"[bold red]{failed} of {len(jobs)} job(s) failed.[/bold red]")
+        return EXIT_FAILURE
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="peg_this",
+        description="Run peg_this operations without the interactive menu. Run with no arguments for the menu."
+    )
+    subparsers = parser.add_subparsers(dest='operation', metavar='COMMAND')
+
+    def add(name, help_text, multiple_inputs=True, output=True):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('inputs', nargs='+' if multiple_inputs else 1, metavar='INPUT', help="Files, directories or glob patterns.")
+        if output:
+            sub.add_argument('-o', '--output', help="Output file (single input only).")
+        return sub
+
+    sub = add('convert', "Convert files to another format, or to several in one pass.")
+    formats = sub.add_mutually_exclusive_group(required=True)
+    formats.add_argument('-f', '--format', choices=OUTPUT_FORMATS)
+    formats.add_argument('-t', '--targets',
+                         help="Several outputs from one decode, e.g. 'mp4:high,mp4:medium:720p,webm,mp3:320k,gif'.")
+    sub.add_argument('--output-dir', help="Directory for the outputs of --targets.")
+    sub.add_argument('-q', '--quality', choices=QUALITY_CHOICES, default='medium')
+    sub.add_argument('--audio-bitrate', choices=AUDIO_BITRATES, default='192k')
+    sub.add_argument('--gif-fps', default='15')
+    sub.add_argument('--gif-width', default='480')
+    sub.add_argument('--gif-palette', choices=GIF_PALETTE_MODES, default='diff',
+                     help="palettegen stats mode: diff (default), single (per frame) or full.")
+    sub.add_argument('--chunked', action='store_true', help="Encode keyframe-aligned segments in parallel, then join them.")
+    sub.add_argument('--segment-seconds', type=int, default=DEFAULT_SEGMENT_SECONDS, help="Segment length for --chunked.")
+    sub.add_argument('-j', '--workers', type=int, help="Parallel segment encodes for --chunked (default: from CPU count).")
+    sub.add_argument('--normalize', choices=list(LOUDNESS_TARGETS), help=NORMALIZE_HELP)
+
+    sub = add('trim', "Cut a file between two timestamps, or cut many clips in one pass.")
+    sub.add_argument('--start', help="HH:MM:SS or seconds.")
+    sub.add_argument('--end', help="HH:MM:SS or seconds.")
+    sub.add_argument('--ranges', help="Several clips as 'start-end, start-end, ...'.")
+    sub.add_argument('--ranges-file', help="CSV/text file with one 'start,end[,name]' per line.")
+    sub.add_argument('--output-dir', help="Directory for clips cut with --ranges/--ranges-file.")
+    sub.add_argument('--mode', choices=list(TRIM_MODES.values()), default='fast',
+                     help="fast: lossless, snaps to keyframes; smart: frame-accurate, re-encodes only the edges; accurate: full re-encode.")
+
+    sub = add('extract-audio', "Extract the audio track.")
+    sub.add_argument('-f', '--format', required=True, choices=AUDIO_FORMATS)
+    sub.add_argument('--normalize', choices=list(LOUDNESS_TARGETS), help=NORMALIZE_HELP)
+
+    add('remove-audio', "Write a silent copy of a video.")
+
+    sub = add('crop', "Crop videos to a fixed rectangle, or remove their black bars.")
+    rect = sub.add_mutually_exclusive_group(required=True)
+    rect.add_argument('--rect', help="Crop rectangle as W:H:X:Y.")
+    rect.add_argument('--auto', action='store_true', help="Detect and remove black bars from each video.")
+    sub.add_argument('--output-dir', help="Directory for the outputs of --auto.")
+    sub.add_argument('-j', '--workers', type=int, help="Videos to crop at once with --auto (default: from CPU count).")
+    sub.add_argument('-r', '--recursive', action='store_true', help="Also crop videos in subdirectories with --auto.")
+    sub.add_argument('--size', help="Resize the cropped video: WIDTHxHEIGHT, WIDTH or xHEIGHT (keeping the aspect ratio).")
+
+    sub = subparsers.add_parser('join', help="Join videos in the given order.")
+    sub.add_argument('inputs', nargs='+', metavar='INPUT')
+    sub.add_argument('-o', '--output', default='joined_video.mp4')
+
+    sub = subparsers.add_parser('batch', help="Convert many files in parallel.")
+    sub.add_argument('inputs', nargs='*', metavar='INPUT', help="Defaults to the current directory.")
+    sub.add_argument('-f', '--format', required=True, choices=OUTPUT_FORMATS)
+    sub.add_argument('-q', '--quality', choices=QUALITY_CHOICES, default='medium')
+    sub.add_argument('--audio-bitrate', choices=AUDIO_BITRATES, default='192k')
+    sub.add_argument('-j', '--workers', type=int, help="Files to convert at once (default: from CPU count).")
+    sub.add_argument('-r', '--recursive', action='store_true', help="Also convert media in subdirectories.")
+    sub.add_argument('--include', action='append', metavar='GLOB', help="Only files matching this pattern (repeatable).")
+    sub.add_argument('--exclude', action='append', metavar='GLOB', help="Skip files and folders matching this pattern (repeatable).")
+    sub.add_argument('--sniff', action='store_true', help="Detect media by file contents, not only by extension.")
+    sub.add_argument('--force', action='store_true', help="Convert every file, even if an up-to-date output exists.")
+    sub.add_argument('--verify', action='store_true', help="Re-check output checksums before skipping up-to-date files.")
+    sub.add_argument('--timeout', type=float, metavar='SECONDS', help="Kill a conversion that takes longer than this.")
+    sub.add_argument('--stall-timeout', type=float, metavar='SECONDS',
+                     help="Kill a conversion whose progress hasn't advanced for this long.")
+    sub.add_argument('--normalize', choices=list(LOUDNESS_TARGETS), help=NORMALIZE_HELP)
+
+    sub = subparsers.add_parser('watch', help="Convert media files as they land in a folder, until stopped.")
+    sub.add_argument('inputs', nargs='?', metavar='FOLDER', help="Folder to watch (default: the current directory).")
+    sub.add_argument('-f', '--format', required=True, choices=OUTPUT_FORMATS)
+    sub.add_argument('-q', '--quality', choices=QUALITY_CHOICES, default='medium')
+    sub.add_argument('--audio-bitrate', choices=AUDIO_BITRATES, default='192k')
+    sub.add_argument('-j', '--workers', type=int, help="Files to convert at once (default: from CPU count).")
+    sub.add_argument('-r', '--recursive', action='store_true', help="Also watch subdirectories.")
+    sub.add_argument('--include', action='append', metavar='GLOB', help="Only files matching this pattern (repeatable).")
+    sub.add_argument('--exclude', action='append', metavar='GLOB', help="Skip files and folders matching this pattern (repeatable).")
+    sub.add_argument('--sniff', action='store_true', help="Detect media by file contents, not only by extension.")
+    sub.add_argument('--stable-seconds', type=float, default=STABLE_SECONDS,
+                     help="How long a file must stop growing before it is converted.")
+    sub.add_argument('--poll-seconds', type=float, default=POLL_SECONDS,
+                     help="Rescan interval when inotify isn't available (pip install peg_this[watch] on Linux).")
+    sub.add_argument('--timeout', type=float, metavar='SECONDS', help="Kill a conversion that takes longer than this.")
+    sub.add_argument('--stall-timeout', type=float, metavar='SECONDS',
+                     help="Kill a conversion whose progress hasn't advanced for this long.")
+    sub.add_argument('--normalize', choices=list(LOUDNESS_TARGETS), help=NORMALIZE_HELP)
+
+    sub = subparsers.add_parser('thumbnails', help="Make a contact sheet (or separate thumbnails) for each video, decoding it once.")
+    sub.add_argument('inputs', nargs='+', metavar='INPUT', help="Files, directories or glob patterns.")
+    sub.add_argument('-m', '--mode', choices=list(SELECTION_MODES.values()), default='scene',
+                     help="Pick frames at scene changes, the most representative frames, or even intervals.")
+    sub.add_argument('-n', '--count', type=int, default=DEFAULT_COUNT, help="Frames per file.")
+    sub.add_argument('--columns', type=int, default=DEFAULT_COLUMNS, help="Contact sheet width in frames.")
+    sub.add_argument('--width', type=int, default=DEFAULT_WIDTH, help="Width of each frame in pixels.")
+    sub.add_argument('--scene-threshold', type=float, default=SCENE_THRESHOLD, help="How much the picture must change (0-1) in scene mode.")
+    sub.add_argument('--image-format', choices=IMAGE_FORMATS, default='jpg')
+    sub.add_argument('--separate', action='store_true', help="Write numbered images instead of one contact sheet.")
+    sub.add_argument('--output-dir', help="Write images here instead of next to each video.")
+    sub.add_argument('-j', '--workers', type=int, help="Files to process at once (default: one per CPU).")
+    sub.add_argument('-r', '--recursive', action='store_true', help="Also process videos in subdirectories.")
+    sub.add_argument('--include', action='append', metavar='GLOB', help="Only files matching this pattern (repeatable).")
+    sub.add_argument('--exclude', action='append', metavar='GLOB', help="Skip files and folders matching this pattern (repeatable).")
+
+    sub = add('package', "Package videos for adaptive streaming as HLS or DASH.", output=False)
+    sub.add_argument('-f', '--format', choices=PACKAGE_FORMATS, default='hls')
+    sub.add_argument('--ladder', default=DEFAULT_LADDER,
+                     help="Renditions as HEIGHTp:BITRATEk, comma-separated. Rungs taller than the source are left out.")
+    sub.add_argument('--segment-seconds', type=int, default=PACKAGE_SEGMENT_SECONDS, help="Segment length; every rendition gets a keyframe here.")
+    sub.add_argument('--copy', action='store_true', help="Segment an H.264 source as it is, without re-encoding (one rendition).")
+    sub.add_argument('--output-dir', help="Write each <name>_hls / <name>_dash directory here instead of next to the video.")
+
+    add('inspect', "Print ffprobe information as JSON.", output=False)
+
+    sub = subparsers.add_parser('calibrate', help="Benchmark libx264 presets and thread counts and save the fastest fit for this machine.")
+    sub.add_argument('--sample', help="Media file to benchmark with (default: a synthetic 720p test pattern).")
+    sub.add_argument('--seconds', type=float, default=SAMPLE_SECONDS, help="Length of the sample to encode.")
+    sub.add_argument('--presets', help=f"Comma-separated x264 presets (default: {','.join(DEFAULT_PRESETS)}).")
+    sub.add_argument('--threads', help="Comma-separated thread counts (default: powers of two up to the CPU count).")
+    sub.add_argument('--goal', choices=CALIBRATION_GOALS, default='balanced',
+                     help="speed: fastest preset; quality: best compression; balanced: best compression at half the top speed or better.")
+    sub.add_argument('--target-fps', type=float, help="Use the slowest preset that still encodes at least this fast.")
+    sub.add_argument('--show', action='store_true', help="Print the saved profile instead of calibrating.")
+
+    # Listed for --help only; main() hands everything after 'bench' to peg_this.bench.
+    subparsers.add_parser('bench', help="Benchmark every operation on synthetic media (see 'peg_this bench --help').", add_help=False)
+
+    sub = subparsers.add_parser('run', help="Run the jobs listed in a JSON or YAML job file.")
+    sub.add_argument('job_file')
+    sub.add_argument('--fail-fast', action='store_true', help="Stop at the first failed job.")
+
+    return parser
+
+
+def main(argv=None):
+    """Entry point for non-interactive use. Returns the process exit code."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ['bench']:
+        from peg_this.bench import main as bench_main
+        check_ffmpeg_ffprobe()
+        return bench_main(argv[1:])
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.operation:
+        parser.print_help()
+        return EXIT_USAGE
+
+    check_ffmpeg_ffprobe()
+    try:
+        if args.operation == 'run':
+            jobs = load_job_file(args.job_file)
+            return run_jobs(jobs, fail_fast=args.fail_fast)
+
+        job = {k: v for k, v in vars(args).items() if v is not None}
+        job['operation'] = args.operation.replace('-', '_')
+        validate_job(job, "Command")
+        return run_jobs([job])
+    except (UsageError, OSError, ValueError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        logging.info("Operation cancelled by user.")
+        console.print("[bold]Operation cancelled.[/bold]")
+        return EXIT_INTERRUPTED
@@ -1,15 +1,52 @@
-
 from pathlib import Path
 
 import ffmpeg
 import questionary
 from rich.console import Console
 
+from peg_this.features.convert import AUDIO_CODECS, ask_loudness
 from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream
+from peg_this.utils.loudness import LOUDNESS_TARGETS, normalize_audio
 
 console = Console()
 
 
+def extract(file_path, audio_format, output_file=None, loudness=None):
+    """
+    Extract the audio track without prompting. Returns the output path, or None if ffmpeg failed.
+    `loudness` normalizes it to one of LOUDNESS_TARGETS, measuring the file first unless that's cached.
+    Raises ValueError if the file has no audio or the format or loudness target is unsupported.
+    """
+    if audio_format not in AUDIO_CODECS:
+        raise ValueError(f"Unsupported audio format: {audio_format}")
+    if loudness and loudness not in LOUDNESS_TARGETS:
+        raise ValueError(f"Unknown loudness target: {loudness}")
+    if not has_audio_stream(file_path):
+        raise ValueError("No audio stream found in the file.")
+
+    output_file = output_file or f"{Path(file_path).stem}_audio.{audio_format}"
+    if loudness:
+        console.print("Measuring loudness...")
+        audio, audio_kwargs = normalize_audio(ffmpeg.input(file_path)['a:0'], file_path, loudness)
+        stream = audio.output(output_file, vn=None, acodec=AUDIO_CODECS[audio_format], y=None, **audio_kwargs)
+    else:
+        stream = ffmpeg.input(file_path).output(output_file, vn=None, acodec=AUDIO_CODECS[audio_format], y=None)
+
+    if run_command(stream, f"Extracting audio to {audio_format.upper()}...", show_progress=True):
+        return output_file
+    return None
+
+
+def strip_audio(file_path, output_file=None):
+    """Write a silent copy of the video without prompting. Returns the output path or None."""
+    output_file = output_file or f"{Path(file_path).stem}_no_audio{Path(file_path).suffix}"
+    stream = ffmpeg.input(file_path).output(output_file, vcodec='copy', an=None, y=None)
+
+    if run_command(stream, "Removing audio track...", show_progress=True):
+        return output_file
+    return None
+
+
 def extract_audio(file_path):
     """Extract the audio track from a video file."""
     if not has_audio_stream(file_path):
@@ -17,22 +54,31 @@ def extract_audio(file_path):
         questionary.press_any_key_to_continue().ask()
         return
 
-    audio_format = questionary.select("Select audio format:", choices=["mp3", "flac", "wav"], use_indicator=True).ask()
+    audio_format = questionary.select("Select audio format:", choices=list(AUDIO_CODECS), use_indicator=True).ask()
     if not audio_format: return
 
-    output_file = f"{Path(file_path).stem}_audio.{audio_format}"
-    stream = ffmpeg.input(file_path).output(output_file, vn=None, acodec='libmp3lame' if audio_format == 'mp3' else audio_format, y=None)
-    
-    run_command(stream, f"Extracting audio to {audio_format.upper()}...", show_progress=True)
-    console.print(f"[bold green]Successfully extracted audio to {output_file}[/bold green]")
+    loudness = ask_loudness()
+    if loudness is None: return
+
+    try:
+        output_file = extract(file_path, audio_format, loudness=loudness)
+    except (ffmpeg.Error, ValueError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        questionary.press_any_key_to_continue().ask()
+        return
+
+    if output_file:
+        console.print(f"[bold green]Successfully extracted audio to {output_file}[/bold green]")
+    else:
+        console.print("[bold red]Failed to extract audio.[/bold red]")
     questionary.press_any_key_to_continue().ask()
 
 
 def remove_audio(file_path):
     """Create a silent version of a video."""
-    output_file = f"{Path(file_path).stem}_no_audio{Path(file_path).suffix}"
-    stream = ffmpeg.input(file_path).output(output_file, vcodec='copy', an=None, y=None)
-    
-    run_command(stream, "Removing audio track...", show_progress=True)
-    console.print(f"[bold green]Successfully removed audio, saved to {output_file}[/bold green]")
+    output_file = strip_audio(file_path)
+    if output_file:
+        console.print(f"[bold green]Successfully removed audio, saved to {output_file}[/bold green]")
+    else:
+        console.print("[bold red]Failed to remove audio.[/bold red]")
     questionary.press_any_key_to_continue().ask()
@@ -1,44 +1,72 @@
-
 import os
 import logging
+import itertools
 from pathlib import Path
 
-import ffmpeg
 import questionary
 from rich.console import Console
+from rich.table import Table
 
-from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream
-from peg_this.utils.ui_utils import get_media_files
+from peg_this.features.convert import (
+    OUTPUT_FORMATS, VIDEO_FORMATS, AUDIO_FORMATS, QUALITY_PRESETS, build_convert_stream, ask_loudness
+)
+from peg_this.utils.ffmpeg_utils import has_audio_stream
+from peg_this.utils.scheduler import Job, JobScheduler, default_worker_count, threads_per_worker
+from peg_this.utils.manifest import BatchManifest, partial_name, is_partial
+from peg_this.utils.scanner import scan_media
 
 console = Console()
 
+UP_TO_DATE = "Already converted and up to date"
+
 
 def batch_convert():
     """Convert all media files in the directory to a specific format."""
-    media_files = get_media_files()
-    if not media_files:
+    recursive = questionary.confirm("Include media files in subfolders?", default=False).ask()
+    if recursive is None: return
+
+    # The scan runs lazily alongside the conversions; just make sure there is something to convert.
+    media_files = scan_media('.', recursive=recursive)
+    first_file = next(media_files, None)
+    if first_file is None:
         console.print("[bold yellow]No media files found in the current directory.[/bold yellow]")
         questionary.press_any_key_to_continue().ask()
         return
+    media_files = itertools.chain([first_file], media_files)
 
     output_format = questionary.select(
         "Select output format for the batch conversion:",
-        choices=["mp4", "mkv", "mov", "avi", "webm", "mp3", "flac", "wav", "gif"],
+        choices=OUTPUT_FORMATS,
         use_indicator=True
     ).ask()
     if not output_format: return
 
-    quality_preset = None
-    if output_format in ["mp4", "mkv", "mov", "avi", "webm"]:
+    quality = None
+    if output_format in VIDEO_FORMATS:
         quality_preset = questionary.select(
             "Select quality preset:",
-            choices=["Same as source", "High (CRF 18)", "Medium (CRF 23)", "Low (CRF 28)"],
+            choices=list(QUALITY_PRESETS),
             use_indicator=True
         ).ask()
         if not quality_preset: return
+        quality = QUALITY_PRESETS[quality_preset]
+
+    loudness = None
+    if output_format in AUDIO_FORMATS:
+        loudness = ask_loudness()
+        if loudness is None: return
+
+    workers = questionary.text(
+        "Number of files to convert in parallel:",
+        default=str(default_batch_workers(output_format, quality)),
+        validate=lambda text: text.isdigit() and int(text) > 0 or "Please enter a positive whole number."
+    ).ask()
+    if not workers: return
+    workers = int(workers)
 
+    where = "the current directory and its subfolders" if recursive else "the current directory"
     confirm = questionary.confirm(
-        f"This will convert {len(media_files)} file(s) in the current directory to .{output_format}. Continue?",
+        f"This will convert every media file in {where} to .{output_format}. Continue?",
         default=False
     ).ask()
 
@@ -46,80 +74,142 @@ def batch_convert():
         console.print("[bold yellow]Batch conversion cancelled.[/bold yellow]")
         return
 
-    success_count = 0
-    fail_count = 0
-
-    for file in media_files:
-        console.rule(f"Processing: {file}")
-        file_path = os.path.abspath(file)
-        is_gif = Path(file_path).suffix.lower() == '.gif'
-        has_audio = has_audio_stream(file_path)
+    try:
+        jobs, skipped = run_batch(media_files, output_format, quality or "medium", workers, loudness=loudness)
+    except KeyboardInterrupt:
+        console.print("[bold yellow]Batch conversion cancelled. Running conversions were stopped.[/bold yellow]")
+        logging.info("Batch conversion cancelled by user.")
+        return
 
-        if (is_gif or not has_audio) and output_format in ["mp3", "flac", "wav"]:
-            console.print(f"[bold yellow]Skipping {file}: Source has no audio to convert.[/bold yellow]")
-            continue
+    print_batch_summary(jobs, skipped)
+    questionary.press_any_key_to_continue().ask()
 
-        output_file = f"{Path(file_path).stem}_batch.{output_format}"
-        input_stream = ffmpeg.input(file_path)
-        output_stream = None
-        kwargs = {'y': None}
 
+def default_batch_workers(output_format, quality=None):
+    """Suggested parallelism: x264 encodes share the CPUs, copies and audio encodes get one each."""
+    if output_format in VIDEO_FORMATS and quality != "source":
+        return default_worker_count()
+    return default_worker_count(1)
+
+
+def run_batch(files, output_format, quality="medium", workers=None, audio_bitrate="192k", force=False, verify=False,
+              manifest=None, timeout=None, stall_timeout=None, loudness=None):
+    """
+    Convert many files without prompting, `workers` at a time.
+    `files` may be a lazy iterable (see scan_media); conversions start as soon as the first files arrive.
+    Outputs recorded in the batch manifest as converted from the same, unchanged source with the
+    same settings are skipped unless `force` is set; `verify` also re-checks their checksums.
+    `timeout` and `stall_timeout` (seconds) kill a conversion that runs too long or stops making progress.
+    `loudness` normalizes audio outputs to one of LOUDNESS_TARGETS. Each file is measured as its job
+    is queued, while the earlier jobs encode; measurements are cached, so a re-run or a batch to
+    another format doesn't measure again.
+    Returns (jobs, skipped) where each job records success or the error it hit, and
+    skipped holds (file, reason) pairs.
+    """
+    workers = workers or default_batch_workers(output_format, quality)
+    threads = threads_per_worker(workers)
+    manifest = manifest or BatchManifest()
+    settings = batch_settings(output_format, quality, audio_bitrate, loudness)
+    jobs = []
+    skipped = []
+    outputs = set()
+
+    def runnable_jobs():
+        for file in files:
+            # A scan of the tree we're writing into turns up batch outputs from this and earlier
+            # runs, and partial files from an interrupted run; none of them are inputs.
+            if os.path.abspath(file) in outputs or is_partial(file) or manifest.is_output(file):
+                continue
+            output_file = batch_output_name(os.path.abspath(file), output_format)
+            if not force and manifest.is_up_to_date(file, output_file, settings, verify=verify):
+                skipped.append((file, UP_TO_DATE))
+                continue
+            try:
+                job = build_batch_job(os.path.abspath(file), output_format, quality, threads, audio_bitrate, manifest, loudness)
+            except Exception as e:
+                console.print(f"[bold red]An unexpected error occurred while preparing {file}: {e}[/bold red]")
+                logging.error(f"Batch convert error for file {file}: {e}")
+                job = Job(file, [])
+                job.error = str(e)
+            if job is None:
+                console.print(f"[bold yellow]Skipping {file}: Source has no audio to convert.[/bold yellow]")
+                skipped.append((file, "Source has no audio to convert"))
+                continue
+            jobs.append(job)
+            if job.stream_specs:
+                outputs.add(os.path.abspath(job.output_file))
+                yield job
+
+    scheduler = JobScheduler(workers, timeout=timeout, stall_timeout=stall_timeout)
+    scheduler.run(runnable_jobs(), f"Converting with {workers} worker(s)...")
+    return jobs, skipped
+
+
+def batch_settings(output_format, quality="medium", audio_bitrate="192k", loudness=None):
+    """The options that decide what a batch output looks like, as recorded in the manifest."""
+    settings = {'format': output_format, 'quality': quality, 'audio_bitrate': audio_bitrate}
+    if loudness:
+        # Only when set, so outputs recorded before normalization existed stay up to date.
+        settings['loudness'] = loudness
+    return settings
+
+
+def batch_output_name(file_path, output_format):
+    return os.path.join(os.path.dirname(file_path), f"{Path(file_path).stem}_batch.{output_format}")
+
+
+def build_batch_job(file_path, output_format, quality="medium", threads=None, audio_bitrate="192k", manifest=None,
+                    loudness=None):
+    """
+    Build the scheduler Job converting one file, or None if the file should be skipped.
+    The output is written under a temporary name and renamed when complete, then recorded in `manifest`.
+    """
+    is_gif = Path(file_path).suffix.lower() == '.gif'
+    if (is_gif or not has_audio_stream(file_path)) and output_format in AUDIO_FORMATS:
+        return None
+
+    output_file = batch_output_name(file_path, output_format)
+    temp_file = partial_name(output_file)
+    stream_spec = build_convert_stream(
+        file_path, output_format, temp_file, quality, audio_bitrate, threads=threads, loudness=loudness
+    )
+
+    def record(job):
         try:
-            if output_format in ["mp4", "mkv", "mov", "avi", "webm"]:
-                if quality_preset == "Same as source":
-                    kwargs['c'] = 'copy'
-                else:
-                    crf = quality_preset.split(" ")[-1][1:-1]
-                    kwargs['c:v'] = 'libx264'
-                    kwargs['crf'] = crf
-                    kwargs['pix_fmt'] = 'yuv420p'
-                    if has_audio:
-                        kwargs['c:a'] = 'aac'
-                        kwargs['b:a'] = '192k'
-                    else:
-                        kwargs['an'] = None
-                output_stream = input_stream.output(output_file, **kwargs)
-
-            elif output_format in ["mp3", "flac", "wav"]:
-                kwargs['vn'] = None
-                kwargs['c:a'] = 'libmp3lame' if output_format == 'mp3' else output_format
-                if output_format == 'mp3':
-                    kwargs['b:a'] = '192k' # Default bitrate for batch
-                output_stream = input_stream.output(output_file, **kwargs)
-
-            elif output_format == "gif":
-                fps = "15"
-                scale = "480"
-                palette_file = f"palette_{Path(file_path).stem}.png"
-                
-                palette_gen_stream = input_stream.video.filter('fps', fps=fps).filter('scale', w=scale, h=-1, flags='lanczos').filter('palettegen')
-                run_command(palette_gen_stream.output(palette_file, y=None), f"Generating palette for {file}...")
-
-                if not os.path.exists(palette_file):
-                    console.print(f"[bold red]Failed to generate color palette for {file}.[/bold red]")
-                    fail_count += 1
-                    continue
-
-                palette_input = ffmpeg.input(palette_file)
-                video_stream = input_stream.video.filter('fps', fps=fps).filter('scale', w=scale, h=-1, flags='lanczos')
-                final_stream = ffmpeg.filter([video_stream, palette_input], 'paletteuse')
-                output_stream = final_stream.output(output_file, y=None)
-
-            if output_stream and run_command(output_stream, f"Converting {file}...", show_progress=True):
-                console.print(f"  -> [bold green]Successfully converted to {output_file}[/bold green]")
-                success_count += 1
-            else:
-                console.print(f"  -> [bold red]Failed to convert {file}.[/bold red]")
-                fail_count += 1
-
-            if output_format == "gif" and os.path.exists(f"palette_{Path(file_path).stem}.png"):
-                os.remove(f"palette_{Path(file_path).stem}.png")
-
-        except Exception as e:
-            console.print(f"[bold red]An unexpected error occurred while processing {file}: {e}[/bold red]")
-            logging.error(f"Batch convert error for file {file}: {e}")
-            fail_count += 1
-
-    console.rule("[bold green]Batch Conversion Complete[/bold green]")
-    console.print(f"Successful: {success_count} | Failed: {fail_count}")
-    questionary.press_any_key_to_continue().ask()
+            manifest.record(job.source_file, job.output_file, batch_settings(output_format, quality, audio_bitrate, loudness))
+        except OSError as e:
+            logging.warning(f"Could not record {job.output_file} in the batch manifest: {e}")
+
+    return Job(
+        os.path.relpath(file_path), [stream_spec], source_file=file_path, output_file=output_file,
+        temp_file=temp_file, on_success=record if manifest else None
+    )
+
+
+def print_batch_summary(jobs, skipped=(), title="Batch Conversion Complete"):
+    """Print a per-file table of batch results followed by the totals."""
+    table = Table(title="Batch Results", show_header=True, header_style="bold magenta")
+    table.add_column("File")
+    table.add_column("Status")
+    table.add_column("Details")
+
+    for job in jobs:
+        if job.success:
+            table.add_row(job.name, "[bold green]OK[/bold green]", os.path.relpath(job.output_file))
+        else:
+            table.add_row(job.name, "[bold red]Failed[/bold red]", job.error or "Not run")
+    # Up-to-date files are only counted; on a resumed run there can be thousands of them.
+    up_to_date = sum(1 for _, reason in skipped if reason == UP_TO_DATE)
+    for file, reason in skipped:
+        if reason != UP_TO_DATE:
+            table.add_row(os.path.relpath(file), "[bold yellow]Skipped[/bold yellow]", reason)
+
+    success_count = sum(1 for job in jobs if job.success)
+    fail_count = len(jobs) - success_count
+
+    console.rule(f"[bold green]{title}[/bold green]")
+    if table.row_count:
+        console.print(table)
+    console.print(
+        f"Successful: {success_count} | Failed: {fail_count} | Up to date: {up_to_date} | Skipped: {len(skipped) - up_to_date}"
+    )
@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import shutil
+import logging
+import platform
+import tempfile
+from datetime import datetime
+
+import ffmpeg
+import questionary
+from rich.console import Console
+from rich.table import Table
+from rich.progress import Progress
+
+from peg_this.utils.encoder_profile import (
+    X264_PRESETS, CALIBRATION_GOALS, choose_settings, save_profile, load_profile, profile_path
+)
+from peg_this.utils.ffmpeg_utils import run_ffmpeg_process, progress_columns
+
+console = Console()
+
+DEFAULT_PRESETS = ["ultrafast", "veryfast", "faster", "fast", "medium", "slow"]
+SAMPLE_SECONDS = 5
+SAMPLE_SOURCE = "testsrc2=size=1280x720:rate=30"
+CALIBRATION_CRF = 23
+
+SSIM_RE = re.compile(r"SSIM .*All:([\d.]+)")
+PSNR_RE = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+
+def default_thread_counts():
+    """1, 2, 4, 8... up to the number of CPUs, plus the CPU count itself."""
+    cpu_count = os.cpu_count() or 1
+    counts = {cpu_count}
+    n = 1
+    while n < cpu_count:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def _sample_input(sample_file, seconds):
+    if sample_file:
+        return ffmpeg.input(sample_file, t=seconds)
+    return ffmpeg.input(f"{SAMPLE_SOURCE}:duration={seconds}", f='lavfi')
+
+
+def _time_encode(sample_file, seconds, preset, threads, output_file):
+    """Encode the sample once. Returns (frames per second of wall time, output size in bytes)."""
+    stream = _sample_input(sample_file, seconds).video.output(
+        output_file, an=None, y=None,
+        **{'c:v': 'libx264', 'crf': CALIBRATION_CRF, 'preset': preset, 'threads': threads, 'pix_fmt': 'yuv420p'}
+    )
+    last = {}
+    started = time.monotonic()
+    returncode, stderr_tail = run_ffmpeg_process(['ffmpeg'] + stream.get_args(), duration=seconds, on_progress=last.update)
+    elapsed = time.monotonic() - started
+    if returncode != 0:
+        raise RuntimeError(stderr_tail[-1] if stderr_tail else f"ffmpeg exited with code {returncode}")
+    return (last.get('frame') or 0) / elapsed, os.path.getsize(output_file)
+
+
+def _measure_quality(sample_file, seconds, encoded_file):
+    """PSNR (dB) and SSIM of an encode against the sample it was made from."""
+    encoded = ffmpeg.input(encoded_file).video.split()
+    reference = _sample_input(sample_file, seconds).video.split()
+    ssim = ffmpeg.filter([encoded[0], reference[0]], 'ssim').output('-', f='null')
+    psnr = ffmpeg.filter([encoded[1], reference[1]], 'psnr').output('-', f='null')
+    returncode, stderr_tail = run_ffmpeg_process(['ffmpeg'] + ffmpeg.merge_outputs(ssim, psnr).get_args())
+    log = "\n".join(stderr_tail)
+    ssim_match, psnr_match = SSIM_RE.search(log), PSNR_RE.search(log)
+    if returncode != 0 or not ssim_match or not psnr_match:
+        logging.warning(f"Could not measure quality of {encoded_file}:\n{log}")
+        return None, None
+    return float(psnr_match.group(1)), float(ssim_match.group(1))
+
+
+def calibrate(sample_file=None, seconds=SAMPLE_SECONDS, presets=None, thread_counts=None, goal="balanced",
+              target_fps=None, save=True):
+    """
+    Benchmark libx264 on this machine: encode a short sample with every preset and thread count,
+    recording speed and output size, and PSNR/SSIM once per preset. The sample is a synthetic
+    720p test pattern unless `sample_file` is given. The chosen settings (see choose_settings)
+    are stored as this host's profile and used by later encodes. Returns the profile.
+    """
+    presets = presets or DEFAULT_PRESETS
+    unknown = [p for p in presets if p not in X264_PRESETS]
+    if unknown:
+        raise ValueError(f"Unknown x264 preset(s): {', '.join(unknown)}")
+    thread_counts = thread_counts or default_thread_counts()
+
+    work_dir = tempfile.mkdtemp(prefix="peg_this_calibrate_")
+    results = []
+    try:
+        with Progress(*progress_columns(), console=console) as progress:
+            task = progress.add_task("Calibrating libx264...", total=len(presets) * len(thread_counts), stats="")
+            for preset in presets:
+                output_file = os.path.join(work_dir, f"{preset}.mp4")
+                for threads in thread_counts:
+                    progress.update(task, stats=f"preset={preset} threads={threads}")
+                    fps, size = _time_encode(sample_file, seconds, preset, threads, output_file)
+                    results.append({'preset': preset, 'threads': threads, 'fps': round(fps, 2), 'size': size})
+                    progress.advance(task)
+                # Threads barely change x264's output, so quality is measured once per preset.
+                psnr, ssim = _measure_quality(sample_file, seconds, output_file)
+                for result in results:
+                    if result['preset'] == preset:
+                        result.update(psnr=psnr, ssim=ssim)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    profile = {
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'sample': sample_file or SAMPLE_SOURCE,
+        'sample_seconds': seconds,
+        'crf': CALIBRATION_CRF,
+        'goal': goal,
+        'target_fps': target_fps,
+        'results': results,
+        'choice': choose_settings(results, goal, target_fps),
+    }
+    if save:
+        save_profile(profile)
+        logging.info(f"Saved encoder profile to {profile_path()}: {profile['choice']}")
+    return profile
+
+
+def print_profile(profile):
+    """Show calibration results as a table, with the chosen settings highlighted."""
+    table = Table(title=f"libx264 on {profile.get('host', 'this machine')}", show_header=True, header_style="bold magenta")
+    for column in ("Preset", "Threads", "FPS", "Size (KB)", "PSNR (dB)", "SSIM"):
+        table.add_column(column)
+    choice = profile.get('choice', {})
+    for r in profile.get('results', []):
+        chosen = r['preset'] == choice.get('preset') and r['threads'] == choice.get('threads')
+        style = "bold green" if chosen else None
+        table.add_row(
+            r['preset'], str(r['threads']), f"{r['fps']:.1f}", f"{r['size'] / 1024:.0f}",
+            f"{r['psnr']:.2f}" if r.get('psnr') is not None else "N/A",
+            f"{r['ssim']:.4f}" if r.get('ssim') is not None else "N/A",
+            style=style,
+        )
+    console.print(table)
+    console.print(f"Encodes will use preset [bold]{choice.get('preset')}[/bold] with [bold]{choice.get('threads')}[/bold] thread(s).")
+
+
+def calibrate_encoder():
+    """Interactively benchmark the encoder and save a profile for this machine."""
+    profile = load_profile()
+    if profile:
+        console.print(f"This machine was calibrated on {profile.get('created', 'an earlier run')}.")
+        print_profile(profile)
+
+    goal = questionary.select(
+        "What should encodes favour?",
+        choices=CALIBRATION_GOALS,
+        use_indicator=True
+    ).ask()
+    if not goal: return
+
+    confirm = questionary.confirm(
+        f"Encode a {SAMPLE_SECONDS}s test clip with {len(DEFAULT_PRESETS)} presets and "
+        f"{len(default_thread_counts())} thread counts? This can take a few minutes.",
+        default=True
+    ).ask()
+    if not confirm: return
+
+    try:
+        profile = calibrate(goal=goal)
+    except (RuntimeError, ValueError) as e:
+        console.print(f"[bold red]Calibration failed: {e}[/bold red]")
+    else:
+        print_profile(profile)
+        console.print(f"[bold green]Saved to {profile_path()}[/bold green]")
+    questionary.press_any_key_to_continue().ask()
@@ -1,93 +1,519 @@
-
 import os
+import logging
 from pathlib import Path
 
 import ffmpeg
 import questionary
 from rich.console import Console
 
-from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream
+from peg_this.utils.chunked import chunked_encode, CHUNKING_MIN_DURATION, DEFAULT_SEGMENT_SECONDS
+from peg_this.utils.encoder_profile import x264_tuning
+from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream, probe_file, get_duration
+from peg_this.utils.filter_plan import FilterPlan
+from peg_this.utils.loudness import LOUDNESS_TARGETS, LOUDNESS_CHOICES, normalize_audio
 
 console = Console()
 
+VIDEO_FORMATS = ["mp4", "mkv", "mov", "avi", "webm"]
+AUDIO_FORMATS = ["mp3", "flac", "wav"]
+OUTPUT_FORMATS = VIDEO_FORMATS + AUDIO_FORMATS + ["gif"]
 
-def convert_file(file_path):
-    """Convert the file to a different format."""
-    is_gif = Path(file_path).suffix.lower() == '.gif'
-    has_audio = has_audio_stream(file_path)
+# Menu labels for the quality presets and the names used by the CLI and job files.
+QUALITY_PRESETS = {
+    "Same as source (remux, re-encode only what doesn't fit)": "source",
+    "High (CRF 18)": "high",
+    "Medium (CRF 23)": "medium",
+    "Low (CRF 28)": "low",
+}
+CRF_VALUES = {"high": "18", "medium": "23", "low": "28"}
+AUDIO_BITRATES = ["128k", "192k", "256k", "320k"]
+AUDIO_CODECS = {"mp3": "libmp3lame", "flac": "flac", "wav": "pcm_s16le"}
+GIF_PALETTE_CHOICES = {
+    "Adaptive (best for screen recordings)": "diff",
+    "Per frame (best for scene changes)": "single",
+    "Global (one palette for the whole clip)": "full",
+}
+GIF_PALETTE_MODES = list(GIF_PALETTE_CHOICES.values())
+MULTIPLE_FORMATS_CHOICE = "Several formats at once..."
 
-    output_format = questionary.select("Select the output format:", choices=["mp4", "mkv", "mov", "avi", "webm", "mp3", "flac", "wav", "gif"], use_indicator=True).ask()
-    if not output_format: return
+# Encoders used when a video container needs re-encoding; WebM can't carry H.264/AAC.
+VIDEO_ENCODERS = {"webm": "libvpx-vp9"}
+AUDIO_ENCODERS = {"webm": "libopus"}
 
-    if (is_gif or not has_audio) and output_format in ["mp3", "flac", "wav"]:
-        console.print("[bold red]Error: Source has no audio to convert.[/bold red]")
-        questionary.press_any_key_to_continue().ask()
-        return
+# ffprobe profile names mapped to libx264's -profile:v values.
+H264_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high"}
 
-    output_file = f"{Path(file_path).stem}_converted.{output_format}"
-    
-    input_stream = ffmpeg.input(file_path)
-    output_stream = None
-    kwargs = {'y': None}
+# Codecs each container can take as-is, as (video, audio). None means anything ffmpeg can mux.
+COPY_COMPATIBLE = {
+    "mp4": ({"h264", "hevc", "mpeg4", "av1"}, {"aac", "mp3", "ac3", "eac3", "alac"}),
+    "mov": ({"h264", "hevc", "mpeg4", "prores", "mjpeg"}, {"aac", "mp3", "alac", "pcm_s16le", "pcm_s24le"}),
+    "mkv": (None, None),
+    "webm": ({"vp8", "vp9", "av1"}, {"vorbis", "opus"}),
+    "avi": ({"mpeg4", "h264", "mjpeg", "msmpeg4v3"}, {"mp3", "ac3", "pcm_s16le"}),
+    "mp3": (set(), {"mp3"}),
+    "flac": (set(), {"flac"}),
+    "wav": (set(), {"pcm_s16le"}),
+}
 
-    if output_format in ["mp4", "mkv", "mov", "avi", "webm"]:
-        quality = questionary.select("Select quality preset:", choices=["Same as source", "High (CRF 18)", "Medium (CRF 23)", "Low (CRF 28)"], use_indicator=True).ask()
-        if not quality: return
 
-        if quality == "Same as source":
+def build_output_kwargs(output_format, quality="medium", has_audio=True, audio_bitrate="192k", threads=None):
+    """ffmpeg output options for converting to a video or audio format with the given preset."""
+    kwargs = {'y': None}
+    if output_format in VIDEO_FORMATS:
+        if quality == "source":
             kwargs['c'] = 'copy'
         else:
-            crf = quality.split(" ")[-1][1:-1]
-            kwargs['c:v'] = 'libx264'
-            kwargs['crf'] = crf
-            kwargs['pix_fmt'] = 'yuv420p'
+            kwargs.update(video_encode_kwargs(output_format, quality, threads))
             if has_audio:
-                kwargs['c:a'] = 'aac'
+                kwargs['c:a'] = AUDIO_ENCODERS.get(output_format, 'aac')
                 kwargs['b:a'] = '192k'
             else:
                 kwargs['an'] = None
-        output_stream = input_stream.output(output_file, **kwargs)
-
-    elif output_format in ["mp3", "flac", "wav"]:
+    elif output_format in AUDIO_FORMATS:
         kwargs['vn'] = None
+        kwargs['c:a'] = AUDIO_CODECS[output_format]
         if output_format == 'mp3':
-            bitrate = questionary.select("Select audio bitrate:", choices=["128k", "192k", "256k", "320k"]).ask()
-            if not bitrate: return
-            kwargs['c:a'] = 'libmp3lame'
-            kwargs['b:a'] = bitrate
+            kwargs['b:a'] = audio_bitrate
+    return kwargs
+
+
+def video_encode_kwargs(output_format, quality="medium", threads=None, stream_index=None):
+    """Encoder options for re-encoding video into output_format at a CRF preset."""
+    suffix = f":{stream_index}" if stream_index is not None else ""
+    kwargs = {
+        f'c:v{suffix}': VIDEO_ENCODERS.get(output_format, 'libx264'),
+        'crf': CRF_VALUES[quality],
+        'pix_fmt': 'yuv420p',
+    }
+    if output_format == "webm":
+        kwargs[f'b:v{suffix}'] = 0 # libvpx only honours CRF as a pure quality target with b:v 0
+    else:
+        # Preset and thread count measured by `peg_this calibrate`, if it has been run.
+        tuning = x264_tuning()
+        if 'preset' in tuning:
+            kwargs[f'preset{suffix}'] = tuning['preset']
+        threads = threads or tuning.get('threads')
+    if threads:
+        kwargs['threads'] = threads
+    return kwargs
+
+
+def matching_h264_kwargs(video_info, crf=18):
+    """
+    libx264 options that reproduce an existing H.264 stream's profile, level and pixel
+    format, so newly encoded pieces can be stream-copied next to the original packets.
+    """
+    kwargs = {'c:v': 'libx264', 'crf': crf, 'pix_fmt': video_info.get('pix_fmt', 'yuv420p'), **x264_tuning()}
+    if video_info.get('profile') in H264_PROFILES:
+        kwargs['profile:v'] = H264_PROFILES[video_info['profile']]
+    if video_info.get('level', 0) > 0:
+        kwargs['level'] = f"{video_info['level'] / 10:.1f}"
+    return kwargs
+
+
+def plan_streams(probe, output_format):
+    """
+    Decide per stream whether it can be remuxed into output_format or must be re-encoded.
+    Returns a list of dicts with the stream's type, its index among input streams of that type,
+    its codec and the action ('copy' or 'encode'). Cover art and data streams are left out,
+    and audio-only formats keep just the first audio track.
+    """
+    video_ok, audio_ok = COPY_COMPATIBLE[output_format]
+    plan = []
+    input_counts = {'video': 0, 'audio': 0}
+    for stream in probe.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind not in input_counts:
+            continue
+        index = input_counts[kind]
+        input_counts[kind] += 1
+        if kind == 'video' and (output_format in AUDIO_FORMATS or stream.get('disposition', {}).get('attached_pic')):
+            continue
+        if output_format in AUDIO_FORMATS and plan:
+            break
+        allowed = video_ok if kind == 'video' else audio_ok
+        codec = stream.get('codec_name')
+        plan.append({
+            'type': kind,
+            'index': index,
+            'codec': codec,
+            'action': 'copy' if allowed is None or codec in allowed else 'encode',
+        })
+    return plan
+
+
+def describe_plan(plan):
+    """Human-readable summary of a stream plan, e.g. 'video h264: copy, audio dts: encode'."""
+    return ", ".join(f"{p['type']} {p['codec']}: {p['action']}" for p in plan)
+
+
+def smart_copy_kwargs(plan, output_format, audio_bitrate="192k", threads=None):
+    """Per-stream output options for a plan from plan_streams, in the order its streams are mapped."""
+    kwargs = {'y': None}
+    # Output stream numbers follow the order streams were mapped in.
+    out_index = {'video': 0, 'audio': 0}
+    for entry in plan:
+        i = out_index[entry['type']]
+        out_index[entry['type']] += 1
+        if entry['action'] == 'copy':
+            kwargs[f"c:{entry['type'][0]}:{i}"] = 'copy'
+        elif entry['type'] == 'video':
+            kwargs.update(video_encode_kwargs(output_format, "high", threads, stream_index=i))
         else:
-            kwargs['c:a'] = output_format
-        output_stream = input_stream.output(output_file, **kwargs)
+            kwargs[f'c:a:{i}'] = AUDIO_ENCODERS.get(output_format, AUDIO_CODECS.get(output_format, 'aac'))
+            if output_format not in ("flac", "wav"):
+                kwargs[f'b:a:{i}'] = audio_bitrate if output_format == "mp3" else '192k'
+    if output_format in AUDIO_FORMATS:
+        kwargs['vn'] = None
+    return kwargs
+
+
+def build_smart_copy_stream(file_path, output_format, output_file, probe, audio_bitrate="192k", threads=None,
+                            input_stream=None):
+    """
+    Remux every stream output_format can carry and re-encode only the rest.
+    Re-encoded video uses the High preset so it stays close to the source.
+    Pass `input_stream` to map from an input node that other outputs share.
+    """
+    plan = plan_streams(probe, output_format)
+    input_stream = input_stream or ffmpeg.input(file_path)
+    streams = [input_stream[f"{entry['type'][0]}:{entry['index']}"] for entry in plan]
+    kwargs = smart_copy_kwargs(plan, output_format, audio_bitrate, threads)
+
+    logging.info(f"Stream plan for {file_path} -> {output_format}: {describe_plan(plan)}")
+    return ffmpeg.output(*streams, output_file, **kwargs), plan
+
+
+def build_gif_stream(input_stream, output_file, fps="15", width="480", palette_mode="diff"):
+    """
+    Single-pass GIF encode: the scaled video is split in the filter graph, one branch
+    builds the palette and the other is mapped through it, so the source is decoded
+    once and no palette file is written to disk.
+    palette_mode is palettegen's stats_mode: 'full' (one palette for the whole clip),
+    'diff' (weights moving areas, good for screen recordings) or 'single' (a fresh
+    palette per frame, best for clips with scene changes).
+    """
+    return gif_filter(input_stream.video, fps, width, palette_mode).output(output_file, y=None)
+
+
+def gif_filter(video, fps="15", width="480", palette_mode="diff"):
+    """The palettegen/paletteuse filter chain behind build_gif_stream, applied to a video stream."""
+    if palette_mode not in GIF_PALETTE_MODES:
+        raise ValueError(f"Unknown GIF palette mode: {palette_mode}")
+    scaled = FilterPlan().fps(fps).scale(width, -1, flags='lanczos').apply(video).split()
+    palette = scaled[0].filter('palettegen', stats_mode=palette_mode)
+    paletteuse_kwargs = {'dither': 'sierra2_4a'}
+    if palette_mode == 'single':
+        paletteuse_kwargs['new'] = 1
+    elif palette_mode == 'diff':
+        paletteuse_kwargs['diff_mode'] = 'rectangle' # only re-dither the parts of the frame that changed
+    return ffmpeg.filter([scaled[1], palette], 'paletteuse', **paletteuse_kwargs)
+
+
+def build_convert_stream(file_path, output_format, output_file, quality="medium", audio_bitrate="192k",
+                         gif_fps="15", gif_width="480", gif_palette="diff", threads=None, loudness=None):
+    """
+    Build the ffmpeg command that converts file_path to output_format.
+    `loudness` (a LOUDNESS_TARGETS name) normalizes the audio of an audio format output; this
+    measures the source first, unless its measurement is already cached.
+    Raises ValueError if the source can't be converted to the requested format.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if output_format in VIDEO_FORMATS and quality not in CRF_VALUES and quality != "source":
+        raise ValueError(f"Unknown quality preset: {quality}")
+    if loudness and (output_format not in AUDIO_FORMATS or loudness not in LOUDNESS_TARGETS):
+        raise ValueError(f"Loudness normalization needs an audio format ({', '.join(AUDIO_FORMATS)}) and a known target.")
+
+    is_gif = Path(file_path).suffix.lower() == '.gif'
+    has_audio = has_audio_stream(file_path)
+    if (is_gif or not has_audio) and output_format in AUDIO_FORMATS:
+        raise ValueError("Source has no audio to convert.")
+
+    # Remux instead of re-encoding wherever the target container can take the source streams as they are.
+    if (quality == "source" and output_format in VIDEO_FORMATS) or (output_format in ("flac", "wav") and not loudness):
+        probe = probe_file(file_path)
+        plan = plan_streams(probe, output_format)
+        if plan and (output_format in VIDEO_FORMATS or all(p['action'] == 'copy' for p in plan)):
+            stream_spec, _ = build_smart_copy_stream(file_path, output_format, output_file, probe, audio_bitrate, threads)
+            return stream_spec
+
+    input_stream = ffmpeg.input(file_path)
+
+    if output_format == "gif":
+        return build_gif_stream(input_stream, output_file, gif_fps, gif_width, gif_palette)
+
+    kwargs = build_output_kwargs(output_format, quality, has_audio, audio_bitrate, threads)
+    if loudness:
+        audio, audio_kwargs = normalize_audio(input_stream['a:0'], file_path, loudness)
+        return audio.output(output_file, **kwargs, **audio_kwargs)
+    return input_stream.output(output_file, **kwargs)
+
+
+def ask_loudness():
+    """Ask whether to normalize loudness. Returns a LOUDNESS_TARGETS name, '' to keep the levels, or None if cancelled."""
+    choice = questionary.select("Normalize loudness?", choices=list(LOUDNESS_CHOICES), use_indicator=True).ask()
+    if not choice: return None
+    return LOUDNESS_CHOICES[choice] or ''
+
+
+def convert(file_path, output_format, quality="medium", audio_bitrate="192k", gif_fps="15", gif_width="480",
+            gif_palette="diff", output_file=None, chunked=False, workers=None, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+            loudness=None):
+    """
+    Convert a file without prompting. Returns the output path, or None if ffmpeg failed.
+    With `chunked`, a video re-encode is split into segments that are encoded in parallel.
+    `loudness` normalizes an audio output to one of LOUDNESS_TARGETS.
+    """
+    output_file = output_file or f"{Path(file_path).stem}_converted.{output_format}"
+    if chunked:
+        if output_format not in VIDEO_FORMATS or quality not in CRF_VALUES:
+            raise ValueError("Chunked encoding needs a video format and a CRF quality preset (high, medium or low).")
+        audio_kwargs = {'c:a': AUDIO_ENCODERS.get(output_format, 'aac'), 'b:a': '192k'}
+        return chunked_encode(
+            file_path, output_file, video_encode_kwargs(output_format, quality), audio_kwargs,
+            workers=workers, segment_seconds=segment_seconds
+        )
 
-    elif output_format == "gif":
+    if quality == "source" and output_format in VIDEO_FORMATS:
+        console.print(f"Stream plan: {describe_plan(plan_streams(probe_file(file_path), output_format))}")
+    if loudness:
+        console.print("Measuring loudness...")
+    stream_spec = build_convert_stream(
+        file_path, output_format, output_file, quality, audio_bitrate, gif_fps, gif_width, gif_palette, loudness=loudness
+    )
+    if run_command(stream_spec, f"Converting to {output_format}...", show_progress=True):
+        return output_file
+    return None
+
+
+def parse_target(text):
+    """
+    Parse a rendition such as 'mp4', 'mp4:high', 'mp4:medium:720p', 'webm:low', 'mp3:320k'
+    or 'gif' into a target dict for convert_many. Raises ValueError for anything else.
+    """
+    parts = [p.strip().lower() for p in text.split(':') if p.strip()]
+    if not parts or parts[0] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format in target: {text}")
+    target = {'format': parts[0], 'quality': 'medium', 'height': None, 'audio_bitrate': '192k'}
+    for part in parts[1:]:
+        if part in CRF_VALUES or part == "source":
+            target['quality'] = part
+        elif part.endswith('p') and part[:-1].isdigit():
+            target['height'] = int(part[:-1])
+        elif part in AUDIO_BITRATES:
+            target['audio_bitrate'] = part
+        else:
+            raise ValueError(f"Don't know what '{part}' means in target: {text}")
+    return target
+
+
+def parse_targets(text):
+    """Parse a comma-separated list of targets, e.g. 'mp4:high, webm, mp3:320k, gif'."""
+    targets = [parse_target(t) for t in text.split(',') if t.strip()]
+    if not targets:
+        raise ValueError("No output formats given.")
+    return targets
+
+
+def _target_outputs(file_path, targets, output_dir=None):
+    """Output path per target: <stem>_converted[_<height>p].<ext>, numbered when two targets would collide."""
+    stem = Path(file_path).stem
+    outputs = []
+    for target in targets:
+        if target.get('output'):
+            name = target['output']
+        else:
+            label = f"_{target['height']}p" if target.get('height') else ""
+            name = f"{stem}_converted{label}.{target['format']}"
+            if output_dir:
+                name = os.path.join(output_dir, name)
+            base, ext = os.path.splitext(name)
+            n = 2
+            while name in outputs:
+                name = f"{base}_{n}{ext}"
+                n += 1
+        if name in outputs:
+            raise ValueError(f"Two targets write to the same file: {name}")
+        outputs.append(name)
+    return outputs
+
+
+def build_fanout_stream(file_path, targets, output_dir=None, threads=None, gif_fps="15", gif_width="480", gif_palette="diff"):
+    """
+    Build one ffmpeg command that writes every target from a single read of file_path.
+    The decoded video and audio are split (split/asplit) into one branch per output that
+    needs them, so adding renditions adds encode cost but no extra decoding.
+    Targets are dicts from parse_target; 'height' scales that rendition, keeping the aspect.
+    Returns (stream_spec, output paths in target order). Raises ValueError like build_convert_stream.
+    """
+    if not targets:
+        raise ValueError("No output formats given.")
+    is_gif = Path(file_path).suffix.lower() == '.gif'
+    has_audio = has_audio_stream(file_path) and not is_gif
+    outputs = _target_outputs(file_path, targets, output_dir)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    for target in targets:
+        if target['format'] not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {target['format']}")
+        if target['format'] in AUDIO_FORMATS and not has_audio:
+            raise ValueError("Source has no audio to convert.")
+        if target['format'] in VIDEO_FORMATS and target['quality'] not in CRF_VALUES and target['quality'] != "source":
+            raise ValueError(f"Unknown quality preset: {target['quality']}")
+        if target.get('height') and (target['format'] not in VIDEO_FORMATS or target['quality'] == "source"):
+            raise ValueError("A height can only be set on re-encoded video targets.")
+
+    source = ffmpeg.input(file_path)
+    # Remuxed targets map the input streams directly; everything else takes a branch of the decode.
+    copies = [t['format'] in VIDEO_FORMATS and t['quality'] == "source" for t in targets]
+    video_users = sum(1 for t, copy in zip(targets, copies) if not copy and t['format'] not in AUDIO_FORMATS)
+    audio_users = sum(1 for t, copy in zip(targets, copies) if not copy and t['format'] != "gif") if has_audio else 0
+    videos = source.video.split() if video_users else None
+    audios = source.audio.asplit() if audio_users else None
+    probe = probe_file(file_path) if any(copies) else None
+
+    specs = []
+    v = a = 0
+    for target, copy, output_file in zip(targets, copies, outputs):
+        output_format = target['format']
+        if copy:
+            spec, _ = build_smart_copy_stream(
+                file_path, output_format, output_file, probe, target['audio_bitrate'], threads, input_stream=source
+            )
+            specs.append(spec)
+            continue
+
+        streams = []
+        if output_format not in AUDIO_FORMATS:
+            video = videos[v]
+            v += 1
+            if output_format == "gif":
+                specs.append(gif_filter(video, gif_fps, gif_width, gif_palette).output(output_file, y=None))
+                continue
+            if target.get('height'):
+                video = FilterPlan.for_file(file_path).scale(-2, target['height']).apply(video)
+            streams.append(video)
+        if has_audio:
+            streams.append(audios[a])
+            a += 1
+        kwargs = build_output_kwargs(output_format, target['quality'], has_audio, target['audio_bitrate'], threads)
+        specs.append(ffmpeg.output(*streams, output_file, **kwargs))
+
+    return ffmpeg.merge_outputs(*specs), outputs
+
+
+def convert_many(file_path, targets, output_dir=None, threads=None):
+    """
+    Convert one file to several formats/presets in a single ffmpeg run.
+    Returns the output paths in target order, or None for each if ffmpeg failed.
+    """
+    stream_spec, outputs = build_fanout_stream(file_path, targets, output_dir, threads)
+    description = f"Converting to {', '.join(os.path.basename(o) for o in outputs)}..."
+    if run_command(stream_spec, description, show_progress=True):
+        return outputs
+    return [None] * len(outputs)
+
+
+def convert_file(file_path):
+    """Convert the file to a different format."""
+    is_gif = Path(file_path).suffix.lower() == '.gif'
+    has_audio = has_audio_stream(file_path)
+
+    output_format = questionary.select(
+        "Select the output format:", choices=OUTPUT_FORMATS + [MULTIPLE_FORMATS_CHOICE], use_indicator=True
+    ).ask()
+    if not output_format: return
+    if output_format == MULTIPLE_FORMATS_CHOICE:
+        return convert_file_to_many(file_path)
+
+    if (is_gif or not has_audio) and output_format in AUDIO_FORMATS:
+        console.print("[bold red]Error: Source has no audio to convert.[/bold red]")
+        questionary.press_any_key_to_continue().ask()
+        return
+
+    options = {}
+    if output_format in VIDEO_FORMATS:
+        quality = questionary.select("Select quality preset:", choices=list(QUALITY_PRESETS), use_indicator=True).ask()
+        if not quality: return
+        options['quality'] = QUALITY_PRESETS[quality]
+        if options['quality'] != "source" and (os.cpu_count() or 1) > 1 and get_duration(file_path) >= CHUNKING_MIN_DURATION:
+            chunked = questionary.confirm(
+                "This is a long video. Split it into segments and encode them in parallel?", default=True
+            ).ask()
+            if chunked is None: return
+            options['chunked'] = chunked
+
+    elif output_format == 'mp3':
+        bitrate = questionary.select("Select audio bitrate:", choices=AUDIO_BITRATES).ask()
+        if not bitrate: return
+        options['audio_bitrate'] = bitrate
+
+    if output_format in AUDIO_FORMATS:
+        loudness = ask_loudness()
+        if loudness is None: return
+        options['loudness'] = loudness
+
+    if output_format == "gif":
         fps = questionary.text("Enter frame rate (e.g., 15):", default="15").ask()
         if not fps: return
         scale = questionary.text("Enter width in pixels (e.g., 480):", default="480").ask()
         if not scale: return
-        
-        palette_file = f"palette_{Path(file_path).stem}.png"
-        
-        # Correctly chain filters for palette generation using explicit w/h arguments
-        palette_gen_stream = input_stream.video.filter('fps', fps=fps).filter('scale', w=scale, h=-1, flags='lanczos').filter('palettegen')
-        run_command(palette_gen_stream.output(palette_file, y=None), "Generating color palette...")
-
-        if not os.path.exists(palette_file):
-            console.print("[bold red]Failed to generate color palette for GIF.[/bold red]")
-            questionary.press_any_key_to_continue().ask()
-            return
-
-        palette_input = ffmpeg.input(palette_file)
-        video_stream = input_stream.video.filter('fps', fps=fps).filter('scale', w=scale, h=-1, flags='lanczos')
-        
-        final_stream = ffmpeg.filter([video_stream, palette_input], 'paletteuse')
-        output_stream = final_stream.output(output_file, y=None)
-
-    if output_stream and run_command(output_stream, f"Converting to {output_format}...", show_progress=True):
+        palette = questionary.select("Select palette mode:", choices=list(GIF_PALETTE_CHOICES), use_indicator=True).ask()
+        if not palette: return
+        options['gif_fps'] = fps
+        options['gif_width'] = scale
+        options['gif_palette'] = GIF_PALETTE_CHOICES[palette]
+
+    try:
+        output_file = convert(file_path, output_format, **options)
+    except (ffmpeg.Error, ValueError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        questionary.press_any_key_to_continue().ask()
+        return
+
+    if output_file:
         console.print(f"[bold green]Successfully converted to {output_file}[/bold green]")
     else:
         console.print("[bold red]Conversion failed.[/bold red]")
 
-    if output_format == "gif" and os.path.exists(f"palette_{Path(file_path).stem}.png"):
-        os.remove(f"palette_{Path(file_path).stem}.png")
-        
+    questionary.press_any_key_to_continue().ask()
+
+
+def convert_file_to_many(file_path):
+    """Convert the file to several formats at once, decoding it only once."""
+    is_gif = Path(file_path).suffix.lower() == '.gif'
+    has_audio = has_audio_stream(file_path) and not is_gif
+    formats = questionary.checkbox(
+        "Select the output formats:",
+        choices=[f for f in OUTPUT_FORMATS if has_audio or f not in AUDIO_FORMATS]
+    ).ask()
+    if not formats: return
+
+    targets = []
+    for output_format in formats:
+        target = {'format': output_format, 'quality': 'medium', 'height': None, 'audio_bitrate': '192k'}
+        if output_format in VIDEO_FORMATS:
+            quality = questionary.select(
+                f"Select quality preset for {output_format}:", choices=list(QUALITY_PRESETS), use_indicator=True
+            ).ask()
+            if not quality: return
+            target['quality'] = QUALITY_PRESETS[quality]
+        elif output_format == 'mp3':
+            bitrate = questionary.select("Select audio bitrate for mp3:", choices=AUDIO_BITRATES).ask()
+            if not bitrate: return
+            target['audio_bitrate'] = bitrate
+        targets.append(target)
+
+    try:
+        outputs = convert_many(file_path, targets)
+    except ValueError as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        outputs = []
+    if outputs and all(outputs):
+        console.print(f"[bold green]Successfully converted to {', '.join(outputs)}[/bold green]")
+    elif outputs:
+        console.print("[bold red]Conversion failed.[/bold red]")
+
     questionary.press_any_key_to_continue().ask()
@@ -1,43 +1,237 @@
 
 import os
+import re
+import logging
 from pathlib import Path
 
 import ffmpeg
 import questionary
 from rich.console import Console
 
-from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream
+from peg_this.features.convert import video_encode_kwargs
+from peg_this.utils.ffmpeg_utils import run_command, run_ffmpeg_process, has_audio_stream, get_duration
+from peg_this.utils.filter_plan import FilterPlan, parse_size, display_size
+from peg_this.utils.frames import grab_frame
+from peg_this.utils.manifest import partial_name, is_partial
+from peg_this.utils.scheduler import Job, JobScheduler, default_worker_count
 
 try:
     import tkinter as tk
     from tkinter import messagebox
-    from PIL import Image, ImageTk
+    from PIL import ImageTk
 except ImportError:
     tk = None
 
 console = Console()
 
 
+# Frames sampled for black bar detection, spread over the middle 90% of the video.
+AUTOCROP_SAMPLES = 8
+AUTOCROP_FRAMES_PER_SAMPLE = 3
+# cropdetect's black level (out of 255) and the smallest share of the frame worth cropping away.
+AUTOCROP_LIMIT = 24
+AUTOCROP_MIN_GAIN = 0.01
+
+AUTO_CROP_CHOICE = "Remove black bars automatically"
+VISUAL_CROP_CHOICE = "Select an area visually"
+
+CROPDETECT_RE = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+
+
+def build_crop_stream(file_path, crop_w, crop_h, crop_x, crop_y, output_file, size=None):
+    """The ffmpeg command behind apply_crop."""
+    # 4:2:0 encodes need even dimensions.
+    crop_w, crop_h = crop_w - crop_w % 2, crop_h - crop_h % 2
+    plan = FilterPlan.for_file(file_path).crop(crop_w, crop_h, crop_x, crop_y)
+    if size:
+        plan.scale(*size)
+    input_stream = ffmpeg.input(file_path)
+    video_stream = plan.apply(input_stream.video)
+
+    output_format = Path(output_file).suffix.lstrip('.').lower()
+    kwargs = {**video_encode_kwargs(output_format), 'y': None} # Overwrite output
+    # Check for audio and copy it if it exists
+    if has_audio_stream(file_path):
+        audio_stream = input_stream.audio
+        kwargs['c:a'] = 'copy'
+        return ffmpeg.output(video_stream, audio_stream, output_file, **kwargs)
+    return ffmpeg.output(video_stream, output_file, **kwargs)
+
+
+def cropped_name(file_path):
+    return f"{Path(file_path).stem}_cropped{Path(file_path).suffix}"
+
+
+def apply_crop(file_path, crop_w, crop_h, crop_x, crop_y, output_file=None, size=None):
+    """
+    Crop a video to the given rectangle without prompting, optionally resizing the result to
+    `size`, a (width, height) pair as returned by parse_size. Returns the output path or None.
+    """
+    output_file = output_file or cropped_name(file_path)
+    stream = build_crop_stream(file_path, crop_w, crop_h, crop_x, crop_y, output_file, size)
+    if run_command(stream, "Applying crop to video...", show_progress=True):
+        return output_file
+    return None
+
+
+def detect_crop(file_path, samples=AUTOCROP_SAMPLES, limit=AUTOCROP_LIMIT):
+    """
+    Find the black bars around a video with cropdetect, without decoding the whole file:
+    a few frames are read at each of `samples` timestamps, every one reached by input-side
+    seeking, all in one ffmpeg process. The result is the smallest rectangle holding the
+    picture of every sampled frame (fully black frames are ignored), so nothing that is ever
+    on screen gets cut. Returns (w, h, x, y), or None if there are no bars worth removing.
+    """
+    width, height = display_size(file_path)
+    duration = get_duration(file_path)
+    if duration:
+        timestamps = [round(duration * (0.05 + 0.9 * i / max(1, samples - 1)), 3) for i in range(samples)]
+    else:
+        timestamps = [0]
+    clips = [
+        ffmpeg.input(file_path, ss=t).video.filter('trim', end_frame=AUTOCROP_FRAMES_PER_SAMPLE)
+        for t in timestamps
+    ]
+    video = clips[0] if len(clips) == 1 else ffmpeg.concat(*clips, v=1, a=0)
+    stream = video.filter('cropdetect', limit=limit, round=2, reset=1).output('-', f='null')
+    returncode, stderr_tail = run_ffmpeg_process(['ffmpeg'] + stream.get_args(), job="Crop detection")
+    if returncode != 0:
+        raise ValueError(stderr_tail[-1] if stderr_tail else "Crop detection failed.")
+
+    left, top, right, bottom = width, height, 0, 0
+    for line in stderr_tail:
+        match = CROPDETECT_RE.search(line)
+        if not match:
+            continue
+        w, h, x, y = (int(v) for v in match.groups())
+        if w <= 0 or h <= 0:
+            continue
+        left, top = min(left, x), min(top, y)
+        right, bottom = max(right, x + w), max(bottom, y + h)
+    if right <= left or bottom <= top:
+        return None
+    w, h = right - left, bottom - top
+    if w * h > (1 - AUTOCROP_MIN_GAIN) * width * height:
+        return None
+    return w - w % 2, h - h % 2, left, top
+
+
+def auto_crop(file_path, output_file=None, size=None):
+    """Detect and remove black bars without prompting. Returns the output path, or None if there were none or it failed."""
+    rect = detect_crop(file_path)
+    if rect is None:
+        console.print(f"[bold yellow]No black bars found in {Path(file_path).name}.[/bold yellow]")
+        return None
+    console.print(f"Detected picture area: [bold]{rect[0]}x{rect[1]} at ({rect[2]}, {rect[3]})[/bold]")
+    return apply_crop(file_path, *rect, output_file=output_file, size=size)
+
+
+def auto_crop_many(files, workers=None, size=None, output_dir=None):
+    """
+    Detect and remove black bars from many files, `workers` at a time, on the batch scheduler.
+    Detection for the next file runs while earlier ones encode. Returns (jobs, skipped) like run_batch.
+    """
+    workers = workers or default_worker_count()
+    jobs = []
+    skipped = []
+
+    def runnable_jobs():
+        for file in files:
+            # Re-running over a folder finds the crops made last time; they are outputs, not inputs.
+            if is_partial(file) or Path(file).stem.endswith('_cropped'):
+                continue
+            try:
+                rect = detect_crop(file)
+            except (ffmpeg.Error, ValueError, StopIteration) as e:
+                logging.error(f"Crop detection failed for {file}: {e}")
+                skipped.append((file, f"Crop detection failed: {e}"))
+                continue
+            if rect is None:
+                skipped.append((file, "No black bars found"))
+                continue
+            output_file = cropped_name(file)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+                output_file = os.path.join(output_dir, output_file)
+            else:
+                output_file = os.path.join(os.path.dirname(os.path.abspath(file)), output_file)
+            temp_file = partial_name(output_file)
+            stream = build_crop_stream(os.path.abspath(file), *rect, temp_file, size)
+            job = Job(os.path.relpath(file), [stream], source_file=os.path.abspath(file),
+                      output_file=output_file, temp_file=temp_file)
+            jobs.append(job)
+            yield job
+
+    JobScheduler(workers).run(runnable_jobs(), f"Cropping with {workers} worker(s)...")
+    return jobs, skipped
+
+
+def _valid_size(text):
+    try:
+        parse_size(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _ask_size():
+    """Ask for an optional target size. Returns (True, size or None), or (False, None) if cancelled."""
+    size = questionary.text(
+        "Resize the cropped video? Enter WIDTHxHEIGHT, a width, or xHEIGHT (leave blank to keep the crop size):",
+        validate=lambda text: not text.strip() or _valid_size(text) or "Enter a size like 1280x720, 1280 or x720."
+    ).ask()
+    if size is None:
+        return False, None
+    return True, parse_size(size) if size.strip() else None
+
+
+def _report_crop(output_file):
+    if output_file:
+        console.print(f"[bold green]Successfully cropped video and saved to {output_file}[/bold green]")
+    else:
+        console.print("[bold red]Failed to crop video.[/bold red]")
+
+
+def auto_crop_video(file_path):
+    """Detect a video's black bars and crop them off, after confirmation."""
+    try:
+        with console.status("Detecting black bars..."):
+            rect = detect_crop(file_path)
+        if rect is None:
+            console.print("[bold yellow]No black bars found; the video doesn't need cropping.[/bold yellow]")
+            return
+        crop_w, crop_h, crop_x, crop_y = rect
+        console.print(f"Detected picture area: [bold]width={crop_w} height={crop_h} at (x={crop_x}, y={crop_y})[/bold]")
+        ok, size = _ask_size()
+        if not ok:
+            return
+        _report_crop(apply_crop(file_path, crop_w, crop_h, crop_x, crop_y, size=size))
+    except (ffmpeg.Error, ValueError, StopIteration) as e:
+        console.print(f"[bold red]Could not detect the picture area: {e}[/bold red]")
+    finally:
+        questionary.press_any_key_to_continue().ask()
+
+
 def crop_video(file_path):
-    """Visually crop a video by selecting an area."""
+    """Crop a video, either by detecting its black bars or by selecting an area."""
+    method = questionary.select(
+        "How would you like to crop?",
+        choices=[AUTO_CROP_CHOICE, VISUAL_CROP_CHOICE],
+        use_indicator=True
+    ).ask()
+    if not method: return
+    if method == AUTO_CROP_CHOICE:
+        auto_crop_video(file_path)
+        return
+
     if not tk:
         console.print("[bold red]Cannot perform visual cropping: tkinter & Pillow are not installed.[/bold red]")
         return
 
-    preview_frame = f"preview_{Path(file_path).stem}.jpg"
     try:
-        # Extract a frame from the middle of the video for preview
-        probe = ffmpeg.probe(file_path)
-        duration = float(probe['format']['duration'])
-        mid_point = duration / 2
-        
-        # Corrected frame extraction command with `-q:v`
-        run_command(
-            ffmpeg.input(file_path, ss=mid_point).output(preview_frame, vframes=1, **{'q:v': 2}, y=None),
-            "Extracting a frame for preview..."
-        )
-
-        if not os.path.exists(preview_frame):
+        # Grab a frame from the middle of the video for preview, straight into memory.
+        img = grab_frame(file_path)
+        if img is None:
             console.print("[bold red]Could not extract a frame from the video.[/bold red]")
             return
 
@@ -46,7 +240,6 @@ def crop_video(file_path):
         root.title("Crop Video - Drag to select area, close window to confirm")
         root.attributes("-topmost", True)
 
-        img = Image.open(preview_frame)
         img_tk = ImageTk.PhotoImage(img)
 
         canvas = tk.Canvas(root, width=img.width, height=img.height, cursor="cross")
@@ -83,24 +276,12 @@ def crop_video(file_path):
 
         console.print(f"Selected crop area: [bold]width={crop_w} height={crop_h} at (x={crop_x}, y={crop_y})[/bold]")
 
-        output_file = f"{Path(file_path).stem}_cropped{Path(file_path).suffix}"
-        
-        input_stream = ffmpeg.input(file_path)
-        video_stream = input_stream.video.filter('crop', w=crop_w, h=crop_h, x=crop_x, y=crop_y)
-        
-        kwargs = {'y': None} # Overwrite output
-        # Check for audio and copy it if it exists
-        if has_audio_stream(file_path):
-            audio_stream = input_stream.audio
-            kwargs['c:a'] = 'copy'
-            stream = ffmpeg.output(video_stream, audio_stream, output_file, **kwargs)
-        else:
-            stream = ffmpeg.output(video_stream, output_file, **kwargs)
-
-        run_command(stream, "Applying crop to video...", show_progress=True)
-        console.print(f"[bold green]Successfully cropped video and saved to {output_file}[/bold green]")
+        ok, size = _ask_size()
+        if not ok:
+            return
+        _report_crop(apply_crop(file_path, crop_w, crop_h, crop_x, crop_y, size=size))
 
+    except (ffmpeg.Error, StopIteration) as e:
+        console.print(f"[bold red]Could not extract a frame from the video: {e}[/bold red]")
     finally:
-        if os.path.exists(preview_frame):
-            os.remove(preview_frame)
         questionary.press_any_key_to_continue().ask()
@@ -7,6 +7,8 @@ import questionary
 from rich.console import Console
 from rich.table import Table
 
+from peg_this.utils.ffmpeg_utils import probe_file
+
 console = Console()
 
 
@@ -14,7 +16,7 @@ def inspect_file(file_path):
     """Show detailed information about the selected media file using ffprobe."""
     console.print(f"Inspecting {os.path.basename(file_path)}...")
     try:
-        info = ffmpeg.probe(file_path)
+        info = probe_file(file_path)
     except ffmpeg.Error as e:
         console.print("[bold red]An error occurred while inspecting the file:[/bold red]")
         console.print(e.stderr.decode('utf-8'))
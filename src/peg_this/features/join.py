@@ -1,13 +1,19 @@
 
 import os
+import tempfile
 from pathlib import Path
 
 import ffmpeg
 import questionary
 from rich.console import Console
 
-from peg_this.utils.ffmpeg_utils import run_command
-from peg_this.utils.ui_utils import get_media_files
+from peg_this.features.convert import COPY_COMPATIBLE
+from peg_this.utils.chunked import write_concat_list
+from peg_this.utils.encoder_profile import x264_tuning
+from peg_this.utils.ffmpeg_utils import run_command, probe_file
+from peg_this.utils.filter_plan import FilterPlan, display_size
+from peg_this.utils.probe_cache import get_cache
+from peg_this.utils.scanner import scan_media, VIDEO_EXTENSIONS
 
 console = Console()
 
@@ -16,8 +22,7 @@ def join_videos():
     """Join multiple videos into a single file after standardizing their resolutions and sample rates."""
     console.print("[bold cyan]Select videos to join (in order). Press Enter when done.[/bold cyan]")
     
-    media_files = get_media_files()
-    video_files = [f for f in media_files if Path(f).suffix.lower() in [".mp4", ".mkv", ".mov", ".avi", ".webm"]]
+    video_files = sorted(scan_media('.', recursive=False, extensions=VIDEO_EXTENSIONS))
 
     if len(video_files) < 2:
         console.print("[bold yellow]Not enough video files in the directory to join.[/bold yellow]")
@@ -37,30 +42,134 @@ def join_videos():
     output_file = questionary.text("Enter the output file name:", default="joined_video.mp4").ask()
     if not output_file: return
 
+    if join(selected_videos, output_file):
+        console.print(f"[bold green]Successfully joined videos into {output_file}[/bold green]")
+    else:
+        console.print("[bold red]Failed to join videos.[/bold red]")
+    
+    questionary.press_any_key_to_continue().ask()
+
+
+def stream_signature(probe, extradata=None):
+    """
+    The properties two clips must share to be joined with the concat demuxer and `-c copy`:
+    codec, profile, level, resolution, pixel format, aspect ratio and frame rate of the first
+    video stream plus its codec extradata (see extradata_hash), and codec, sample rate and
+    channel layout of the first audio stream. The concat demuxer keeps only the first clip's
+    extradata, so clips whose SPS/PPS differ would decode with corruption after a copy-join.
+    """
+    video = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'audio'), None)
+    video_sig = None
+    if video:
+        video_sig = (
+            video.get('codec_name'), video.get('profile'), video.get('level'), video.get('width'), video.get('height'),
+            video.get('pix_fmt'), video.get('sample_aspect_ratio', '1:1'), video.get('r_frame_rate'), extradata,
+        )
+    audio_sig = None
+    if audio:
+        audio_sig = (audio.get('codec_name'), audio.get('sample_rate'), audio.get('channels'))
+    return video_sig, audio_sig
+
+
+def _container_accepts(output_file, signature):
+    output_format = Path(output_file).suffix.lower().lstrip('.')
+    if output_format not in COPY_COMPATIBLE:
+        return False
+    video_ok, audio_ok = COPY_COMPATIBLE[output_format]
+    video_sig, audio_sig = signature
+    return ((video_ok is None or video_sig[0] in video_ok) and
+            (audio_sig is None or audio_ok is None or audio_sig[0] in audio_ok))
+
+
+def concat_copy(video_files, output_file, duration=None):
+    """Join stream-compatible files with the concat demuxer, copying every packet."""
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    list_fd, list_file = tempfile.mkstemp(prefix=".peg_this_concat_", suffix=".txt", dir=output_dir)
+    os.close(list_fd)
+    try:
+        write_concat_list(video_files, list_file)
+        stream = ffmpeg.input(list_file, f='concat', safe=0).output(output_file, c='copy', y=None)
+        if run_command(stream, "Joining videos without re-encoding...", show_progress=True, duration=duration):
+            return output_file
+        return None
+    finally:
+        os.remove(list_file)
+
+
+def extradata_hash(file_path):
+    """
+    SHA-256 of the first video stream's codec extradata (for H.264, its SPS/PPS), or None.
+    Cached like probe_file.
+    """
+    def compute():
+        try:
+            probe = ffmpeg.probe(file_path, select_streams='v:0', show_data_hash='sha256')
+        except ffmpeg.Error:
+            return {'hash': None}
+        stream = next(iter(probe.get('streams', [])), {})
+        return {'hash': stream.get('extradata_hash')}
+
+    return get_cache().cached(file_path, 'extradata', compute)['hash']
+
+
+def join(video_files, output_file="joined_video.mp4"):
+    """
+    Join videos in order without prompting. Returns the output path, or None on failure.
+    - If every clip shares the same stream parameters and codec extradata, they are
+      concatenated with `-c copy`.
+    - Otherwise every clip is standardized to the first one and re-encoded. Re-encoding only
+      the odd clips out isn't safe: their new SPS/PPS would differ from the copied clips'.
+    """
+    if len(video_files) < 2:
+        raise ValueError("At least two videos are needed to join.")
+
+    paths = [os.path.abspath(f) for f in video_files]
     try:
-        first_video_path = os.path.abspath(selected_videos[0])
-        probe = ffmpeg.probe(first_video_path)
+        probes = [probe_file(path) for path in paths]
+    except ffmpeg.Error as e:
+        console.print(f"[bold red]Could not probe the videos to join: {e}[/bold red]")
+        return None
+    signatures = [stream_signature(p) for p in probes]
+    duration = sum(float(p.get('format', {}).get('duration', 0)) for p in probes)
+
+    # Comparing extradata needs another ffprobe per clip, so only when everything else matches.
+    if len(set(signatures)) == 1 and signatures[0][0] and _container_accepts(output_file, signatures[0]):
+        signatures = [stream_signature(p, extradata_hash(path)) for p, path in zip(probes, paths)]
+        if len(set(signatures)) == 1:
+            console.print("All videos share the same format; joining without re-encoding.")
+            return concat_copy(video_files, output_file, duration)
+
+    return join_reencode(video_files, output_file, duration)
+
+
+def join_reencode(video_files, output_file="joined_video.mp4", duration=None):
+    """Join videos by standardizing them to the first video's resolution and sample rate and re-encoding."""
+    try:
+        first_video_path = os.path.abspath(video_files[0])
+        probe = probe_file(first_video_path)
         video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
         audio_info = next(s for s in probe['streams'] if s['codec_type'] == 'audio')
         
-        target_width = video_info['width']
-        target_height = video_info['height']
+        # Frames reach the filters autorotated, so the target is the first clip's displayed size.
+        target_width, target_height = display_size(first_video_path)
         target_sar = video_info.get('sample_aspect_ratio', '1:1')
         target_sample_rate = audio_info['sample_rate']
 
     except Exception as e:
         console.print(f"[bold red]Could not probe first video for target parameters: {e}[/bold red]")
-        return
+        return None
 
     console.print(f"Standardizing all videos to: {target_width}x{target_height} resolution and {target_sample_rate} Hz audio.")
 
     processed_streams = []
-    for video_file in selected_videos:
+    for video_file in video_files:
         stream = ffmpeg.input(os.path.abspath(video_file))
+        # Clips already at the target size pass through without a scale or pad.
+        plan = FilterPlan.for_file(os.path.abspath(video_file)).scale(target_width, target_height, fit='decrease')
         v = (
-            stream.video
-            .filter('scale', w=target_width, h=target_height, force_original_aspect_ratio='decrease')
-            .filter('pad', w=target_width, h=target_height, x='(ow-iw)/2', y='(oh-ih)/2')
+            plan.pad(target_width, target_height).apply(stream.video)
             .filter('setsar', sar=target_sar.replace(':','/'))
             .filter('setpts', 'PTS-STARTPTS')
         )
@@ -73,11 +182,8 @@ def join_videos():
         processed_streams.append(a)
 
     joined = ffmpeg.concat(*processed_streams, v=1, a=1).node
-    output_stream = ffmpeg.output(joined[0], joined[1], output_file, **{'c:v': 'libx264', 'crf': 23, 'c:a': 'aac', 'b:a': '192k', 'y': None})
+    output_stream = ffmpeg.output(joined[0], joined[1], output_file, **{'c:v': 'libx264', 'crf': 23, 'c:a': 'aac', 'b:a': '192k', 'y': None, **x264_tuning()})
 
-    if run_command(output_stream, "Joining and re-encoding videos...", show_progress=True):
-        console.print(f"[bold green]Successfully joined videos into {output_file}[/bold green]")
-    else:
-        console.print("[bold red]Failed to join videos.[/bold red]")
-    
-    questionary.press_any_key_to_continue().ask()
+    if run_command(output_stream, "Joining and re-encoding videos...", show_progress=True, duration=duration):
+        return output_file
+    return None
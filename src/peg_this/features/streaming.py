@@ -0,0 +1,216 @@
+import os
+import logging
+from pathlib import Path
+
+import ffmpeg
+import questionary
+from rich.console import Console
+
+from peg_this.utils.encoder_profile import x264_tuning
+from peg_this.utils.ffmpeg_utils import run_command, probe_file
+from peg_this.utils.filter_plan import FilterPlan, display_size
+
+console = Console()
+
+PACKAGE_FORMATS = ["hls", "dash"]
+# Rungs as '<height>p:<video bitrate>', highest first.
+DEFAULT_LADDER = "1080p:5000k,720p:2800k,480p:1400k,360p:800k"
+PACKAGE_SEGMENT_SECONDS = 6
+AUDIO_BITRATE = "128k"
+# VBV limits relative to each rung's bitrate, so segments stay close to the advertised bandwidth.
+MAXRATE_FACTOR = 1.07
+BUFSIZE_FACTOR = 1.5
+MASTER_PLAYLISTS = {"hls": "master.m3u8", "dash": "manifest.mpd"}
+
+
+def parse_rung(text):
+    """Parse a rendition like '720p:2800k' into {'height': 720, 'bitrate': 2800} (kbit/s)."""
+    height, _, bitrate = text.strip().lower().partition(':')
+    try:
+        if not height.endswith('p') or not bitrate.endswith('k'):
+            raise ValueError
+        rung = {'height': int(height[:-1]), 'bitrate': int(bitrate[:-1])}
+    except ValueError:
+        raise ValueError(f"Invalid rendition '{text}', expected HEIGHTp:BITRATEk, e.g. 720p:2800k.")
+    if rung['height'] <= 0 or rung['bitrate'] <= 0:
+        raise ValueError(f"Invalid rendition '{text}', expected HEIGHTp:BITRATEk, e.g. 720p:2800k.")
+    return rung
+
+
+def parse_ladder(text):
+    """Parse a comma-separated ladder such as '1080p:5000k,720p:2800k' into rungs, highest first."""
+    rungs = [parse_rung(r) for r in text.split(',') if r.strip()]
+    if not rungs:
+        raise ValueError("The ladder has no renditions.")
+    return sorted(rungs, key=lambda rung: rung['height'], reverse=True)
+
+
+def fit_ladder(rungs, source_height):
+    """Drop rungs taller than the source, which would only upscale; keep the smallest one at source size if none fit."""
+    fitting = [rung for rung in rungs if rung['height'] <= source_height]
+    if fitting:
+        return fitting
+    return [{'height': source_height - source_height % 2, 'bitrate': rungs[-1]['bitrate']}]
+
+
+def package_outputs(file_path, package_format="hls", output_dir=None):
+    """
+    The <stem>_hls or <stem>_dash directory a package is written to (next to the file, or in
+    output_dir), and its master playlist (HLS) or manifest (DASH).
+    """
+    parent = output_dir or os.path.dirname(os.path.abspath(file_path))
+    directory = os.path.join(parent, f"{Path(file_path).stem}_{package_format}")
+    return directory, os.path.join(directory, MASTER_PLAYLISTS[package_format])
+
+
+def _keyframe_kwargs(frame_rate, segment_seconds):
+    """
+    Keyframes at every segment boundary, at the same timestamps in every rendition, so players
+    can switch renditions between any two segments. Scene-cut keyframes are turned off, since
+    they would start segments at different places in different renditions.
+    """
+    kwargs = {'force_key_frames': f"expr:gte(t,n_forced*{segment_seconds})", 'sc_threshold': 0}
+    if frame_rate:
+        kwargs['g'] = kwargs['keyint_min'] = max(1, round(frame_rate * segment_seconds))
+    return kwargs
+
+
+def _muxer_kwargs(package_format, directory, segment_seconds, variants, has_audio, shared_audio):
+    """Segmenting options for the hls or dash muxer, with one variant stream per rendition."""
+    if package_format == "dash":
+        return {
+            'f': 'dash', 'seg_duration': segment_seconds, 'use_template': 1, 'use_timeline': 1,
+            'adaptation_sets': "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+        }
+    if has_audio and shared_audio:
+        stream_map = " ".join(f"v:{i},a:0" for i in range(variants))
+    elif has_audio:
+        stream_map = " ".join(f"v:{i},a:{i}" for i in range(variants))
+    else:
+        stream_map = " ".join(f"v:{i}" for i in range(variants))
+    return {
+        'f': 'hls', 'hls_time': segment_seconds, 'hls_playlist_type': 'vod', 'hls_flags': 'independent_segments',
+        'master_pl_name': MASTER_PLAYLISTS["hls"], 'var_stream_map': stream_map,
+        'hls_segment_filename': os.path.join(directory, "stream_%v", "segment_%05d.ts"),
+    }
+
+
+def build_package_stream(file_path, package_format="hls", ladder=DEFAULT_LADDER, output_dir=None,
+                         segment_seconds=PACKAGE_SEGMENT_SECONDS, copy=False, threads=None):
+    """
+    Build one ffmpeg command that writes an HLS or DASH package of file_path.
+    The source is decoded once and the video split into one branch per ladder rung, each
+    scaled and encoded with H.264 at the rung's bitrate, with keyframes aligned across
+    renditions at every segment boundary. With `copy`, an H.264 source is segmented as it is,
+    as a single rendition, without re-encoding its video; segments then start on the source's
+    own keyframes. Returns (stream_spec, master playlist path). Raises ValueError for
+    unsupported sources or options.
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise ValueError(f"Unsupported package format: {package_format}")
+    probe = probe_file(file_path)
+    video_info = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+    if video_info is None:
+        raise ValueError("No video stream found in the file.")
+    if copy and video_info.get('codec_name') != 'h264':
+        raise ValueError(f"Only H.264 video can be repackaged without re-encoding (this is {video_info.get('codec_name')}).")
+    audio_info = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
+    has_audio = audio_info is not None
+
+    directory, master = package_outputs(file_path, package_format, output_dir)
+    source = ffmpeg.input(file_path)
+    streams = []
+    kwargs = {'y': None}
+
+    if copy:
+        rungs = [None]
+        streams.append(source['v:0'])
+        kwargs['c:v'] = 'copy'
+    else:
+        rungs = fit_ladder(parse_ladder(ladder) if isinstance(ladder, str) else ladder, display_size(file_path)[1])
+        videos = source.video.split() if len(rungs) > 1 else [source.video]
+        plan = FilterPlan.for_file(file_path)
+        kwargs.update(pix_fmt='yuv420p', **_keyframe_kwargs(plan.frame_rate, segment_seconds))
+        tuning = x264_tuning()
+        if 'preset' in tuning:
+            kwargs['preset'] = tuning['preset']
+        threads = threads or tuning.get('threads')
+        if threads:
+            kwargs['threads'] = threads
+        for i, rung in enumerate(rungs):
+            streams.append(FilterPlan(plan.width, plan.height, plan.frame_rate).scale(-2, rung['height']).apply(videos[i]))
+            kwargs[f'c:v:{i}'] = 'libx264'
+            kwargs[f'b:v:{i}'] = f"{rung['bitrate']}k"
+            kwargs[f'maxrate:v:{i}'] = f"{round(rung['bitrate'] * MAXRATE_FACTOR)}k"
+            kwargs[f'bufsize:v:{i}'] = f"{round(rung['bitrate'] * BUFSIZE_FACTOR)}k"
+
+    # DASH lists one audio adaptation set for every rendition; HLS variants each carry their own audio.
+    shared_audio = package_format == "dash" or len(rungs) == 1
+    if has_audio:
+        audio_copies = 1 if shared_audio else len(rungs)
+        if audio_copies == 1:
+            streams.append(source['a:0'])
+        else:
+            audios = source['a:0'].asplit()
+            streams.extend(audios[i] for i in range(audio_copies))
+        if copy and audio_info and audio_info.get('codec_name') == 'aac':
+            kwargs['c:a'] = 'copy'
+        else:
+            kwargs.update({'c:a': 'aac', 'b:a': AUDIO_BITRATE})
+
+    os.makedirs(directory, exist_ok=True)
+    if package_format == "hls":
+        for i in range(len(rungs)):
+            os.makedirs(os.path.join(directory, f"stream_{i}"), exist_ok=True)
+        target = os.path.join(directory, "stream_%v", "playlist.m3u8")
+    else:
+        target = master
+    kwargs.update(_muxer_kwargs(package_format, directory, segment_seconds, len(rungs), has_audio, shared_audio))
+    logging.info(f"Packaging {file_path} as {package_format} with renditions {rungs}")
+    return ffmpeg.output(*streams, target, **kwargs), master
+
+
+def package(file_path, package_format="hls", ladder=DEFAULT_LADDER, output_dir=None,
+            segment_seconds=PACKAGE_SEGMENT_SECONDS, copy=False, threads=None):
+    """Write an HLS or DASH package without prompting. Returns the master playlist path, or None if ffmpeg failed."""
+    stream_spec, master = build_package_stream(file_path, package_format, ladder, output_dir, segment_seconds, copy, threads)
+    action = "Repackaging" if copy else "Encoding and packaging"
+    if run_command(stream_spec, f"{action} as {package_format.upper()}...", show_progress=True):
+        return master
+    return None
+
+
+def package_file(file_path):
+    """Package the file for adaptive streaming (HLS or DASH)."""
+    package_format = questionary.select("Select the streaming format:", choices=PACKAGE_FORMATS, use_indicator=True).ask()
+    if not package_format: return
+
+    video_info = next((s for s in probe_file(file_path)['streams'] if s['codec_type'] == 'video'), None)
+    copy = False
+    if video_info and video_info.get('codec_name') == 'h264':
+        copy = questionary.confirm(
+            "The video is already H.264. Repackage it as it is, without re-encoding (a single rendition)?", default=False
+        ).ask()
+        if copy is None: return
+
+    ladder = DEFAULT_LADDER
+    if not copy:
+        def validate(text):
+            try:
+                parse_ladder(text)
+                return True
+            except ValueError as e:
+                return str(e)
+        ladder = questionary.text("Renditions (HEIGHTp:BITRATEk, comma-separated):", default=DEFAULT_LADDER, validate=validate).ask()
+        if not ladder: return
+
+    try:
+        master = package(file_path, package_format, ladder, copy=copy)
+    except ValueError as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        master = False
+    if master:
+        console.print(f"[bold green]Successfully packaged to {master}[/bold green]")
+    elif master is None:
+        console.print("[bold red]Packaging failed.[/bold red]")
+    questionary.press_any_key_to_continue().ask()
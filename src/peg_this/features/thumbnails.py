@@ -0,0 +1,185 @@
+import os
+import math
+import logging
+from pathlib import Path
+from fractions import Fraction
+
+import ffmpeg
+import questionary
+from rich.console import Console
+
+from peg_this.features.batch import print_batch_summary
+from peg_this.utils.ffmpeg_utils import probe_file, get_duration
+from peg_this.utils.filter_plan import FilterPlan
+from peg_this.utils.manifest import partial_name
+from peg_this.utils.scheduler import Job, JobScheduler, default_worker_count
+
+console = Console()
+
+SELECTION_MODES = {
+    "Scene changes": "scene",
+    "Most representative frames": "thumbnail",
+    "Even intervals": "interval",
+}
+IMAGE_FORMATS = ["jpg", "webp"]
+DEFAULT_COUNT = 12
+DEFAULT_COLUMNS = 4
+DEFAULT_WIDTH = 320
+SCENE_THRESHOLD = 0.3
+TILE_PADDING = 4
+# Most frames the thumbnail filter holds per pick; longer sections are decimated to fit.
+MAX_THUMBNAIL_BATCH = 120
+
+
+def _frame_rate(file_path):
+    try:
+        video = next(s for s in probe_file(file_path)['streams'] if s['codec_type'] == 'video')
+        return float(Fraction(video.get('avg_frame_rate') or video['r_frame_rate']))
+    except (ffmpeg.Error, StopIteration, KeyError, ValueError, ZeroDivisionError):
+        return 25.0
+
+
+def has_video_stream(file_path):
+    try:
+        return any(s['codec_type'] == 'video' for s in probe_file(file_path)['streams'])
+    except (ffmpeg.Error, KeyError):
+        return False
+
+
+def select_frames(video, file_path, mode="scene", count=DEFAULT_COUNT, width=DEFAULT_WIDTH, scene_threshold=SCENE_THRESHOLD):
+    """
+    Pick up to `count` frames from a video stream, scaled to `width`:
+    - 'interval': evenly spaced frames (an fps filter at count/duration).
+    - 'scene': frames where the picture changes by more than scene_threshold (0-1), at least
+      1/(count+1) of the duration apart, so the picks spread over the whole video instead of
+      all coming from the first few cuts.
+    - 'thumbnail': the most representative frame of each 1/count of the video. Long sections
+      are sampled down to MAX_THUMBNAIL_BATCH frames, since the filter buffers a whole section.
+    Frames are scaled down before scene detection and the thumbnail filter's frame buffer,
+    which work just as well on small frames and cost far less.
+    """
+    if mode not in SELECTION_MODES.values():
+        raise ValueError(f"Unknown selection mode: {mode}")
+    duration = get_duration(file_path)
+    plan = FilterPlan.for_file(file_path)
+    if mode == 'interval':
+        plan.fps(Fraction(count / duration).limit_denominator(10000) if duration else 1)
+    batch = MAX_THUMBNAIL_BATCH
+    if mode == 'thumbnail' and duration:
+        batch = max(2, int(duration * _frame_rate(file_path) / count))
+        if batch > MAX_THUMBNAIL_BATCH:
+            batch = MAX_THUMBNAIL_BATCH
+            plan.fps(Fraction(count * batch / duration).limit_denominator(10000))
+    video = plan.scale(width, -2).apply(video)
+    if mode == 'scene':
+        gap = duration / (count + 1) if duration else 0
+        return video.filter('select', f'gt(scene,{scene_threshold})*max(isnan(prev_selected_t),gte(t-prev_selected_t,{gap:.3f}))')
+    if mode == 'thumbnail':
+        return video.filter('thumbnail', batch)
+    return video
+
+
+def _image_kwargs(image_format):
+    # mjpeg's qscale runs 2 (best) to 31; libwebp takes a 0-100 quality.
+    return {'quality': 80} if image_format == 'webp' else {'q:v': 3}
+
+
+def thumbnail_outputs(file_path, image_format="jpg", sheet=True, output_dir=None):
+    """Where a file's contact sheet, or its numbered thumbnails (an ffmpeg %03d pattern), are written."""
+    stem = Path(file_path).stem
+    directory = output_dir or os.path.dirname(os.path.abspath(file_path))
+    if sheet:
+        return os.path.join(directory, f"{stem}_sheet.{image_format}")
+    return os.path.join(directory, f"{stem}_thumbs", f"{stem}_%03d.{image_format}")
+
+
+def build_thumbnail_stream(file_path, output_file, mode="scene", count=DEFAULT_COUNT, columns=DEFAULT_COLUMNS,
+                           width=DEFAULT_WIDTH, image_format="jpg", sheet=True, scene_threshold=SCENE_THRESHOLD):
+    """
+    One ffmpeg command that decodes file_path once and writes either a contact sheet (the
+    selected frames tiled `columns` wide) or up to `count` numbered images to output_file.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    video = select_frames(ffmpeg.input(file_path).video, file_path, mode, count, width, scene_threshold)
+    if sheet:
+        columns = max(1, min(columns, count))
+        rows = math.ceil(count / columns)
+        # tile emits a partly filled sheet at the end of the input, so fewer scenes still give a sheet.
+        video = video.filter('tile', f"{columns}x{rows}", padding=TILE_PADDING, margin=TILE_PADDING)
+        return video.output(output_file, update=1, y=None, **{'frames:v': 1}, **_image_kwargs(image_format))
+    return video.output(output_file, vsync='passthrough', y=None, **{'frames:v': count}, **_image_kwargs(image_format))
+
+
+def build_thumbnail_job(file_path, output_dir=None, image_format="jpg", sheet=True, **options):
+    """The scheduler Job making thumbnails for one file. Sheets are written under a temporary name and renamed when complete."""
+    output_file = thumbnail_outputs(file_path, image_format, sheet, output_dir)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    temp_file = partial_name(output_file) if sheet else None
+    stream_spec = build_thumbnail_stream(file_path, temp_file or output_file, image_format=image_format, sheet=sheet, **options)
+    return Job(os.path.relpath(file_path), [stream_spec], source_file=file_path, output_file=output_file, temp_file=temp_file)
+
+
+def make_thumbnails(files, workers=None, output_dir=None, image_format="jpg", sheet=True, mode="scene",
+                    count=DEFAULT_COUNT, columns=DEFAULT_COLUMNS, width=DEFAULT_WIDTH, scene_threshold=SCENE_THRESHOLD):
+    """
+    Make a contact sheet (or numbered thumbnails) for every file, `workers` files at a time, on
+    the same scheduler as batch conversion. `files` may be a lazy iterable. Each file is decoded once.
+    Returns (jobs, skipped) like run_batch.
+    """
+    workers = workers or default_worker_count(1)
+    jobs = []
+    skipped = []
+    options = dict(mode=mode, count=count, columns=columns, width=width, scene_threshold=scene_threshold)
+
+    def runnable_jobs():
+        for file in files:
+            if not has_video_stream(file):
+                skipped.append((file, "No video stream"))
+                continue
+            try:
+                job = build_thumbnail_job(os.path.abspath(file), output_dir, image_format, sheet, **options)
+            except (ValueError, OSError) as e:
+                logging.error(f"Thumbnail error for file {file}: {e}")
+                job = Job(file, [])
+                job.error = str(e)
+            jobs.append(job)
+            if job.stream_specs:
+                yield job
+
+    JobScheduler(workers).run(runnable_jobs(), f"Making thumbnails with {workers} worker(s)...")
+    return jobs, skipped
+
+
+def create_thumbnails(file_path):
+    """Interactively make a contact sheet or a set of thumbnails for one file."""
+    output = questionary.select(
+        "What would you like to make?",
+        choices=["Contact sheet", "Separate thumbnails"],
+        use_indicator=True
+    ).ask()
+    if not output: return
+
+    mode_label = questionary.select(
+        "Which frames should be picked?",
+        choices=list(SELECTION_MODES),
+        use_indicator=True
+    ).ask()
+    if not mode_label: return
+
+    count = questionary.text(
+        "How many frames?",
+        default=str(DEFAULT_COUNT),
+        validate=lambda text: text.isdigit() and int(text) > 0 or "Please enter a positive whole number."
+    ).ask()
+    if not count: return
+
+    image_format = questionary.select("Image format:", choices=IMAGE_FORMATS, use_indicator=True).ask()
+    if not image_format: return
+
+    sheet = output == "Contact sheet"
+    jobs, skipped = make_thumbnails(
+        [file_path], workers=1, image_format=image_format, sheet=sheet, mode=SELECTION_MODES[mode_label], count=int(count)
+    )
+    print_batch_summary(jobs, skipped, title="Thumbnails Complete")
+    questionary.press_any_key_to_continue().ask()
@@ -1,26 +1,354 @@
-
+import os
+import bisect
+import shutil
+import logging
+import subprocess
+import tempfile
 from pathlib import Path
 
 import ffmpeg
 import questionary
 from rich.console import Console
 
-from peg_this.utils.ffmpeg_utils import run_command
+from peg_this.features.convert import AUDIO_CODECS, AUDIO_ENCODERS, matching_h264_kwargs, video_encode_kwargs
+from peg_this.utils.chunked import write_concat_list
+from peg_this.utils.ffmpeg_utils import (
+    run_command, probe_file, has_audio_stream, get_keyframe_times, is_idr_keyframe, parse_timestamp
+)
 
 console = Console()
 
+# Outputs written by a single ffmpeg process in multi-range trimming; bounds open files and memory.
+MAX_OUTPUTS_PER_PASS = 16
+# Keyframes checked on each side of a smart cut while looking for an IDR frame to cut on.
+IDR_SEARCH_LIMIT = 8
+# Stream properties a re-encoded smart-cut edge must share with the source to be joined to it.
+SMART_CUT_MATCH = ('codec_name', 'profile', 'pix_fmt', 'width', 'height')
+# Audio encoders for re-encoded clips of audio files, by extension.
+AUDIO_CONTAINER_CODECS = {**AUDIO_CODECS, "ogg": "libvorbis", "opus": "libopus", "m4a": "aac"}
+LOSSLESS_AUDIO_FORMATS = ("flac", "wav")
+GIF_REENCODE_ERROR = "GIFs can only be trimmed in fast mode; convert the trimmed clip to GIF for a frame-accurate cut."
+
+TRIM_MODES = {
+    "Fast (lossless, cuts snap to keyframes)": "fast",
+    "Smart (frame-accurate, re-encodes only the edges)": "smart",
+    "Accurate (re-encode the whole clip)": "accurate",
+}
+
+
+def _first_video_stream(file_path):
+    return next((s for s in probe_file(file_path).get('streams', []) if s.get('codec_type') == 'video'
+                 and not s.get('disposition', {}).get('attached_pic')), None)
+
+
+def reencode_kwargs(output_file, has_audio=True, has_video=True):
+    """
+    Encoder options for a re-encoded clip, chosen for the output's container: VP9/Opus for WebM,
+    the extract-audio codecs for audio files, H.264/AAC otherwise. Raises ValueError for GIF,
+    which needs a palette pass (see convert) rather than a plain re-encode.
+    """
+    output_format = Path(output_file).suffix.lstrip('.').lower()
+    if output_format == "gif":
+        raise ValueError(GIF_REENCODE_ERROR)
+    kwargs = {'y': None}
+    if output_format in AUDIO_CONTAINER_CODECS:
+        kwargs['vn'] = None
+        if has_audio:
+            kwargs['c:a'] = AUDIO_CONTAINER_CODECS[output_format]
+            if output_format not in LOSSLESS_AUDIO_FORMATS:
+                kwargs['b:a'] = '192k'
+        return kwargs
+    if has_video:
+        kwargs.update(video_encode_kwargs(output_format, "high"))
+    else:
+        kwargs['vn'] = None
+    if has_audio:
+        kwargs['c:a'] = AUDIO_ENCODERS.get(output_format, 'aac')
+        kwargs['b:a'] = '192k'
+    return kwargs
+
+
+def _trim_accurate(file_path, start, end, output_file, description="Trimming video (re-encoding)..."):
+    kwargs = reencode_kwargs(output_file, has_audio_stream(file_path), _first_video_stream(file_path) is not None)
+    # Input-side -ss seeks quickly, and re-encoding makes the cut land on the exact frame.
+    stream = ffmpeg.input(file_path, ss=start, t=end - start).output(output_file, **kwargs)
+    return run_command(stream, description, show_progress=True, duration=end - start)
+
+
+def _trim_smart(file_path, start, end, output_file):
+    """
+    Frame-accurate cut that re-encodes only the partial GOPs at each end:
+    [start, first IDR frame) and [last IDR frame, end) are encoded with settings matching
+    the source, the IDR-aligned middle is stream-copied, and the three pieces are joined
+    with the concat demuxer. Audio is copied for the whole range.
+    The pieces are MPEG-TS, so each one carries its own SPS/PPS in-band at every IDR frame:
+    the encoder's parameter sets never match the source's byte for byte, and the concat
+    demuxer would otherwise keep only the first piece's.
+    """
+    video_info = _first_video_stream(file_path)
+    if not video_info or video_info.get('codec_name') != 'h264':
+        console.print("[bold yellow]Smart cut needs an H.264 source; re-encoding the whole clip instead.[/bold yellow]")
+        return _trim_accurate(file_path, start, end, output_file)
+
+    try:
+        keyframes = get_keyframe_times(file_path)
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"Could not index keyframes of {file_path}: {e}")
+        keyframes = []
+    # Only IDR frames are safe to cut on; open-GOP I-frames can reference frames before the cut.
+    first_index = next(
+        (i for i in range(bisect.bisect_left(keyframes, start), len(keyframes))[:IDR_SEARCH_LIMIT]
+         if is_idr_keyframe(file_path, keyframes[i])), len(keyframes)
+    )
+    last_index = next(
+        (i for i in range(bisect.bisect_right(keyframes, end) - 1, -1, -1)[:IDR_SEARCH_LIMIT]
+         if is_idr_keyframe(file_path, keyframes[i])), -1
+    )
+    first_key = keyframes[first_index] if first_index < len(keyframes) else None
+    last_key = keyframes[last_index] if last_index >= 0 else None
+    if first_key is None or last_key is None or last_key <= first_key:
+        # No complete IDR-aligned GOP inside the range, so there is nothing to copy.
+        return _trim_accurate(file_path, start, end, output_file)
+
+    logging.info(f"Smart cut {file_path}: encode {start}-{first_key}, copy {first_key}-{last_key}, encode {last_key}-{end}")
+    encode_kwargs = {**matching_h264_kwargs(video_info), 'x264-params': 'repeat-headers=1'}
+    work_dir = tempfile.mkdtemp(prefix=".peg_this_trim_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        pieces = []
+        spans = [(start, first_key, 'encode'), (first_key, last_key, 'copy'), (last_key, end, 'encode')]
+        for i, (span_start, span_end, action) in enumerate(spans):
+            if span_end - span_start <= 0:
+                continue
+            piece = os.path.join(work_dir, f"piece_{i}.ts")
+            codec = {'c:v': 'copy'} if action == 'copy' else encode_kwargs
+            stream = ffmpeg.input(file_path, ss=span_start, t=span_end - span_start).output(
+                piece, map='0:v:0', an=None, y=None, **codec
+            )
+            label = "Copying keyframe-aligned middle..." if action == 'copy' else "Re-encoding cut edge..."
+            if not run_command(stream, label, show_progress=True, duration=span_end - span_start):
+                return None
+            if action == 'encode' and not _matches_source(piece, video_info):
+                console.print("[bold yellow]The re-encoded edge doesn't match the source's format; re-encoding the whole clip instead.[/bold yellow]")
+                return _trim_accurate(file_path, start, end, output_file)
+            pieces.append(piece)
+
+        list_file = os.path.join(work_dir, "pieces.txt")
+        write_concat_list(pieces, list_file)
+        video = ffmpeg.input(list_file, f='concat', safe=0)
+        if has_audio_stream(file_path):
+            audio = ffmpeg.input(file_path, ss=start, t=end - start)
+            stream = ffmpeg.output(video['v'], audio['a'], output_file, c='copy', y=None)
+        else:
+            stream = ffmpeg.output(video['v'], output_file, c='copy', y=None)
+        return run_command(stream, "Joining trimmed pieces...", show_progress=True, duration=end - start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _matches_source(piece, video_info):
+    try:
+        piece_info = next(s for s in ffmpeg.probe(piece)['streams'] if s['codec_type'] == 'video')
+    except (ffmpeg.Error, StopIteration, KeyError):
+        return False
+    mismatched = [key for key in SMART_CUT_MATCH if piece_info.get(key) != video_info.get(key)]
+    if mismatched:
+        logging.warning(f"Smart cut edge differs from the source in {', '.join(mismatched)}.")
+    return not mismatched
+
+
+def trim(file_path, start_time, end_time, output_file=None, mode="fast"):
+    """
+    Cut file_path between start_time and end_time without prompting. Returns the output path or None.
+    - fast: stream copy; cuts snap to keyframes.
+    - smart: frame-accurate, re-encoding only the GOPs at the cut points.
+    - accurate: re-encode the whole clip.
+    """
+    if mode not in TRIM_MODES.values():
+        raise ValueError(f"Unknown trim mode: {mode}")
+    output_file = output_file or f"{Path(file_path).stem}_trimmed{Path(file_path).suffix}"
+
+    if mode == "fast":
+        stream = ffmpeg.input(file_path, ss=start_time, to=end_time).output(output_file, c='copy', y=None)
+        ok = run_command(stream, "Trimming video...", show_progress=True)
+    else:
+        if Path(output_file).suffix.lower() == ".gif":
+            raise ValueError(GIF_REENCODE_ERROR)
+        start, end = parse_timestamp(start_time), parse_timestamp(end_time)
+        if end <= start:
+            raise ValueError("End time must be after start time.")
+        if mode == "smart":
+            ok = _trim_smart(file_path, start, end, output_file)
+        else:
+            ok = _trim_accurate(file_path, start, end, output_file)
+
+    return output_file if ok else None
+
+
+def parse_ranges(text):
+    """
+    Parse time ranges from text: one range per line or comma-separated, each either
+    `start-end` or `start,end[,name]` (CSV). Lines starting with # and a CSV header are ignored.
+    Returns a list of (start_seconds, end_seconds, name_or_None). Raises ValueError.
+    """
+    ranges = []
+    if '\n' in text.strip():
+        lines = text.splitlines()
+    elif '-' in text:
+        lines = text.split(',') # inline "start-end, start-end" list
+    else:
+        lines = [text]
+    for raw in lines:
+        line = raw.strip()
+        if not line or line.startswith('#'):
+            continue
+        if ',' in line or '\t' in line:
+            fields = [f.strip() for f in line.replace('\t', ',').split(',')]
+        else:
+            fields = [f.strip() for f in line.split('-', 1)]
+        if len(fields) < 2:
+            raise ValueError(f"Invalid range: {line}")
+        try:
+            start, end = parse_timestamp(fields[0]), parse_timestamp(fields[1])
+        except ValueError:
+            if not ranges and not any(ch.isdigit() for ch in fields[0]):
+                continue # header row such as "start,end,name"
+            raise ValueError(f"Invalid range: {line}")
+        if end <= start:
+            raise ValueError(f"Range ends before it starts: {line}")
+        name = fields[2] if len(fields) > 2 and fields[2] else None
+        ranges.append((start, end, name))
+    if not ranges:
+        raise ValueError("No time ranges given.")
+    return ranges
+
+
+def load_ranges_file(path):
+    """Read time ranges from a CSV or text file (see parse_ranges)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_ranges(f.read() + '\n')
+
+
+def _clip_name(file_path, index, name, output_dir):
+    suffix = Path(file_path).suffix
+    if name:
+        safe = "".join(ch if ch.isalnum() or ch in " ._-" else "_" for ch in name).strip()
+        file_name = f"{safe}{suffix}"
+    else:
+        file_name = f"{Path(file_path).stem}_clip{index + 1:02d}{suffix}"
+    return os.path.join(output_dir, file_name) if output_dir else file_name
+
+
+def trim_many(file_path, ranges, output_dir=None, mode="fast", max_outputs=MAX_OUTPUTS_PER_PASS):
+    """
+    Cut many clips out of one file with one ffmpeg process per group of up to `max_outputs`
+    clips instead of one per clip. Ranges are sorted so each group covers a stretch of the source.
+    - fast: each clip is its own input, seeked on the input side to the keyframe before its start
+      and stream-copied, so only the clip's own packets are read and audio stays in sync.
+    - accurate: one decode from the group's earliest start feeds split/asplit branches that are
+      trimmed and encoded per clip, with encoders chosen for each clip's container.
+    Returns a list of (output_path or None) in the order the ranges were given.
+    """
+    if mode not in ("fast", "accurate"):
+        raise ValueError("Multi-range trimming supports the fast and accurate modes.")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    has_audio = has_audio_stream(file_path)
+    has_video = _first_video_stream(file_path) is not None
+    if not has_audio and not has_video:
+        raise ValueError("No audio or video stream found in the file.")
+    outputs = [_clip_name(file_path, i, name, output_dir) for i, (_, _, name) in enumerate(ranges)]
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    results = [None] * len(ranges)
+
+    for group_start in range(0, len(order), max_outputs):
+        group = order[group_start:group_start + max_outputs]
+        base = min(ranges[i][0] for i in group)
+        last = max(ranges[i][1] for i in group)
+
+        if mode == "fast":
+            specs = []
+            for i in group:
+                clip = ffmpeg.input(file_path, ss=ranges[i][0], to=ranges[i][1])
+                streams = ([clip['v:0']] if has_video else []) + ([clip['a:0']] if has_audio else [])
+                specs.append(ffmpeg.output(*streams, outputs[i], c='copy', y=None))
+        else:
+            source = ffmpeg.input(file_path, ss=base)
+            videos = source.video.split() if has_video else None
+            audios = source.audio.asplit() if has_audio else None
+            specs = []
+            for n, i in enumerate(group):
+                start, end = ranges[i][0] - base, ranges[i][1] - base
+                streams = []
+                if has_video:
+                    streams.append(videos[n].trim(start=start, end=end).setpts('PTS-STARTPTS'))
+                if has_audio:
+                    streams.append(audios[n].filter('atrim', start=start, end=end).filter('asetpts', 'PTS-STARTPTS'))
+                specs.append(ffmpeg.output(*streams, outputs[i], **reencode_kwargs(outputs[i], has_audio, has_video)))
+
+        description = f"Cutting clips {group_start + 1}-{group_start + len(group)} of {len(ranges)}..."
+        if run_command(ffmpeg.merge_outputs(*specs), description, show_progress=True, duration=last - base):
+            for i in group:
+                results[i] = outputs[i]
+    return results
+
 
 def trim_video(file_path):
     """Cut a video by specifying start and end times."""
+    how = questionary.select(
+        "What would you like to cut?",
+        choices=["A single clip", "Several clips (from a list of ranges or a CSV file)"],
+        use_indicator=True
+    ).ask()
+    if not how: return
+    if how != "A single clip":
+        trim_clips(file_path)
+        return
+
     start_time = questionary.text("Enter start time (HH:MM:SS or seconds):").ask()
     if not start_time: return
     end_time = questionary.text("Enter end time (HH:MM:SS or seconds):").ask()
     if not end_time: return
+    mode = questionary.select("Select trim mode:", choices=list(TRIM_MODES), use_indicator=True).ask()
+    if not mode: return
+
+    try:
+        output_file = trim(file_path, start_time, end_time, mode=TRIM_MODES[mode])
+    except ValueError as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        questionary.press_any_key_to_continue().ask()
+        return
+
+    if output_file:
+        console.print(f"[bold green]Successfully trimmed to {output_file}[/bold green]")
+    else:
+        console.print("[bold red]Failed to trim video.[/bold red]")
+    questionary.press_any_key_to_continue().ask()
+
+
+def trim_clips(file_path):
+    """Prompt for several time ranges and cut them all in one pass over the source."""
+    answer = questionary.text(
+        "Enter ranges as start-end separated by commas (e.g. 00:01:00-00:01:30, 300-315), or a CSV file path:"
+    ).ask()
+    if not answer: return
+    mode = questionary.select(
+        "Select trim mode:",
+        choices=[label for label, value in TRIM_MODES.items() if value != "smart"],
+        use_indicator=True
+    ).ask()
+    if not mode: return
+
+    try:
+        ranges = load_ranges_file(answer) if os.path.isfile(answer) else parse_ranges(answer)
+        results = trim_many(file_path, ranges, mode=TRIM_MODES[mode])
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        questionary.press_any_key_to_continue().ask()
+        return
 
-    output_file = f"{Path(file_path).stem}_trimmed{Path(file_path).suffix}"
-    
-    stream = ffmpeg.input(file_path, ss=start_time, to=end_time).output(output_file, c='copy', y=None)
-    
-    run_command(stream, "Trimming video...", show_progress=True)
-    console.print(f"[bold green]Successfully trimmed to {output_file}[/bold green]")
+    succeeded = [r for r in results if r]
+    console.print(f"[bold green]Created {len(succeeded)} of {len(results)} clip(s).[/bold green]")
+    for output_file in succeeded:
+        console.print(f"  -> {output_file}")
     questionary.press_any_key_to_continue().ask()
@@ -0,0 +1,369 @@
+import os
+import time
+import signal
+import logging
+import sqlite3
+import threading
+from collections import deque
+
+import questionary
+from rich.console import Console
+
+from peg_this.features.batch import (
+    batch_settings, batch_output_name, build_batch_job, default_batch_workers, print_batch_summary
+)
+from peg_this.features.convert import OUTPUT_FORMATS, VIDEO_FORMATS, AUDIO_FORMATS, QUALITY_PRESETS, ask_loudness
+from peg_this.utils.manifest import BatchManifest, is_partial
+from peg_this.utils.metrics import state_dir
+from peg_this.utils.scanner import scan_media, is_scanned_media
+from peg_this.utils.scheduler import JobScheduler, threads_per_worker
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+console = Console()
+
+# How long a file's size and mtime must stay the same before it counts as fully uploaded.
+STABLE_SECONDS = 5.0
+# Rescan interval when inotify isn't available.
+POLL_SECONDS = 2.0
+# How often files that are still being written are checked again.
+CHECK_SECONDS = 1.0
+# Finished jobs kept for the summary shown when watching stops; older ones are dropped.
+WATCH_HISTORY = 1000
+
+
+class FolderWatcher:
+    """
+    Reports media files under `root` that are new or have changed. Uses inotify when the
+    inotify_simple package is installed (Linux only), and otherwise rescans the folder every
+    poll_seconds. The first call reports every file that is already there.
+    """
+
+    def __init__(self, root, recursive=False, include=None, exclude=None, sniff=False, poll_seconds=POLL_SECONDS):
+        self.root = root
+        self.recursive = recursive
+        self.scan_options = dict(include=include, exclude=exclude, sniff=sniff)
+        self.poll_seconds = poll_seconds
+        self._snapshot = None
+        self._last_scan = 0.0
+        self._dirs = {}
+        self._inotify = None
+        if INotify is not None:
+            try:
+                self._inotify = INotify()
+                self._watch_tree(root)
+            except OSError as e:
+                logging.warning(f"inotify unavailable, polling {root} instead: {e}")
+                if self._inotify:
+                    self._inotify.close()
+                self._inotify = None
+                self._dirs = {}
+        self.mode = "inotify" if self._inotify else "polling"
+
+    def _watch_tree(self, path):
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY
+        self._dirs[self._inotify.add_watch(path, mask)] = path
+        if self.recursive:
+            for dirpath, dirnames, _ in os.walk(path):
+                for name in dirnames:
+                    subdir = os.path.join(dirpath, name)
+                    self._dirs[self._inotify.add_watch(subdir, mask)] = subdir
+
+    def _scan(self, root=None):
+        """{path: (size, mtime_ns)} for the media files under root (the watched folder by default)."""
+        snapshot = {}
+        for path in scan_media(root or self.root, recursive=self.recursive, **self.scan_options):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def changed(self, timeout=CHECK_SECONDS):
+        """Media files that appeared or changed since the last call, waiting up to `timeout` seconds for one."""
+        if self._snapshot is None:
+            self._snapshot = self._scan()
+            self._last_scan = time.monotonic()
+            return list(self._snapshot)
+        if self._inotify is None:
+            time.sleep(timeout)
+            if time.monotonic() - self._last_scan < self.poll_seconds:
+                return []
+            snapshot = self._scan()
+            self._last_scan = time.monotonic()
+            changed = [path for path, stat in snapshot.items() if self._snapshot.get(path) != stat]
+            self._snapshot = snapshot
+            return changed
+
+        paths = set()
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                # Events were dropped; fall back to looking at everything.
+                logging.warning(f"Too many changes in {self.root} at once; rescanning it.")
+                paths.update(self._scan())
+                continue
+            directory = self._dirs.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.normpath(os.path.join(directory, event.name))
+            if event.mask & flags.ISDIR:
+                # A folder moved in arrives with its files already inside, and they send no events.
+                if self.recursive and event.mask & (flags.CREATE | flags.MOVED_TO):
+                    self._watch_tree(path)
+                    paths.update(self._scan(path))
+                continue
+            paths.add(path)
+        return [path for path in paths if is_scanned_media(path, self.root, **self.scan_options)]
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+
+class WatchQueue:
+    """
+    Files a watched folder is waiting to convert, kept on disk so that a restarted watcher
+    resumes them first. Files whose conversion failed are remembered (by size and mtime) and
+    left alone until they change. The outputs written into the folder are recorded too, so
+    they are never picked up as new files.
+    """
+
+    def __init__(self, folder, db_path=None):
+        self.folder = os.path.realpath(folder)
+        self.db_path = db_path or os.path.join(state_dir(), 'watch_queue.sqlite3')
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+
+    def _connect(self):
+        if self._db is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS queue ("
+                    "folder TEXT, source TEXT, status TEXT, size INTEGER, mtime_ns INTEGER, added REAL, "
+                    "PRIMARY KEY (folder, source))"
+                )
+                self._db.execute("CREATE TABLE IF NOT EXISTS outputs (folder TEXT, path TEXT, PRIMARY KEY (folder, path))")
+                self._db.commit()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Watch queue unavailable ({self.db_path}); pending files won't survive a restart: {e}")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return []
+            try:
+                rows = db.execute(sql, params).fetchall()
+                db.commit()
+                return rows
+            except sqlite3.Error as e:
+                logging.warning(f"Watch queue update failed: {e}")
+                return []
+
+    def _set(self, file_path, status):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return self.remove(file_path)
+        self._execute(
+            "INSERT OR REPLACE INTO queue VALUES (?, ?, ?, ?, ?, ?)",
+            (self.folder, os.path.realpath(file_path), status, st.st_size, st.st_mtime_ns, time.time())
+        )
+
+    def add(self, file_path):
+        self._set(file_path, 'pending')
+
+    def failed(self, file_path):
+        self._set(file_path, 'failed')
+
+    def remove(self, file_path):
+        self._execute("DELETE FROM queue WHERE folder = ? AND source = ?", (self.folder, os.path.realpath(file_path)))
+
+    def add_output(self, output_path):
+        self._execute("INSERT OR IGNORE INTO outputs VALUES (?, ?)", (self.folder, os.path.realpath(output_path)))
+
+    def is_output(self, file_path):
+        rows = self._execute(
+            "SELECT 1 FROM outputs WHERE folder = ? AND path = ?", (self.folder, os.path.realpath(file_path))
+        )
+        return bool(rows)
+
+    def pending(self):
+        """Queued files in the order they arrived, including any that were converting when the watcher stopped."""
+        rows = self._execute(
+            "SELECT source FROM queue WHERE folder = ? AND status = 'pending' ORDER BY added", (self.folder,)
+        )
+        return [source for source, in rows]
+
+    def has_failed(self, file_path):
+        """True if this exact version of the file (by size and mtime) already failed to convert."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        rows = self._execute(
+            "SELECT size, mtime_ns FROM queue WHERE folder = ? AND source = ? AND status = 'failed'",
+            (self.folder, os.path.realpath(file_path))
+        )
+        return bool(rows) and tuple(rows[0]) == (st.st_size, st.st_mtime_ns)
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def watch(folder, output_format, quality="medium", workers=None, audio_bitrate="192k", recursive=False, include=None,
+          exclude=None, sniff=False, stable_seconds=STABLE_SECONDS, poll_seconds=POLL_SECONDS, loudness=None,
+          timeout=None, stall_timeout=None):
+    """
+    Convert media files as they land in `folder`, until interrupted (Ctrl-C or SIGTERM).
+    Files already there are converted first, then every new or changed file once its size and
+    mtime have stayed the same for `stable_seconds`, so half-uploaded files are never picked up.
+    Conversions use the batch presets, outputs and manifest, `workers` at a time; anything
+    already converted and up to date is skipped. Queued files are kept in a WatchQueue, so
+    after a restart the files that were waiting or converting are done first.
+    Returns the last WATCH_HISTORY jobs that were run.
+    """
+    workers = workers or default_batch_workers(output_format, quality)
+    threads = threads_per_worker(workers)
+    settings = batch_settings(output_format, quality, audio_bitrate, loudness)
+    manifest = BatchManifest()
+    queue = WatchQueue(folder)
+    watcher = FolderWatcher(folder, recursive, include, exclude, sniff, poll_seconds)
+    scheduler = JobScheduler(workers, timeout=timeout, stall_timeout=stall_timeout)
+    jobs = deque(maxlen=WATCH_HISTORY)
+
+    def skip(path):
+        if is_partial(path) or not os.path.isfile(path) or manifest.is_output(path) or queue.is_output(path):
+            return True
+        if queue.has_failed(path):
+            return True
+        return manifest.is_up_to_date(path, batch_output_name(path, output_format), settings)
+
+    def prepare(path):
+        try:
+            job = build_batch_job(path, output_format, quality, threads, audio_bitrate, manifest, loudness)
+        except Exception as e:
+            console.print(f"[bold red]An unexpected error occurred while preparing {path}: {e}[/bold red]")
+            logging.error(f"Watch convert error for file {path}: {e}")
+            queue.failed(path)
+            return None
+        if job is None:
+            console.print(f"[bold yellow]Skipping {path}: Source has no audio to convert.[/bold yellow]")
+            queue.remove(path)
+            return None
+        record = job.on_success
+
+        def on_success(job):
+            record(job)
+            queue.remove(job.source_file)
+
+        job.on_success = on_success
+        return job
+
+    def runnable_jobs():
+        ready = deque(queue.pending())
+        if ready:
+            logging.info(f"Resuming {len(ready)} queued file(s) in {folder}.")
+        waiting = {}
+        running = []
+        while not scheduler.stopping.is_set():
+            for job in [job for job in running if job.success or job.error]:
+                running.remove(job)
+                if not job.success:
+                    queue.failed(job.source_file)
+
+            if ready:
+                path = ready.popleft()
+                if skip(path):
+                    queue.remove(path)
+                    continue
+                job = prepare(path)
+                if job:
+                    queue.add_output(job.output_file)
+                    running.append(job)
+                    yield job
+                continue
+
+            for path in watcher.changed(CHECK_SECONDS):
+                waiting.setdefault(os.path.abspath(path), None)
+            now = time.monotonic()
+            for path, seen in list(waiting.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del waiting[path]
+                    continue
+                current = (st.st_size, st.st_mtime_ns)
+                if seen is None or seen[0] != current:
+                    waiting[path] = (current, now)
+                elif now - seen[1] >= stable_seconds and current[0] > 0:
+                    del waiting[path]
+                    if not skip(path):
+                        queue.add(path)
+                        ready.append(path)
+
+    description = f"Watching {folder} ({watcher.mode}) for files to convert to .{output_format} with {workers} worker(s)..."
+    # A service manager stops us with SIGTERM; treat it like Ctrl-C so running ffmpeg processes are killed too.
+    previous = signal.signal(signal.SIGTERM, _raise_interrupt) if threading.current_thread() is threading.main_thread() else None
+    try:
+        scheduler.run(runnable_jobs(), description, seen=jobs)
+    except KeyboardInterrupt:
+        console.print("[bold yellow]Stopped watching. Files still waiting will be converted next time.[/bold yellow]")
+        logging.info(f"Stopped watching {folder}.")
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGTERM, previous)
+        watcher.close()
+    return list(jobs)
+
+
+def watch_folder():
+    """Watch the current directory and convert media files as they arrive."""
+    output_format = questionary.select(
+        "Select output format for new files:",
+        choices=OUTPUT_FORMATS,
+        use_indicator=True
+    ).ask()
+    if not output_format: return
+
+    quality = None
+    if output_format in VIDEO_FORMATS:
+        quality_preset = questionary.select(
+            "Select quality preset:",
+            choices=list(QUALITY_PRESETS),
+            use_indicator=True
+        ).ask()
+        if not quality_preset: return
+        quality = QUALITY_PRESETS[quality_preset]
+
+    loudness = None
+    if output_format in AUDIO_FORMATS:
+        loudness = ask_loudness()
+        if loudness is None: return
+
+    recursive = questionary.confirm("Also watch subfolders?", default=False).ask()
+    if recursive is None: return
+
+    workers = questionary.text(
+        "Number of files to convert in parallel:",
+        default=str(default_batch_workers(output_format, quality)),
+        validate=lambda text: text.isdigit() and int(text) > 0 or "Please enter a positive whole number."
+    ).ask()
+    if not workers: return
+
+    console.print("[bold]Watching for new files. Press Ctrl-C to stop.[/bold]")
+    jobs = watch('.', output_format, quality or "medium", int(workers), recursive=recursive, loudness=loudness)
+    if jobs:
+        print_batch_summary(jobs, title="Watch Stopped")
+    questionary.press_any_key_to_continue().ask()
@@ -8,25 +8,20 @@ from rich.console import Console
 
 from peg_this.features.audio import extract_audio, remove_audio
 from peg_this.features.batch import batch_convert
+from peg_this.features.calibrate import calibrate_encoder
 from peg_this.features.convert import convert_file
 from peg_this.features.crop import crop_video
 from peg_this.features.inspect import inspect_file
+from peg_this.features.streaming import package_file
 from peg_this.features.join import join_videos
+from peg_this.features.thumbnails import create_thumbnails
 from peg_this.features.trim import trim_video
+from peg_this.features.watch import watch_folder
 from peg_this.utils.ffmpeg_utils import check_ffmpeg_ffprobe
+from peg_this.utils.metrics import configure_logging
 from peg_this.utils.ui_utils import select_media_file
 
 # --- Global Configuration ---
-# Configure logging
-log_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "ffmpeg_log.txt")
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, mode='w') # Overwrite log on each run
-    ]
-)
-
 # Initialize Rich Console
 console = Console()
 # --- End Global Configuration ---
@@ -41,8 +36,10 @@ def action_menu(file_path):
             choices=[
                 "Inspect File Details",
                 "Convert",
+                "Package for Streaming (HLS/DASH)",
                 "Trim Video",
-                "Crop Video (Visual)",
+                "Crop Video",
+                "Thumbnails / Contact Sheet",
                 "Extract Audio",
                 "Remove Audio",
                 questionary.Separator(),
@@ -57,8 +54,10 @@ def action_menu(file_path):
         actions = {
             "Inspect File Details": inspect_file,
             "Convert": convert_file,
+            "Package for Streaming (HLS/DASH)": package_file,
             "Trim Video": trim_video,
-            "Crop Video (Visual)": crop_video,
+            "Crop Video": crop_video,
+            "Thumbnails / Contact Sheet": create_thumbnails,
             "Extract Audio": extract_audio,
             "Remove Audio": remove_audio,
         }
@@ -78,6 +77,8 @@ def main_menu():
                 "Process a Single Media File",
                 "Join Multiple Videos",
                 "Batch Convert All Media in Directory",
+                "Watch Directory and Convert New Files",
+                "Calibrate Encoder for This Machine",
                 "Exit"
             ],
             use_indicator=True
@@ -95,10 +96,21 @@ def main_menu():
             join_videos()
         elif choice == "Batch Convert All Media in Directory":
             batch_convert()
+        elif choice == "Watch Directory and Convert New Files":
+            watch_folder()
+        elif choice == "Calibrate Encoder for This Machine":
+            calibrate_encoder()
 
 
 def main():
     """Main entry point for the application script."""
+    # Logs append to a rotating file in the per-user state directory (see utils/metrics.py).
+    log_file = configure_logging()
+    if len(sys.argv) > 1:
+        # Any arguments switch to the non-interactive command line (see `peg_this --help`).
+        from peg_this.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
     try:
         main_menu()
     except (KeyboardInterrupt, EOFError):
@@ -107,7 +119,8 @@ def main():
     except Exception as e:
         logging.exception("An unexpected error occurred.")
         console.print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
-        console.print(f"Details have been logged to {log_file}")
+        if log_file:
+            console.print(f"Details have been logged to {log_file}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
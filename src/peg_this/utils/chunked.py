@@ -0,0 +1,113 @@
+import os
+import csv
+import shutil
+import logging
+import tempfile
+
+import ffmpeg
+from rich.console import Console
+
+from peg_this.utils.ffmpeg_utils import run_command, has_audio_stream, get_duration
+from peg_this.utils.scheduler import Job, JobScheduler, default_worker_count, threads_per_worker
+
+console = Console()
+
+# Segment length used when none is given; short enough to keep every core busy
+# on feature-length sources, long enough that per-chunk encoder warm-up is negligible.
+DEFAULT_SEGMENT_SECONDS = 60
+# Sources shorter than this gain little from chunking, so the menu doesn't offer it.
+CHUNKING_MIN_DURATION = 600
+
+
+def split_into_segments(file_path, work_dir, segment_seconds=DEFAULT_SEGMENT_SECONDS):
+    """
+    Stream-copy the first video track into keyframe-aligned segments.
+    Returns a list of (segment_path, duration) in playback order, or None on failure.
+    """
+    pattern = os.path.join(work_dir, "source_%05d.mkv")
+    segment_list = os.path.join(work_dir, "segments.csv")
+    stream = ffmpeg.input(file_path).output(
+        pattern,
+        map='0:v:0',
+        c='copy',
+        f='segment',
+        segment_time=segment_seconds,
+        segment_list=segment_list,
+        segment_list_type='csv',
+        reset_timestamps=1,
+        y=None
+    )
+    if not run_command(stream, "Splitting source on keyframes...", show_progress=True):
+        return None
+
+    segments = []
+    with open(segment_list, newline='', encoding='utf-8') as f:
+        for name, start, end in csv.reader(f):
+            segments.append((os.path.join(work_dir, name), float(end) - float(start)))
+    return segments
+
+
+def write_concat_list(paths, list_file):
+    """Write a concat demuxer playlist, quoting paths the way the demuxer expects."""
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def chunked_encode(file_path, output_file, video_kwargs, audio_kwargs=None, workers=None,
+                   segment_seconds=DEFAULT_SEGMENT_SECONDS):
+    """
+    Re-encode a long video by splitting it on keyframes, encoding the segments in
+    parallel and joining them losslessly with the concat demuxer.
+    Every segment gets the same `video_kwargs` encoder options, so the joined stream
+    is a normal, continuous encode. The first audio track is encoded once with
+    `audio_kwargs`, in parallel with the video segments.
+    Returns the output path, or None on failure.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    # Keep the chunks next to the output so the final concat never crosses filesystems.
+    work_dir = tempfile.mkdtemp(prefix=".peg_this_chunks_", dir=output_dir)
+    try:
+        segments = split_into_segments(file_path, work_dir, segment_seconds)
+        if not segments:
+            console.print("[bold red]Could not split the source into segments.[/bold red]")
+            return None
+
+        workers = workers or default_worker_count()
+        threads = threads_per_worker(workers)
+        jobs = []
+        encoded = []
+        for i, (segment, duration) in enumerate(segments):
+            encoded_segment = os.path.join(work_dir, f"encoded_{i:05d}.mkv")
+            kwargs = {**video_kwargs, 'threads': threads}
+            stream = ffmpeg.input(segment).output(encoded_segment, an=None, y=None, **kwargs)
+            jobs.append(Job(f"Segment {i + 1}/{len(segments)}", [stream], output_file=encoded_segment, duration=duration))
+            encoded.append(encoded_segment)
+
+        audio_file = None
+        if audio_kwargs and has_audio_stream(file_path):
+            audio_file = os.path.join(work_dir, "audio.mka")
+            stream = ffmpeg.input(file_path).output(audio_file, map='0:a:0', vn=None, y=None, **audio_kwargs)
+            jobs.append(Job("Audio", [stream], output_file=audio_file, duration=get_duration(file_path)))
+
+        JobScheduler(workers).run(jobs, f"Encoding {len(segments)} segment(s) with {workers} worker(s)...")
+        failed = [job for job in jobs if not job.success]
+        if failed:
+            for job in failed:
+                console.print(f"[bold red]{job.name} failed: {job.error}[/bold red]")
+            return None
+
+        list_file = os.path.join(work_dir, "concat.txt")
+        write_concat_list(encoded, list_file)
+        video = ffmpeg.input(list_file, f='concat', safe=0)
+        if audio_file:
+            stream = ffmpeg.output(video['v'], ffmpeg.input(audio_file)['a'], output_file, c='copy', y=None)
+        else:
+            stream = ffmpeg.output(video['v'], output_file, c='copy', y=None)
+        if not run_command(stream, "Joining encoded segments...", show_progress=True, duration=sum(d for _, d in segments)):
+            return None
+        return output_file
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logging.info(f"Removed chunk working directory {work_dir}")
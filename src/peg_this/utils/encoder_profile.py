@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+import threading
+
+from peg_this.utils.probe_cache import default_cache_dir
+
+# libx264 presets from fastest to slowest.
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+CALIBRATION_GOALS = ["balanced", "speed", "quality"]
+
+# A thread count is "enough" once adding more buys less than this fraction of extra speed.
+THREAD_SCALING_TOLERANCE = 0.05
+
+
+def profile_path():
+    """Where this host's encoder profile is stored (next to the probe cache)."""
+    return os.path.join(default_cache_dir(), 'encoder_profile.json')
+
+
+def load_profile(path=None):
+    """The saved encoder profile, or None if this host hasn't been calibrated."""
+    path = path or profile_path()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable encoder profile {path}: {e}")
+        return None
+
+
+def save_profile(profile, path=None):
+    path = path or profile_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    global _tuning
+    with _tuning_lock:
+        _tuning = None
+    return path
+
+
+def best_threads(results):
+    """Per preset, the measurement with the fewest threads that is within tolerance of that preset's best speed."""
+    picks = {}
+    for preset in {r['preset'] for r in results}:
+        entries = [r for r in results if r['preset'] == preset]
+        fastest = max(r['fps'] for r in entries)
+        good_enough = [r for r in entries if r['fps'] >= fastest * (1 - THREAD_SCALING_TOLERANCE)]
+        picks[preset] = min(good_enough, key=lambda r: r['threads'])
+    return picks
+
+
+def choose_settings(results, goal="balanced", target_fps=None):
+    """
+    Pick a preset and thread count from calibration results.
+    - target_fps: the slowest (best compressing) preset that still reaches this speed,
+      or the fastest one if none does.
+    - speed: the highest frame rate.
+    - quality: the smallest file at the same CRF, i.e. the best compression.
+    - balanced: the smallest file among presets at least half as fast as the fastest.
+    """
+    picks = list(best_threads(results).values())
+    if not picks:
+        raise ValueError("No calibration results to choose from.")
+    order = lambda r: X264_PRESETS.index(r['preset']) if r['preset'] in X264_PRESETS else 0
+    if target_fps:
+        fast_enough = [r for r in picks if r['fps'] >= target_fps]
+        chosen = max(fast_enough, key=order) if fast_enough else max(picks, key=lambda r: r['fps'])
+    elif goal == "speed":
+        chosen = max(picks, key=lambda r: r['fps'])
+    elif goal == "quality":
+        chosen = min(picks, key=lambda r: (r['size'], -r['fps']))
+    elif goal == "balanced":
+        fastest = max(r['fps'] for r in picks)
+        chosen = min((r for r in picks if r['fps'] >= fastest / 2), key=lambda r: (r['size'], -r['fps']))
+    else:
+        raise ValueError(f"Unknown calibration goal: {goal}")
+    return {'preset': chosen['preset'], 'threads': chosen['threads']}
+
+
+_tuning = None
+_tuning_lock = threading.Lock()
+
+
+def x264_tuning():
+    """
+    libx264 options from this host's calibration, e.g. {'preset': 'faster', 'threads': 4}.
+    Empty if the host hasn't been calibrated, in which case x264's own defaults apply.
+    """
+    global _tuning
+    with _tuning_lock:
+        if _tuning is None:
+            profile = load_profile() or {}
+            _tuning = dict(profile.get('choice') or {})
+        return dict(_tuning)
@@ -1,12 +1,22 @@
 
+import os
+import re
+import json
+import asyncio
 import subprocess
+import threading
 import logging
+import time
 import sys
+from collections import deque
 
 import ffmpeg
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
 
+from peg_this.utils.metrics import record_job
+from peg_this.utils.probe_cache import get_cache
+
 console = Console()
 
 
@@ -32,13 +42,361 @@ def check_ffmpeg_ffprobe():
         sys.exit(1)
 
 
-def run_command(stream_spec, description="Processing...", show_progress=False):
+def find_input_file(full_command):
+    """Return the first input file (the argument after `-i`) of an ffmpeg command."""
+    for i, arg in enumerate(full_command):
+        if arg == '-i' and i + 1 < len(full_command):
+            return full_command[i + 1]
+    return None
+
+
+def probe_file(file_path):
+    """
+    Returns the ffprobe information for a file.
+    Results are cached by path, size and mtime, so each file is probed once
+    no matter how many features ask about it. Raises ffmpeg.Error like ffmpeg.probe.
+    """
+    return get_cache().cached(file_path, 'probe', lambda: ffmpeg.probe(file_path))
+
+
+def get_duration(file_path):
+    """Return the duration of a media file in seconds, or 0 if it can't be determined."""
+    try:
+        probe_info = probe_file(file_path)
+        return float(probe_info['format']['duration'])
+    except (ffmpeg.Error, KeyError, ValueError) as e:
+        logging.warning(f"Could not probe for duration: {e}")
+        return 0
+
+
+# Lines of ffmpeg's stderr kept for error reports; older lines are dropped.
+STDERR_TAIL_LINES = 200
+
+
+def parse_timestamp(value):
+    """Parse `HH:MM:SS.ms`, `MM:SS` or plain seconds into seconds. Raises ValueError."""
+    parts = str(value).strip().split(':')
+    if len(parts) > 3:
+        raise ValueError(f"Invalid timestamp: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Invalid timestamp: {value}")
+    return seconds
+
+
+def _parse_seconds(value):
+    """Parse an ffmpeg `HH:MM:SS.micro` timestamp into seconds."""
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        return None # e.g. "N/A" before the first frame is muxed
+
+
+def parse_progress_block(block, duration=0):
+    """
+    Turn one block of ffmpeg's `-progress` key/value output into a stats dict
+    with frame, fps, speed (x realtime), out_time (seconds), bitrate, percent and eta.
+    """
+    stats = {'frame': None, 'fps': None, 'speed': None, 'out_time': None, 'bitrate': block.get('bitrate')}
+    try:
+        stats['frame'] = int(block['frame'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        stats['fps'] = float(block['fps'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        stats['speed'] = float(block.get('speed', '').rstrip('x'))
+    except ValueError:
+        pass
+
+    # out_time_us is the modern key; out_time_ms is the legacy name for the same microseconds.
+    for key in ('out_time_us', 'out_time_ms'):
+        try:
+            stats['out_time'] = int(block[key]) / 1_000_000
+            break
+        except (KeyError, ValueError):
+            continue
+    if stats['out_time'] is None and 'out_time' in block:
+        stats['out_time'] = _parse_seconds(block['out_time'])
+
+    stats['percent'] = None
+    stats['eta'] = None
+    if duration > 0 and stats['out_time'] is not None:
+        stats['percent'] = max(0, min(stats['out_time'] / duration * 100, 100))
+        if stats['speed']:
+            stats['eta'] = max(0, (duration - stats['out_time']) / stats['speed'])
+    return stats
+
+
+def format_progress_stats(stats):
+    """A compact one-line summary of encode throughput for progress displays."""
+    if not stats:
+        return ""
+    parts = []
+    if stats.get('fps'):
+        parts.append(f"{stats['fps']:.0f} fps")
+    if stats.get('speed'):
+        parts.append(f"{stats['speed']:.2f}x")
+    if stats.get('bitrate') and stats['bitrate'] != 'N/A':
+        parts.append(stats['bitrate'].strip())
+    if stats.get('eta') is not None:
+        eta = int(stats['eta'])
+        parts.append(f"ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}")
+    return " | ".join(parts)
+
+
+def progress_columns():
+    """Columns shared by every ffmpeg progress bar: bar, percentage and live encode stats."""
+    return (
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        TextColumn("[dim]{task.fields[stats]}[/dim]"),
+    )
+
+
+# How often the watchdog checks a running ffmpeg against its time limits.
+WATCHDOG_INTERVAL = 0.5
+# Longest stderr line kept whole; anything longer is split rather than buffered without bound.
+MAX_LINE_BYTES = 64 * 1024
+
+
+def _env_seconds(name):
+    try:
+        value = float(os.environ.get(name, ''))
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+def watchdog_limits():
+    """
+    Default (timeout, stall_timeout) in seconds for ffmpeg processes, from PEG_THIS_TIMEOUT and
+    PEG_THIS_STALL_TIMEOUT. Both are off unless set: some graphs (GIF palettes, for one) report
+    no progress at all until they have read their whole input.
+    """
+    return _env_seconds('PEG_THIS_TIMEOUT'), _env_seconds('PEG_THIS_STALL_TIMEOUT')
+
+
+async def _read_lines(stream, on_line):
+    """Feed every line of an asyncio stream to on_line, splitting on carriage returns as well."""
+    pending = b''
+    while True:
+        chunk = await stream.read(MAX_LINE_BYTES)
+        if not chunk:
+            break
+        pending += chunk.replace(b'\r', b'\n')
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            on_line(line)
+        if len(pending) > MAX_LINE_BYTES:
+            on_line(pending)
+            pending = b''
+    if pending:
+        on_line(pending)
+
+
+def _writes_to_stdout(full_command):
+    return any(arg in ('-', 'pipe:', 'pipe:1') for arg in full_command[1:])
+
+
+async def run_ffmpeg_async(full_command, duration=0, on_progress=None, job=None, probe_seconds=None,
+                           timeout=None, stall_timeout=None):
+    """
+    Runs a full ffmpeg command line as an asyncio subprocess, so one event loop can supervise
+    many of them at once. Progress is read from ffmpeg's machine-readable `-progress pipe:1`
+    stream and stderr is drained into a bounded ring buffer.
+    - `on_progress(stats)` receives a dict from parse_progress_block after every update.
+    - `timeout` kills ffmpeg after that many seconds; `stall_timeout` kills it once progress
+      has not advanced for that long. Both default to watchdog_limits().
+    - Cancelling the task kills ffmpeg before the cancellation propagates.
+    - `job` and `probe_seconds` are added to the metrics record written when ffmpeg exits.
+    Returns (returncode, stderr_tail) where stderr_tail holds the last lines ffmpeg logged;
+    when the watchdog kills ffmpeg, the reason is the last line.
+    """
+    default_timeout, default_stall_timeout = watchdog_limits()
+    timeout = timeout if timeout is not None else default_timeout
+    stall_timeout = stall_timeout if stall_timeout is not None else default_stall_timeout
+
+    started = time.monotonic()
+    use_progress_pipe = not _writes_to_stdout(full_command)
+    if use_progress_pipe:
+        full_command = [full_command[0], '-progress', 'pipe:1', '-nostats'] + full_command[1:]
+
+    process = await asyncio.create_subprocess_exec(
+        *full_command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE if use_progress_pipe else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    state = {'block': {}, 'stats': None, 'position': None, 'advanced': started}
+
+    def on_stderr_line(line):
+        if line.strip():
+            text = line.decode('utf-8', errors='replace').rstrip()
+            tail.append(text)
+            logging.debug(f"ffmpeg stderr: {text}")
+            # Without the progress pipe, ffmpeg's own stats lines are the only sign of life.
+            if not use_progress_pipe:
+                state['advanced'] = time.monotonic()
+
+    def on_progress_line(line):
+        key, sep, value = line.decode('ascii', errors='replace').strip().partition('=')
+        if not sep:
+            return
+        state['block'][key] = value
+        # Every update ends with progress=continue (or progress=end for the last one).
+        if key == 'progress':
+            stats = parse_progress_block(state['block'], duration)
+            position = (stats['frame'], stats['out_time'], state['block'].get('total_size'))
+            if position != state['position']:
+                state['position'] = position
+                state['advanced'] = time.monotonic()
+            state['stats'] = stats
+            state['block'] = {}
+            if on_progress:
+                on_progress(stats)
+
+    readers = [asyncio.ensure_future(_read_lines(process.stderr, on_stderr_line))]
+    if use_progress_pipe:
+        readers.append(asyncio.ensure_future(_read_lines(process.stdout, on_progress_line)))
+    exited = asyncio.ensure_future(process.wait())
+
+    killed_for = None
+    try:
+        while not exited.done():
+            await asyncio.wait([exited], timeout=WATCHDOG_INTERVAL)
+            if exited.done():
+                break
+            now = time.monotonic()
+            if timeout and now - started > timeout:
+                killed_for = f"Timed out after {timeout:g}s; ffmpeg was killed."
+            elif stall_timeout and now - state['advanced'] > stall_timeout:
+                killed_for = f"No progress for {stall_timeout:g}s; ffmpeg was killed."
+            if killed_for:
+                logging.warning(f"{job or full_command[0]}: {killed_for}")
+                process.kill()
+                await exited
+        await asyncio.gather(*readers)
+    except asyncio.CancelledError:
+        killed_for = "Cancelled; ffmpeg was killed."
+        if process.returncode is None:
+            process.kill()
+        await asyncio.shield(exited)
+        for reader in readers:
+            reader.cancel()
+        raise
+    finally:
+        if killed_for:
+            tail.append(killed_for)
+        if process.returncode is not None:
+            record_job(
+                full_command, process.returncode, time.monotonic() - started,
+                input_file=find_input_file(full_command), media_duration=duration, probe_seconds=probe_seconds,
+                job=job, final_stats=state['stats'],
+                error=tail[-1] if process.returncode != 0 and tail else None,
+            )
+    return process.returncode, list(tail)
+
+
+def run_ffmpeg_process(full_command, duration=0, on_progress=None, job=None, probe_seconds=None,
+                       timeout=None, stall_timeout=None):
+    """Blocking wrapper around run_ffmpeg_async for callers outside an event loop."""
+    return asyncio.run(run_ffmpeg_async(
+        full_command, duration=duration, on_progress=on_progress, job=job, probe_seconds=probe_seconds,
+        timeout=timeout, stall_timeout=stall_timeout,
+    ))
+
+
+STDOUT_CHUNK_BYTES = 1024 * 1024
+
+
+def _drain_stderr(pipe, tail):
+    """Read ffmpeg's stderr until EOF, keeping only the last lines in a ring buffer."""
+    pending = b''
+    for chunk in iter(lambda: pipe.read(MAX_LINE_BYTES), b''):
+        pending += chunk.replace(b'\r', b'\n')
+        *lines, pending = pending.split(b'\n')
+        if len(pending) > MAX_LINE_BYTES:
+            lines.append(pending)
+            pending = b''
+        for line in lines:
+            if line.strip():
+                text = line.decode('utf-8', errors='replace').rstrip()
+                tail.append(text)
+                logging.debug(f"ffmpeg stderr: {text}")
+    if pending.strip():
+        tail.append(pending.decode('utf-8', errors='replace').rstrip())
+    pipe.close()
+
+
+def iter_ffmpeg_stdout(full_command, chunk_size=STDOUT_CHUNK_BYTES, job=None):
+    """
+    Runs an ffmpeg command that writes its output to stdout (`pipe:`) and yields that output in
+    chunks of exactly `chunk_size` bytes (the last may be shorter), so a rawvideo stream can be
+    read one frame at a time. Chunks are memoryviews of a single reused buffer: copy one with
+    bytes() if it has to outlive the next iteration. stderr is kept in a bounded ring buffer,
+    so memory use stays constant however much ffmpeg writes. Closing the generator early kills
+    ffmpeg. Raises ffmpeg.Error with the tail of the log if ffmpeg fails.
+    """
+    started = time.monotonic()
+    process = subprocess.Popen(
+        full_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+    )
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_thread = threading.Thread(target=_drain_stderr, args=(process.stderr, tail), daemon=True)
+    stderr_thread.start()
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    complete = False
+    try:
+        while True:
+            filled = 0
+            while filled < chunk_size:
+                count = process.stdout.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            if not filled:
+                break
+            yield view[:filled]
+            if filled < chunk_size:
+                break
+        complete = True
+    finally:
+        if not complete and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        stderr_thread.join()
+        record_job(
+            full_command, process.returncode, time.monotonic() - started,
+            input_file=find_input_file(full_command), job=job,
+            error=tail[-1] if process.returncode != 0 and tail else None,
+        )
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, "\n".join(tail).encode('utf-8'))
+
+
+def run_command(stream_spec, description="Processing...", show_progress=False, duration=None,
+                timeout=None, stall_timeout=None):
     """
     Runs an ffmpeg command using ffmpeg-python.
     - For simple commands, it runs directly.
-    - For commands with a progress bar, it generates the ffmpeg arguments,
-      runs them as a subprocess, and parses stderr to show progress,
-      mimicking the logic from the original script for accuracy.
+    - For commands with a progress bar, it generates the ffmpeg arguments and
+      runs them through run_ffmpeg_process, which reads ffmpeg's `-progress`
+      stream to show percentage, fps, speed and ETA. `duration` overrides the
+      length probed from the first input, for inputs ffprobe can't measure.
+      `timeout` and `stall_timeout` are passed on to its watchdog.
+    Returns "Success", or None after printing the tail of ffmpeg's log.
     """
     console.print(f"[bold cyan]{description}[/bold cyan]")
     
@@ -48,87 +406,139 @@ def run_command(stream_spec, description="Processing...", show_progress=False):
     logging.info(f"Executing command: {' '.join(full_command)}")
 
     if not show_progress:
-        try:
-            # Use ffmpeg.run() for simple, non-progress tasks. It's cleaner.
-            out, err = ffmpeg.run(stream_spec, capture_stdout=True, capture_stderr=True, quiet=True)
-            logging.info("Command successful (no progress bar).")
-            return out.decode('utf-8')
-        except ffmpeg.Error as e:
-            error_message = e.stderr.decode('utf-8')
+        # Nothing is captured in full: stderr goes through the runner's ring buffer, and commands
+        # that produce data on stdout should be read with iter_ffmpeg_stdout instead.
+        returncode, stderr_tail = run_ffmpeg_process(
+            full_command, job=description, timeout=timeout, stall_timeout=stall_timeout
+        )
+        if returncode != 0:
+            error_message = "\n".join(stderr_tail[-20:])
             console.print("[bold red]An error occurred:[/bold red]")
-            console.print(error_message)
-            logging.error(f"ffmpeg error:{error_message}")
+            console.print(error_message, markup=False)
+            logging.error(f"ffmpeg exited with code {returncode}:\n" + "\n".join(stderr_tail))
             return None
+        logging.info("Command successful (no progress bar).")
+        return "Success"
     else:
-        # For the progress bar, we must run ffmpeg as a subprocess and parse stderr.
-        duration = 0
-        try:
-            # Find the primary input file from the command arguments to probe it.
-            input_file_path = None
-            for i, arg in enumerate(full_command):
-                if arg == '-i' and i + 1 < len(full_command):
-                    # This is a robust way to find the first input file.
-                    input_file_path = full_command[i+1]
-                    break
-            
+        # For the progress bar, we run ffmpeg as a subprocess and follow its progress output.
+        probe_seconds = None
+        if duration is None:
+            input_file_path = find_input_file(full_command)
             if input_file_path:
-                probe_info = ffmpeg.probe(input_file_path)
-                duration = float(probe_info['format']['duration'])
+                probe_started = time.monotonic()
+                duration = get_duration(input_file_path)
+                probe_seconds = time.monotonic() - probe_started
+                if not duration:
+                    console.print(f"[bold yellow]Warning: Could not determine video duration for progress bar.[/bold yellow]")
             else:
+                duration = 0
                 logging.warning("Could not find input file in command to determine duration for progress bar.")
 
-        except (ffmpeg.Error, KeyError) as e:
-            console.print(f"[bold yellow]Warning: Could not determine video duration for progress bar.[/bold yellow]")
-            logging.warning(f"Could not probe for duration: {e}")
-
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            console=console,
-        ) as progress:
-            task = progress.add_task(description, total=100)
-            
-            # Run the command as a subprocess to capture stderr in real-time
-            process = subprocess.Popen(
-                full_command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                encoding='utf-8'
-            )
+        def on_progress(stats):
+            if stats['percent'] is not None:
+                progress.update(task, completed=stats['percent'], stats=format_progress_stats(stats))
+            else:
+                progress.update(task, stats=format_progress_stats(stats))
 
-            for line in process.stderr:
-                logging.debug(f"ffmpeg stderr: {line.strip()}")
-                if "time=" in line and duration > 0:
-                    try:
-                        time_str = line.split("time=")[1].split(" ")[0].strip()
-                        h, m, s_parts = time_str.split(':')
-                        s = float(s_parts)
-                        elapsed_time = int(h) * 3600 + int(m) * 60 + s
-                        percent_complete = (elapsed_time / duration) * 100
-                        progress.update(task, completed=min(percent_complete, 100))
-                    except Exception:
-                        pass # Ignore any parsing errors
-
-            process.wait()
+        with Progress(*progress_columns(), console=console) as progress:
+            task = progress.add_task(description, total=100, stats="")
+            returncode, stderr_tail = run_ffmpeg_process(
+                full_command, duration=duration, on_progress=on_progress, job=description, probe_seconds=probe_seconds,
+                timeout=timeout, stall_timeout=stall_timeout,
+            )
             progress.update(task, completed=100)
-            
-            if process.returncode != 0:
-                # The error was already logged line-by-line, but we can add a final message.
-                log_file = logging.getLogger().handlers[0].baseFilename
-                console.print(f"[bold red]An error occurred during processing. Check {log_file} for details.[/bold red]")
-                return None
-        
+
+        if returncode != 0:
+            error_message = "\n".join(stderr_tail[-20:])
+            console.print("[bold red]An error occurred during processing:[/bold red]")
+            console.print(error_message, markup=False)
+            logging.error(f"ffmpeg exited with code {returncode}:\n" + "\n".join(stderr_tail))
+            return None
+
         logging.info("Command successful (with progress bar).")
         return "Success"
 
 
+def get_keyframe_times(file_path):
+    """
+    Returns the sorted presentation times (seconds) of the keyframes in the first video stream,
+    relative to the start of the file as `-ss` counts them.
+    Built from packet flags, so nothing is decoded; cached like probe_file.
+    """
+    def build_index():
+        try:
+            offset = float(probe_file(file_path)['format'].get('start_time', 0))
+        except (ffmpeg.Error, KeyError, ValueError):
+            offset = 0
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', file_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+        )
+        times = []
+        for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                times.append(float(pts_time) - offset)
+        return sorted(times)
+
+    return get_cache().cached(file_path, 'keyframes', build_index)
+
+
+H264_IDR_NAL = 5
+
+
+def _h264_nal_types(data):
+    """NAL unit types in an H.264 packet, either Annex B (start codes) or length-prefixed (MP4/MKV)."""
+    if data[:3] == b'\0\0\1' or data[:4] == b'\0\0\0\1':
+        return [data[m.end()] & 0x1f for m in re.finditer(b'\0\0\1', data) if m.end() < len(data)]
+    types = []
+    pos = 0
+    while pos + 4 < len(data):
+        types.append(data[pos + 4] & 0x1f)
+        pos += 4 + int.from_bytes(data[pos:pos + 4], 'big')
+    return types
+
+
+def _parse_hex_dump(text):
+    """Bytes from ffprobe's -show_data dump: an offset, 41 columns of hex, then the ASCII rendering."""
+    data = bytearray()
+    for line in text.splitlines():
+        _, sep, rest = line.partition(': ')
+        if sep:
+            data += bytes.fromhex(rest[:41].replace(' ', ''))
+    return bytes(data)
+
+
+def is_idr_keyframe(file_path, keyframe_time):
+    """
+    True if the first video stream's H.264 keyframe at keyframe_time (from get_keyframe_times)
+    is an IDR frame. Containers flag every random access point as a keyframe, including the
+    non-IDR I-frames of open GOPs, whose following frames may reference pictures before them.
+    """
+    try:
+        offset = float(probe_file(file_path)['format'].get('start_time', 0))
+    except (ffmpeg.Error, KeyError, ValueError):
+        offset = 0
+    # read_intervals takes absolute timestamps; the nudge keeps rounding from seeking to the keyframe before.
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f"{keyframe_time + offset + 0.0005}%+#1",
+         '-show_entries', 'packet=pts_time,flags,data', '-show_data', '-of', 'json', file_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        packet = json.loads(result.stdout or b'{}').get('packets', [])[0]
+        if abs(float(packet['pts_time']) - offset - keyframe_time) > 0.001 or 'K' not in packet.get('flags', ''):
+            return False
+        return H264_IDR_NAL in _h264_nal_types(_parse_hex_dump(packet.get('data', '')))
+    except (ValueError, IndexError, KeyError):
+        return False
+
+
 def has_audio_stream(file_path):
     """Check if the media file has an audio stream."""
     try:
-        probe = ffmpeg.probe(file_path, select_streams='a')
-        return 'streams' in probe and len(probe['streams']) > 0
+        probe = probe_file(file_path)
+        return any(s.get('codec_type') == 'audio' for s in probe.get('streams', []))
     except ffmpeg.Error:
         return False
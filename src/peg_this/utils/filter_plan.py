@@ -0,0 +1,276 @@
+import logging
+from fractions import Fraction
+
+import ffmpeg
+
+from peg_this.utils.ffmpeg_utils import probe_file
+
+FIT_MODES = ('decrease', 'increase')
+
+
+def _number(value):
+    """An int or float for numeric filter arguments (including numeric strings), else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(value):
+    """A frame rate like 15, '29.97' or '30000/1001' as a Fraction, or None."""
+    try:
+        rate = Fraction(str(value))
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def display_size(file_path):
+    """
+    Width and height of the first video stream as ffmpeg outputs it, after applying rotation
+    metadata (a rotate tag or display matrix side data). ffmpeg autorotates frames before the
+    filtergraph, so this, not the coded size, is what filters see.
+    """
+    video = next(s for s in probe_file(file_path)['streams'] if s['codec_type'] == 'video')
+    width, height = int(video['width']), int(video['height'])
+    rotation = video.get('tags', {}).get('rotate')
+    for side_data in video.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    try:
+        if int(float(rotation or 0)) % 180:
+            width, height = height, width
+    except ValueError:
+        pass
+    return width, height
+
+
+def scaled_size(in_w, in_h, w, h, fit=None):
+    """
+    The size ffmpeg's scale filter produces from in_w x in_h, for explicit sizes, -1 (keep the
+    aspect ratio) and -2 (keep it, rounded to an even number), and force_original_aspect_ratio.
+    """
+    if w in (-1, -2) and h in (-1, -2):
+        w, h = in_w, in_h
+    elif w in (-1, -2):
+        w = round(h * in_w / (in_h * -w)) * -w
+    elif h in (-1, -2):
+        h = round(w * in_h / (in_w * -h)) * -h
+    if fit:
+        fit_w, fit_h = round(h * in_w / in_h), round(w * in_h / in_w)
+        if fit == 'decrease':
+            w, h = min(w, fit_w), min(h, fit_h)
+        else:
+            w, h = max(w, fit_w), max(h, fit_h)
+    return max(1, w), max(1, h)
+
+
+class FilterPlan:
+    """
+    Collects crop/scale/fps/pad steps in the order a feature describes them, and emits an
+    equivalent filter chain that does the least work per frame: frames are dropped before
+    anything touches their pixels, and with a known input size every crop, scale and pad
+    collapses into at most one crop (in source pixels), one scale and one pad. Steps that
+    leave the frame unchanged, like scaling a clip to the size it already is, are dropped.
+    """
+
+    def __init__(self, width=None, height=None, frame_rate=None):
+        self.width = width
+        self.height = height
+        self.frame_rate = _rate(frame_rate) if frame_rate else None
+        self.steps = []
+
+    @classmethod
+    def for_file(cls, file_path):
+        """
+        A plan for the first video stream of a file at its displayed (rotation-aware) size,
+        or one without geometry if it can't be probed.
+        """
+        try:
+            video = next(s for s in probe_file(file_path)['streams'] if s['codec_type'] == 'video')
+            width, height = display_size(file_path)
+            return cls(width, height, video.get('avg_frame_rate') or video.get('r_frame_rate'))
+        except (ffmpeg.Error, StopIteration, KeyError, ValueError):
+            return cls()
+
+    def crop(self, w, h, x=None, y=None):
+        """Keep a w x h rectangle at (x, y); centered when x or y is omitted."""
+        self.steps.append(('crop', {'w': w, 'h': h, 'x': x, 'y': y}))
+        return self
+
+    def scale(self, w=-2, h=-2, fit=None, flags=None):
+        """Resize to w x h; -1/-2 keep the aspect ratio, fit='decrease' or 'increase' fits within/around the box."""
+        if fit and fit not in FIT_MODES:
+            raise ValueError(f"Unknown fit mode: {fit}")
+        self.steps.append(('scale', {'w': w, 'h': h, 'fit': fit, 'flags': flags}))
+        return self
+
+    def fps(self, rate):
+        """Convert to a constant frame rate."""
+        self.steps.append(('fps', {'rate': rate}))
+        return self
+
+    def pad(self, w, h, x=None, y=None, color=None):
+        """Place the frame on a w x h canvas at (x, y); centered when x or y is omitted."""
+        self.steps.append(('pad', {'w': w, 'h': h, 'x': x, 'y': y, 'color': color}))
+        return self
+
+    def filters(self):
+        """The planned chain as a list of (filter name, kwargs)."""
+        spatial = [(name, args) for name, args in self.steps if name != 'fps']
+        head, tail = self._plan_fps()
+        body = self._compose(spatial)
+        if body is None:
+            body = self._fuse(spatial)
+        return head + body + tail
+
+    def apply(self, stream):
+        """Apply the planned chain to a video stream."""
+        for name, kwargs in self.filters():
+            stream = stream.filter(name, **kwargs)
+        return stream
+
+    def _plan_fps(self):
+        """
+        fps only drops or repeats whole frames, so it commutes with the spatial steps. Dropping
+        happens first, at the lowest rate any step asks for; repeating (if the last rate is higher
+        than that or than the source) happens last, after the pixels of each frame are final.
+        """
+        rates = [args['rate'] for name, args in self.steps if name == 'fps']
+        if not rates:
+            return [], []
+        parsed = [_rate(r) for r in rates]
+        if None in parsed:
+            # Can't compare the rates, so keep them as given, ahead of the spatial work.
+            return [('fps', {'fps': r}) for r in rates], []
+        lowest, final = min(parsed), parsed[-1]
+        if self.frame_rate is not None and lowest >= self.frame_rate:
+            # Nothing gets dropped. The step still runs, since it also makes variable rate input constant.
+            return [], [('fps', {'fps': str(final)})]
+        head = [('fps', {'fps': str(lowest)})]
+        tail = [('fps', {'fps': str(final)})] if final > lowest else []
+        return head, tail
+
+    def _compose(self, steps):
+        """
+        With a known input size and numeric arguments, fold every step into one source crop,
+        one scale and one pad. Returns None when that isn't possible.
+        """
+        if not steps or not self.width or not self.height:
+            return None if steps else []
+        # The source rectangle shown, the size it is scaled to, and where it sits on the canvas.
+        cx, cy, cw, ch = 0.0, 0.0, float(self.width), float(self.height)
+        sw, sh, px, py = cw, ch, 0.0, 0.0
+        pw, ph = self.width, self.height
+        flags = color = None
+        for name, args in steps:
+            values = {k: _number(v) for k, v in args.items() if k in ('w', 'h', 'x', 'y') and v is not None}
+            if None in values.values():
+                return None
+            if name == 'scale':
+                tw, th = scaled_size(pw, ph, int(values['w']), int(values['h']), args['fit'])
+                fx, fy = tw / pw, th / ph
+                sw, sh, px, py = sw * fx, sh * fy, px * fx, py * fy
+                pw, ph = tw, th
+                flags = args['flags'] or flags
+            elif name == 'crop':
+                w, h = int(values['w']), int(values['h'])
+                x = values.get('x', (pw - w) / 2)
+                y = values.get('y', (ph - h) / 2)
+                if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > pw or y + h > ph:
+                    return None
+                # The part of the image still visible, in canvas and then in source pixels.
+                left, top = max(x, px), max(y, py)
+                right, bottom = min(x + w, px + sw), min(y + h, py + sh)
+                if right <= left or bottom <= top:
+                    return None
+                cx, cy = cx + (left - px) * cw / sw, cy + (top - py) * ch / sh
+                cw, ch = (right - left) * cw / sw, (bottom - top) * ch / sh
+                sw, sh, px, py = right - left, bottom - top, left - x, top - y
+                pw, ph = w, h
+            else:
+                w, h = int(values['w']), int(values['h'])
+                x = values.get('x', (w - pw) / 2)
+                y = values.get('y', (h - ph) / 2)
+                if w < pw or h < ph or x < 0 or y < 0 or x + pw > w or y + ph > h:
+                    return None
+                if color and args['color'] and args['color'] != color:
+                    return None
+                color = args['color'] or color
+                px, py = px + x, py + y
+                pw, ph = w, h
+
+        crop = [round(cx), round(cy), round(cw), round(ch)]
+        crop[2], crop[3] = min(crop[2], self.width - crop[0]), min(crop[3], self.height - crop[1])
+        size = [min(round(sw), pw), min(round(sh), ph)]
+        offset = [min(max(round(px), 0), pw - size[0]), min(max(round(py), 0), ph - size[1])]
+
+        filters = []
+        if crop != [0, 0, self.width, self.height]:
+            filters.append(('crop', {'w': crop[2], 'h': crop[3], 'x': crop[0], 'y': crop[1]}))
+        if size != crop[2:]:
+            kwargs = {'w': size[0], 'h': size[1]}
+            if flags:
+                kwargs['flags'] = flags
+            filters.append(('scale', kwargs))
+        if [pw, ph] != size:
+            kwargs = {'w': pw, 'h': ph, 'x': offset[0], 'y': offset[1]}
+            if color:
+                kwargs['color'] = color
+            filters.append(('pad', kwargs))
+        logging.debug(f"Filter plan for {self.width}x{self.height}: {filters}")
+        return filters
+
+    def _fuse(self, steps):
+        """
+        Without a known input size, keep the order but drop any scale that a following scale
+        to an absolute size overrides anyway.
+        """
+        filters = []
+        for name, args in steps:
+            if name == 'scale':
+                w, h = _number(args['w']), _number(args['h'])
+                absolute = w is not None and h is not None and w > 0 and h > 0 and not args['fit']
+                if absolute and filters and filters[-1][0] == 'scale':
+                    previous = filters.pop()[1]
+                    args = {**args, 'flags': args['flags'] or previous.get('flags')}
+                kwargs = {'w': args['w'], 'h': args['h']}
+                if args['fit']:
+                    kwargs['force_original_aspect_ratio'] = args['fit']
+                if args['flags']:
+                    kwargs['flags'] = args['flags']
+                filters.append(('scale', kwargs))
+            elif name == 'crop':
+                kwargs = {'w': args['w'], 'h': args['h']}
+                kwargs['x'] = args['x'] if args['x'] is not None else '(in_w-out_w)/2'
+                kwargs['y'] = args['y'] if args['y'] is not None else '(in_h-out_h)/2'
+                filters.append(('crop', kwargs))
+            else:
+                kwargs = {'w': args['w'], 'h': args['h']}
+                kwargs['x'] = args['x'] if args['x'] is not None else '(ow-iw)/2'
+                kwargs['y'] = args['y'] if args['y'] is not None else '(oh-ih)/2'
+                if args['color']:
+                    kwargs['color'] = args['color']
+                filters.append(('pad', kwargs))
+        return filters
+
+
+def parse_size(text):
+    """A target size like '1280x720', '1280' (width, keep aspect) or 'x720' (height) as (w, h)."""
+    text = str(text).strip().lower()
+    width, sep, height = text.partition('x')
+    try:
+        w = int(width) if width else -2
+        h = int(height) if sep and height else -2
+    except ValueError:
+        raise ValueError(f"Invalid size '{text}', expected WIDTHxHEIGHT, WIDTH or xHEIGHT.")
+    if (w, h) == (-2, -2) or w == 0 or h == 0 or w < -2 or h < -2:
+        raise ValueError(f"Invalid size '{text}', expected WIDTHxHEIGHT, WIDTH or xHEIGHT.")
+    return w, h
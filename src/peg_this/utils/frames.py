@@ -0,0 +1,77 @@
+import logging
+
+import ffmpeg
+
+from peg_this.utils.ffmpeg_utils import get_duration, iter_ffmpeg_stdout
+from peg_this.utils.filter_plan import FilterPlan, scaled_size, display_size
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Inputs opened by one ffmpeg process; longer lists of timestamps are grabbed in batches.
+MAX_FRAMES_PER_PROCESS = 32
+# Seeking this close to the end can land after the last frame, so timestamps are pulled back.
+END_MARGIN_SECONDS = 0.1
+
+
+def _clamp(timestamps, duration):
+    if not duration:
+        return [max(0.0, float(t)) for t in timestamps]
+    last = max(0.0, duration - END_MARGIN_SECONDS)
+    return [min(max(0.0, float(t)), last) for t in timestamps]
+
+
+def iter_frames(file_path, timestamps, width=-2, height=-2):
+    """
+    Decode one frame at each timestamp (seconds) and yield (timestamp, width, height, rgb24 data).
+    The data is a memoryview that is reused for the next frame: copy it to keep it.
+    Every timestamp is its own input with an input-side `-ss`, so ffmpeg seeks to the nearest
+    keyframe and decodes only up to the requested frame, and all of them share one process.
+    Frames are scaled to width x height (-2 keeps the aspect ratio) and piped out as rawvideo,
+    so nothing is written to disk. Timestamps past the end (by the cached duration) are clamped.
+    Raises ffmpeg.Error if ffmpeg fails.
+    """
+    timestamps = list(timestamps)
+    if not timestamps:
+        return
+    source_w, source_h = display_size(file_path)
+    out_w, out_h = scaled_size(source_w, source_h, width, height)
+    frame_bytes = out_w * out_h * 3
+    seek_times = _clamp(timestamps, get_duration(file_path))
+
+    for start in range(0, len(timestamps), MAX_FRAMES_PER_PROCESS):
+        batch = seek_times[start:start + MAX_FRAMES_PER_PROCESS]
+        clips = [ffmpeg.input(file_path, ss=t).video.filter('trim', end_frame=1) for t in batch]
+        video = clips[0] if len(clips) == 1 else ffmpeg.concat(*clips, v=1, a=0)
+        # An explicit size, so every frame is exactly frame_bytes long whatever the source's metadata says.
+        video = FilterPlan().scale(out_w, out_h).apply(video)
+        stream = video.output('pipe:', format='rawvideo', pix_fmt='rgb24', vsync='passthrough',
+                              **{'frames:v': len(batch)})
+        full_command = ['ffmpeg'] + stream.get_args()
+        logging.info(f"Grabbing {len(batch)} frame(s): {' '.join(full_command)}")
+
+        count = 0
+        for chunk in iter_ffmpeg_stdout(full_command, chunk_size=frame_bytes, job="Frame grab"):
+            if len(chunk) < frame_bytes:
+                break
+            yield timestamps[start + count], out_w, out_h, chunk
+            count += 1
+        if count < len(batch):
+            logging.warning(f"Got {count} of {len(batch)} frames from {file_path}.")
+
+
+def grab_frames(file_path, timestamps, width=-2, height=-2):
+    """Frames at several timestamps as Pillow images, in one ffmpeg process (see iter_frames)."""
+    if Image is None:
+        raise RuntimeError("Pillow is required to grab frames: pip install Pillow")
+    return [Image.frombytes('RGB', (w, h), data) for _, w, h, data in iter_frames(file_path, timestamps, width, height)]
+
+
+def grab_frame(file_path, timestamp=None, width=-2, height=-2):
+    """One frame as a Pillow image; from the middle of the file when no timestamp is given. None if none was decoded."""
+    if timestamp is None:
+        timestamp = get_duration(file_path) / 2
+    frames = grab_frames(file_path, [timestamp], width, height)
+    return frames[0] if frames else None
@@ -0,0 +1,89 @@
+import json
+import logging
+
+import ffmpeg
+
+from peg_this.utils.ffmpeg_utils import run_ffmpeg_process, probe_file
+from peg_this.utils.probe_cache import get_cache
+
+# Integrated loudness (LUFS), true peak (dBTP) and loudness range (LU) for each target.
+LOUDNESS_TARGETS = {
+    "ebu": {'I': -23, 'TP': -1, 'LRA': 7},
+    "podcast": {'I': -16, 'TP': -1.5, 'LRA': 11},
+    "streaming": {'I': -14, 'TP': -1, 'LRA': 11},
+}
+# Menu labels for the targets, plus the option to leave levels alone.
+LOUDNESS_CHOICES = {
+    "Keep original levels": None,
+    "EBU R128 broadcast (-23 LUFS)": "ebu",
+    "Podcast / speech (-16 LUFS)": "podcast",
+    "Music streaming (-14 LUFS)": "streaming",
+}
+MEASURED_KEYS = ('input_i', 'input_tp', 'input_lra', 'input_thresh')
+
+
+def _parse_loudnorm_json(lines):
+    """The JSON block loudnorm prints at the end of its log, or None."""
+    text = "\n".join(lines)
+    start, end = text.rfind('{'), text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+def measure_loudness(file_path):
+    """
+    Measure the first audio stream's loudness with loudnorm's analysis pass. Only the audio is
+    decoded. Results are cached per file next to its probe data (kind 'loudness'), so any number
+    of exports from the same source measure it once. Returns a dict of MEASURED_KEYS as strings.
+    Raises ValueError if the measurement fails.
+    """
+    def measure():
+        stream = (
+            ffmpeg.input(file_path)['a:0']
+            .filter('loudnorm', print_format='json')
+            .output('-', f='null', vn=None, sn=None, dn=None)
+        )
+        returncode, stderr_tail = run_ffmpeg_process(['ffmpeg'] + stream.get_args(), job="Loudness analysis")
+        measured = _parse_loudnorm_json(stderr_tail)
+        if returncode != 0 or not measured or not all(key in measured for key in MEASURED_KEYS):
+            raise ValueError(stderr_tail[-1] if stderr_tail else "Loudness analysis failed.")
+        logging.info(f"Measured loudness of {file_path}: {measured}")
+        return {key: measured[key] for key in MEASURED_KEYS}
+
+    return get_cache().cached(file_path, 'loudness', measure)
+
+
+def _sample_rate(file_path):
+    try:
+        audio = next(s for s in probe_file(file_path)['streams'] if s['codec_type'] == 'audio')
+        return int(audio['sample_rate'])
+    except (ffmpeg.Error, StopIteration, KeyError, ValueError):
+        return 48000
+
+
+def normalize_audio(audio, file_path, target="ebu"):
+    """
+    Apply loudness normalization to an audio stream in a single encode pass, using the cached
+    measurement. loudnorm runs in linear mode, so the whole file gets one gain change and its
+    dynamics are kept. Returns (audio stream, extra output kwargs). Silent audio is left as is.
+    """
+    if target not in LOUDNESS_TARGETS:
+        raise ValueError(f"Unknown loudness target: {target}")
+    measured = measure_loudness(file_path)
+    if measured['input_i'] in ('-inf', 'inf'):
+        logging.info(f"{file_path} is silent; skipping loudness normalization.")
+        return audio, {}
+    settings = LOUDNESS_TARGETS[target]
+    audio = audio.filter(
+        'loudnorm',
+        I=settings['I'], TP=settings['TP'], LRA=settings['LRA'],
+        measured_I=measured['input_i'], measured_TP=measured['input_tp'],
+        measured_LRA=measured['input_lra'], measured_thresh=measured['input_thresh'],
+        linear='true',
+    )
+    # loudnorm works at 192 kHz internally; write the source's rate back out.
+    return audio, {'ar': _sample_rate(file_path)}
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from peg_this.utils.probe_cache import default_cache_dir
+
+PARTIAL_MARKER = ".partial"
+CHECKSUM_CHUNK = 1024 * 1024
+
+
+def partial_name(output_file):
+    """
+    Temporary name an output is written under until it is complete, e.g. 'dir/.clip.partial.mp4'.
+    The real extension is kept so ffmpeg still picks the right muxer.
+    """
+    directory, name = os.path.split(output_file)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{stem}{PARTIAL_MARKER}{ext}")
+
+
+def is_partial(file_path):
+    """True for a temporary output left behind by an unfinished run."""
+    name = os.path.basename(file_path)
+    return name.startswith('.') and PARTIAL_MARKER in name
+
+
+def file_checksum(file_path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat(file_path):
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime_ns
+
+
+class BatchManifest:
+    """
+    Persistent record of finished batch outputs: which source (by size and mtime) and which
+    settings produced each output, and the output's own size, mtime and checksum.
+    An output is up to date when all of these still match, so re-runs only redo what changed.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(default_cache_dir(), 'batch_manifest.sqlite3')
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+
+    def _connect(self):
+        if self._db is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS outputs ("
+                    "output TEXT PRIMARY KEY, source TEXT, source_size INTEGER, source_mtime_ns INTEGER, "
+                    "settings TEXT, output_size INTEGER, output_mtime_ns INTEGER, checksum TEXT, finished REAL)"
+                )
+                self._db.commit()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Batch manifest unavailable ({self.db_path}); every file will be converted: {e}")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def is_output(self, file_path):
+        """True if file_path was written by an earlier batch run (so it shouldn't be converted again)."""
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return False
+            try:
+                row = db.execute("SELECT 1 FROM outputs WHERE output = ?", (os.path.realpath(file_path),)).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Batch manifest read failed: {e}")
+                return False
+        return row is not None
+
+    def is_up_to_date(self, source_file, output_file, settings, verify=False):
+        """True if output_file was produced from this exact source with these settings and hasn't changed since."""
+        output_file = os.path.realpath(output_file)
+        try:
+            source_stat = _stat(source_file)
+            output_stat = _stat(output_file)
+        except OSError:
+            return False
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return False
+            try:
+                row = db.execute(
+                    "SELECT source, source_size, source_mtime_ns, settings, output_size, output_mtime_ns, checksum "
+                    "FROM outputs WHERE output = ?", (output_file,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Batch manifest read failed: {e}")
+                return False
+        if row is None:
+            return False
+        source, source_size, source_mtime_ns, saved_settings, output_size, output_mtime_ns, checksum = row
+        if (source, source_size, source_mtime_ns) != (os.path.realpath(source_file), *source_stat):
+            return False
+        if saved_settings != json.dumps(settings, sort_keys=True):
+            return False
+        if (output_size, output_mtime_ns) != output_stat:
+            return False
+        return not verify or file_checksum(output_file) == checksum
+
+    def record(self, source_file, output_file, settings):
+        """Remember that output_file is a finished conversion of source_file with these settings."""
+        output_file = os.path.realpath(output_file)
+        source_size, source_mtime_ns = _stat(source_file)
+        output_size, output_mtime_ns = _stat(output_file)
+        checksum = file_checksum(output_file)
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (output_file, os.path.realpath(source_file), source_size, source_mtime_ns,
+                     json.dumps(settings, sort_keys=True), output_size, output_mtime_ns, checksum, time.time())
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Batch manifest write failed: {e}")
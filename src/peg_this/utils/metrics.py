@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# One id per process, so records from the same run (and its workers) can be grouped.
+RUN_ID = uuid.uuid4().hex[:12]
+
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+
+_lock = threading.Lock()
+
+
+def state_dir():
+    """Per-user directory for logs and metrics, overridable with PEG_THIS_STATE_DIR."""
+    if os.environ.get('PEG_THIS_STATE_DIR'):
+        return os.environ['PEG_THIS_STATE_DIR']
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == "darwin":
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(base, 'peg_this')
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Log to a rotating file in the state directory, appending across runs.
+    Falls back to the temp directory if the state directory can't be written,
+    and to no log file at all if neither can. Returns the log file path or None.
+    """
+    for directory in (state_dir(), os.path.join(tempfile.gettempdir(), 'peg_this')):
+        path = os.path.join(directory, 'peg_this.log')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+        except OSError:
+            continue
+        handler.setFormatter(logging.Formatter(f'%(asctime)s - {RUN_ID} - %(levelname)s - %(message)s'))
+        logging.basicConfig(level=level, handlers=[handler])
+        return path
+    logging.basicConfig(level=level, handlers=[logging.NullHandler()])
+    return None
+
+
+def metrics_path():
+    """JSON Lines file job records are appended to; PEG_THIS_METRICS overrides it, 'off' disables it."""
+    return os.environ.get('PEG_THIS_METRICS') or os.path.join(state_dir(), 'metrics.jsonl')
+
+
+def prometheus_path():
+    """Optional Prometheus textfile (for node_exporter's textfile collector), set with PEG_THIS_PROM_FILE."""
+    return os.environ.get('PEG_THIS_PROM_FILE')
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path) if path else None
+    except OSError:
+        return None
+
+
+def _output_file(full_command):
+    last = full_command[-1] if full_command else None
+    return last if last and not last.startswith('-') and last not in ('pipe:', 'pipe:1') else None
+
+
+def record_job(full_command, returncode, wall_seconds, input_file=None, media_duration=None, probe_seconds=None,
+               job=None, final_stats=None, error=None):
+    """
+    Append one structured record for a finished ffmpeg process to the metrics file, and
+    update the Prometheus textfile if one is configured. Never raises: metrics must not
+    break the job they describe.
+    """
+    output_file = _output_file(full_command)
+    speed = None
+    if returncode == 0 and media_duration and wall_seconds:
+        speed = round(media_duration / wall_seconds, 3)
+    record = {
+        'ts': time.time(),
+        'run_id': RUN_ID,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'job': job,
+        'command': full_command,
+        'input': input_file,
+        'input_bytes': _file_size(input_file),
+        'output': output_file,
+        'output_bytes': _file_size(output_file) if returncode == 0 else None,
+        'media_seconds': media_duration or None,
+        'probe_seconds': round(probe_seconds, 4) if probe_seconds is not None else None,
+        'wall_seconds': round(wall_seconds, 4),
+        'speed_factor': speed,
+        'exit_code': returncode,
+        'frames': (final_stats or {}).get('frame'),
+        'error': error,
+    }
+    try:
+        path = metrics_path()
+        if path != 'off':
+            line = json.dumps(record) + "\n"
+            with _lock:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        if prometheus_path():
+            _update_prometheus(record)
+    except OSError as e:
+        logging.warning(f"Could not write job metrics: {e}")
+    return record
+
+
+# Counters kept in the Prometheus textfile: name -> (help text, record field or None for a count).
+PROM_COUNTERS = {
+    'peg_this_jobs_total': ("ffmpeg processes finished, by status.", None),
+    'peg_this_wall_seconds_total': ("Wall-clock seconds spent in ffmpeg.", 'wall_seconds'),
+    'peg_this_media_seconds_total': ("Seconds of media processed.", 'media_seconds'),
+    'peg_this_probe_seconds_total': ("Seconds spent probing inputs.", 'probe_seconds'),
+    'peg_this_input_bytes_total': ("Bytes of input read.", 'input_bytes'),
+    'peg_this_output_bytes_total': ("Bytes of output written.", 'output_bytes'),
+}
+
+
+def _read_prometheus(path):
+    """Counter values from a textfile written by _update_prometheus, so totals carry over between runs."""
+    totals = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                key, _, value = line.rstrip().rpartition(' ')
+                try:
+                    totals[key] = float(value)
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return totals
+
+
+def _format_value(value):
+    # Byte counters outgrow %g's six significant digits quickly.
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+@contextmanager
+def _textfile_lock(path):
+    """
+    Hold an exclusive lock on a sidecar file next to `path` while it is read, updated and
+    rewritten, so concurrent runs (or hosts sharing the directory) never lose each other's counts.
+    Without fcntl (Windows) the update is unlocked.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_prometheus(record):
+    path = prometheus_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with _lock, _textfile_lock(path):
+        # Re-read on every update: other processes may have added to the counters since.
+        totals = _read_prometheus(path)
+        status = "ok" if record['exit_code'] == 0 else "failed"
+        key = f'peg_this_jobs_total{{status="{status}"}}'
+        totals[key] = totals.get(key, 0) + 1
+        for name, (_, field) in PROM_COUNTERS.items():
+            if field and record.get(field):
+                totals[name] = totals.get(name, 0) + record[field]
+        if record['speed_factor']:
+            totals['peg_this_last_speed_factor'] = record['speed_factor']
+        totals['peg_this_last_job_timestamp_seconds'] = record['ts']
+
+        lines = []
+        for name, (help_text, _) in PROM_COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{key} {_format_value(value)}" for key, value in sorted(totals.items())
+                         if key == name or key.startswith(name + '{'))
+        lines.append("# HELP peg_this_last_speed_factor Media seconds per wall second of the last job.")
+        lines.append("# TYPE peg_this_last_speed_factor gauge")
+        lines.append(f"peg_this_last_speed_factor {_format_value(totals.get('peg_this_last_speed_factor', 0))}")
+        lines.append("# HELP peg_this_last_job_timestamp_seconds When the last job finished.")
+        lines.append("# TYPE peg_this_last_job_timestamp_seconds gauge")
+        lines.append(f"peg_this_last_job_timestamp_seconds {totals['peg_this_last_job_timestamp_seconds']:.3f}")
+
+        # Write then rename, so the collector never reads a half-written file.
+        fd, temp_path = tempfile.mkstemp(prefix='.peg_this_prom_', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
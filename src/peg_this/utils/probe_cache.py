@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Entries kept in memory for this process and on disk across runs.
+MEMORY_ENTRIES = 512
+DISK_ENTRIES = 5000
+
+
+def default_cache_dir():
+    """Per-user cache directory for peg_this, overridable with PEG_THIS_CACHE_DIR."""
+    if os.environ.get('PEG_THIS_CACHE_DIR'):
+        return os.environ['PEG_THIS_CACHE_DIR']
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == "darwin":
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'peg_this')
+
+
+def file_key(file_path):
+    """Cache key for a file: its resolved path plus size and mtime, so edits invalidate the entry."""
+    resolved = os.path.realpath(file_path)
+    st = os.stat(resolved)
+    return f"{resolved}|{st.st_size}|{st.st_mtime_ns}"
+
+
+class ProbeCache:
+    """
+    Two-level LRU cache for per-file analysis results (ffprobe output and the like).
+    Lookups hit an in-memory OrderedDict first, then a SQLite table that survives restarts.
+    If the database can't be opened the cache quietly degrades to memory only.
+    """
+
+    def __init__(self, db_path=None, memory_entries=MEMORY_ENTRIES, disk_entries=DISK_ENTRIES):
+        self.db_path = db_path or os.path.join(default_cache_dir(), 'probe_cache.sqlite3')
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+
+    def _connect(self):
+        if self._db is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "kind TEXT, key TEXT, data TEXT, last_used REAL, PRIMARY KEY (kind, key))"
+                )
+                self._db.commit()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Probe cache disabled on disk ({self.db_path}): {e}")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def get(self, kind, key):
+        with self._lock:
+            if (kind, key) in self._memory:
+                self._memory.move_to_end((kind, key))
+                return self._memory[(kind, key)]
+
+            db = self._connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute("SELECT data FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE entries SET last_used = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+                db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Probe cache read failed: {e}")
+                return None
+            value = json.loads(row[0])
+            self._remember(kind, key, value)
+            return value
+
+    def put(self, kind, key, value):
+        with self._lock:
+            self._remember(kind, key, value)
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries (kind, key, data, last_used) VALUES (?, ?, ?, ?)",
+                    (kind, key, json.dumps(value), time.time())
+                )
+                # Evict the least recently used rows beyond the size limit.
+                db.execute(
+                    "DELETE FROM entries WHERE rowid IN ("
+                    "SELECT rowid FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_entries,)
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Probe cache write failed: {e}")
+
+    def _remember(self, kind, key, value):
+        self._memory[(kind, key)] = value
+        self._memory.move_to_end((kind, key))
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def cached(self, file_path, kind, compute):
+        """Return the cached `kind` result for file_path, running `compute()` once on a miss."""
+        try:
+            key = file_key(file_path)
+        except OSError:
+            # Not a local file (URL, device, pipe...); nothing stable to key on.
+            return compute()
+        value = self.get(kind, key)
+        if value is None:
+            value = compute()
+            self.put(kind, key, value)
+        return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide ProbeCache instance."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProbeCache()
+        return _cache
@@ -0,0 +1,104 @@
+import os
+import logging
+from fnmatch import fnmatch
+
+MEDIA_EXTENSIONS = [".mkv", ".mp4", ".avi", ".mov", ".webm", ".flv", ".wmv", ".mp3", ".flac", ".wav", ".ogg", ".gif"]
+VIDEO_EXTENSIONS = [".mp4", ".mkv", ".mov", ".avi", ".webm"]
+
+# (offset, magic bytes) for the containers peg_this handles, used when sniffing file contents.
+MEDIA_SIGNATURES = [
+    (4, b"ftyp"),                      # MP4 / MOV / M4A
+    (0, b"\x1a\x45\xdf\xa3"),          # Matroska / WebM (EBML)
+    (8, b"AVI "),                      # AVI (RIFF)
+    (8, b"WAVE"),                      # WAV (RIFF)
+    (0, b"ID3"),                       # MP3 with an ID3 tag
+    (0, b"\xff\xfb"), (0, b"\xff\xf3"), (0, b"\xff\xf2"),  # bare MP3 frames
+    (0, b"fLaC"),
+    (0, b"OggS"),
+    (0, b"GIF8"),
+    (0, b"FLV"),
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"),  # ASF / WMV
+]
+SNIFF_BYTES = 16
+
+
+def sniff_media(file_path):
+    """True if the first bytes of the file look like one of the supported media containers."""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(SNIFF_BYTES)
+    except OSError:
+        return False
+    return any(header[offset:offset + len(magic)] == magic for offset, magic in MEDIA_SIGNATURES)
+
+
+def _matches(rel_path, name, patterns):
+    return any(fnmatch(rel_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def is_scanned_media(file_path, root='.', include=None, exclude=None, extensions=MEDIA_EXTENSIONS, sniff=False):
+    """True if scan_media(root, ...) would yield file_path; for checking single files, e.g. from a folder watcher."""
+    rel_path = os.path.relpath(file_path, root).replace(os.sep, '/')
+    parts = rel_path.split('/')
+    if exclude and any(_matches('/'.join(parts[:i + 1]), part, exclude) for i, part in enumerate(parts)):
+        return False
+    if include and not _matches(rel_path, parts[-1], include):
+        return False
+    if not os.path.isfile(file_path):
+        return False
+    extensions = {e.lower() for e in extensions}
+    return os.path.splitext(file_path)[1].lower() in extensions or (sniff and sniff_media(file_path))
+
+
+def scan_media(root='.', recursive=True, include=None, exclude=None, extensions=MEDIA_EXTENSIONS, sniff=False,
+               follow_symlinks=False):
+    """
+    Yield media files under `root` as they are found, walking with os.scandir.
+    - include / exclude: glob patterns matched against the path relative to root
+      (with '/' separators) or the bare name. Excluded directories are not entered.
+    - extensions: files with these suffixes count as media.
+    - sniff: also accept files with other (or no) extensions whose header looks like media.
+    The walk is depth-first with one open directory iterator per level, so memory stays
+    bounded by the tree's depth rather than its size. Unreadable directories are skipped.
+    """
+    include = include or []
+    exclude = exclude or []
+    extensions = {e.lower() for e in extensions}
+    stack = []
+
+    def open_dir(path, rel):
+        try:
+            stack.append((os.scandir(path), rel))
+        except OSError as e:
+            logging.warning(f"Skipping unreadable directory {path}: {e}")
+
+    open_dir(root, "")
+    while stack:
+        iterator, rel_dir = stack[-1]
+        try:
+            entry = next(iterator, None)
+        except OSError as e:
+            logging.warning(f"Stopped reading {rel_dir or root}: {e}")
+            entry = None
+        if entry is None:
+            iterator.close()
+            stack.pop()
+            continue
+
+        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+        if exclude and _matches(rel_path, entry.name, exclude):
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                if recursive:
+                    open_dir(entry.path, rel_path)
+                continue
+            if not entry.is_file():
+                continue
+        except OSError:
+            continue
+
+        if include and not _matches(rel_path, entry.name, include):
+            continue
+        if os.path.splitext(entry.name)[1].lower() in extensions or (sniff and sniff_media(entry.path)):
+            yield os.path.normpath(entry.path)
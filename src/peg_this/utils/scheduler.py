@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+
+from rich.console import Console
+from rich.progress import Progress, TimeElapsedColumn
+
+from peg_this.utils.encoder_profile import x264_tuning
+from peg_this.utils.ffmpeg_utils import run_ffmpeg_async, get_duration, progress_columns, format_progress_stats
+
+console = Console()
+
+# x264 stops scaling linearly somewhere around this many threads per encode,
+# so on big machines it's faster to run more encodes side by side.
+DEFAULT_THREADS_PER_JOB = 4
+
+
+def default_worker_count(threads_per_job=None):
+    """
+    Number of ffmpeg processes to run at once, given how many threads each one uses.
+    Defaults to the thread count from the host's encoder calibration, or DEFAULT_THREADS_PER_JOB.
+    """
+    threads_per_job = threads_per_job or x264_tuning().get('threads', DEFAULT_THREADS_PER_JOB)
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, threads_per_job))
+
+
+def threads_per_worker(worker_count):
+    """Split the CPUs evenly between `worker_count` concurrent encodes."""
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, worker_count))
+
+
+class Job:
+    """
+    One unit of work for the scheduler: ffmpeg commands that run in order for a single file.
+    With `temp_file`, the commands write there and it is renamed to output_file only once
+    they have all succeeded, so an interrupted job never leaves a truncated output_file.
+    `on_success(job)` runs after that, on the scheduler's event loop.
+    """
+
+    def __init__(self, name, stream_specs, source_file=None, output_file=None, cleanup_files=(), duration=None,
+                 temp_file=None, on_success=None):
+        self.name = name
+        self.stream_specs = list(stream_specs)
+        self.source_file = source_file
+        self.output_file = output_file
+        self.cleanup_files = list(cleanup_files)
+        self.duration = duration
+        self.temp_file = temp_file
+        self.on_success = on_success
+        self.started = False
+        self.success = False
+        self.error = None
+
+
+class JobScheduler:
+    """
+    Runs Jobs on a single asyncio event loop, supervising at most `max_workers` ffmpeg
+    processes at once. `timeout` and `stall_timeout` (seconds) apply to every ffmpeg
+    process; see run_ffmpeg_async. `stopping` is set when a run is cancelled, so a job
+    source that blocks while it waits for work (see watch.py) knows to give up.
+    """
+
+    def __init__(self, max_workers, timeout=None, stall_timeout=None):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.stopping = threading.Event()
+        self._total = 0
+        self._finished = 0
+        self._running = {}
+
+    async def _run_job(self, job, progress, overall_task):
+        job.started = True
+        task = progress.add_task(job.name, total=100 * len(job.stream_specs), stats="")
+        loop = asyncio.get_running_loop()
+        try:
+            duration = job.duration
+            probe_seconds = None
+            if duration is None:
+                probe_started = time.monotonic()
+                # ffprobe blocks, so it runs off the loop while other jobs keep encoding.
+                duration = await loop.run_in_executor(None, get_duration, job.source_file) if job.source_file else 0
+                probe_seconds = time.monotonic() - probe_started
+
+            for step, stream_spec in enumerate(job.stream_specs):
+                full_command = ['ffmpeg'] + stream_spec.get_args()
+                logging.info(f"[{job.name}] Executing command: {' '.join(full_command)}")
+
+                base = 100 * step
+                def on_progress(stats):
+                    if stats['percent'] is not None:
+                        progress.update(task, completed=base + stats['percent'], stats=format_progress_stats(stats))
+                    else:
+                        progress.update(task, stats=format_progress_stats(stats))
+
+                returncode, stderr_tail = await run_ffmpeg_async(
+                    full_command,
+                    duration=duration,
+                    on_progress=on_progress,
+                    job=job.name,
+                    probe_seconds=probe_seconds if step == 0 else None,
+                    timeout=self.timeout,
+                    stall_timeout=self.stall_timeout,
+                )
+                if returncode != 0:
+                    job.error = stderr_tail[-1] if stderr_tail else f"ffmpeg exited with code {returncode}"
+                    logging.error(f"[{job.name}] ffmpeg exited with code {returncode}:\n" + "\n".join(stderr_tail))
+                    return job
+                progress.update(task, completed=base + 100)
+
+            if job.temp_file:
+                os.replace(job.temp_file, job.output_file)
+            if job.on_success:
+                job.on_success(job)
+            job.success = True
+            return job
+        finally:
+            progress.remove_task(task)
+            self._finished += 1
+            progress.update(overall_task, advance=1, stats=f"{self._finished}/{self._total} done")
+            for path in job.cleanup_files + ([job.temp_file] if job.temp_file else []):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    async def _supervise(self, job, progress, overall_task, slots):
+        try:
+            await self._run_job(job, progress, overall_task)
+        except Exception as e:
+            job.error = str(e)
+            logging.error(f"[{job.name}] Unexpected error: {e}")
+        finally:
+            slots.release()
+
+    async def _run_all(self, jobs_iter, seen, progress, overall_task):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_workers)
+        running = self._running
+        try:
+            while True:
+                # Backpressure: the next job is only pulled once a worker slot is free. Pulling may
+                # scan the disk or checksum files, so it runs off the loop too.
+                await slots.acquire()
+                # Forget finished jobs so an endless job source doesn't keep every one of them alive.
+                for future in [future for future in running if future.done()]:
+                    del running[future]
+                job = await loop.run_in_executor(None, next, jobs_iter, None)
+                if job is None:
+                    slots.release()
+                    progress.update(overall_task, total=self._total)
+                    break
+                seen.append(job)
+                self._total += 1
+                running[asyncio.ensure_future(self._supervise(job, progress, overall_task, slots))] = job
+            await asyncio.gather(*running)
+        except asyncio.CancelledError:
+            # asyncio.run waits for the executor thread that is pulling the next job.
+            self.stopping.set()
+            raise
+
+    def run(self, jobs, description="Processing...", seen=None):
+        """
+        Runs all jobs, at most `max_workers` at a time, behind a single aggregate progress display.
+        `jobs` may be a lazy iterable: it is consumed only as workers free up, so encoding starts
+        while the caller is still finding files. Returns the jobs that were run, collected in
+        `seen` (a new list by default; pass e.g. a bounded deque for a job source that never ends).
+        On Ctrl-C every running ffmpeg child is killed, pending jobs are dropped,
+        partial outputs are removed and KeyboardInterrupt is re-raised.
+        """
+        jobs_iter = iter(jobs)
+        seen = [] if seen is None else seen
+        self._total = 0
+        self._finished = 0
+        self._running = {}
+        self.stopping.clear()
+        with Progress(*progress_columns(), TimeElapsedColumn(), console=console) as progress:
+            overall_task = progress.add_task(f"[bold]{description}[/bold]", total=None, stats="0 done")
+            try:
+                asyncio.run(self._run_all(jobs_iter, seen, progress, overall_task))
+            except KeyboardInterrupt:
+                # asyncio.run has cancelled every job by now, and each one killed its ffmpeg.
+                # `seen` may have been trimmed, so the jobs that were still running are checked too.
+                for job in {id(job): job for job in [*seen, *self._running.values()]}.values():
+                    # Only remove outputs this run was writing; never touch files from earlier runs.
+                    partial = job.temp_file or job.output_file
+                    if job.started and not job.success and partial and os.path.exists(partial):
+                        os.remove(partial)
+                logging.info("Batch cancelled by user; killed running ffmpeg processes.")
+                raise
+        return seen
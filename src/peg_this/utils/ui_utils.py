@@ -1,10 +1,11 @@
 
 import os
-from pathlib import Path
 
 import questionary
 from rich.console import Console
 
+from peg_this.utils.scanner import MEDIA_EXTENSIONS, scan_media
+
 try:
     import tkinter as tk
     from tkinter import filedialog
@@ -16,9 +17,7 @@ console = Console()
 
 def get_media_files():
     """Scan the current directory for media files."""
-    media_extensions = [".mkv", ".mp4", ".avi", ".mov", ".webm", ".flv", ".wmv", ".mp3", ".flac", ".wav", ".ogg", ".gif"]
-    files = [f for f in os.listdir('.') if os.path.isfile(f) and Path(f).suffix.lower() in media_extensions]
-    return files
+    return list(scan_media('.', recursive=False))
 
 
 def select_media_file():
@@ -31,7 +30,7 @@ def select_media_file():
             root.withdraw()
             file_path = filedialog.askopenfilename(
                 title="Select a media file",
-                filetypes=[("Media Files", "*.mkv *.mp4 *.avi *.mov *.webm *.flv *.wmv *.mp3 *.flac *.wav *.ogg *.gif"), ("All Files", "*.*")]
+                filetypes=[("Media Files", " ".join(f"*{ext}" for ext in MEDIA_EXTENSIONS)), ("All Files", "*.*")]
             )
             return file_path if file_path else None
         return None